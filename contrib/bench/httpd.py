@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Compares the number of requests per second served by the Django
+WSGI handler, and by the fast path of the branch HTTP server
+(:class:`cyme.branch.httpd.FastRouter`).
+
+The WSGI applications are called directly, so the numbers do not
+include the cost of the HTTP server itself::
+
+    $ python contrib/bench/httpd.py [requests]
+
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+
+from StringIO import StringIO
+from time import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cyme.settings')
+
+from django.conf import settings
+settings.CELERY_RESULT_BACKEND = 'cache'
+settings.CELERY_CACHE_BACKEND = 'locmem://'
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import AdminMediaHandler
+
+from cyme.branch.httpd import FastRouter
+
+PATHS = ['/ping/', '/cyme/query/6ce8b3c0-6f15-4a6f-a4c1-1b0ff6cfd40f/state/']
+
+
+def environ(path):
+    return {'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '8000',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.input': StringIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http'}
+
+
+def bench(app, path, n):
+    status = []
+
+    def start_response(s, headers):
+        status.append(s)
+
+    time_start = time()
+    for i in xrange(n):
+        response = app(environ(path), start_response)
+        ''.join(response)
+        response.close()
+    elapsed = time() - time_start
+    assert status[-1].startswith('200'), status[-1]
+    return n / elapsed
+
+
+def main(n=2000):
+    django = AdminMediaHandler(WSGIHandler())
+    apps = [('django', django), ('fast', FastRouter(django))]
+    print('%-58s %-8s %10s' % ('path', 'handler', 'req/s'))
+    for path in PATHS:
+        for name, app in apps:
+            bench(app, path, 10)    # warm up
+            print('%-58s %-8s %10.1f' % (path, name, bench(app, path, n)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Compares the JSON libraries available for API responses.
+
+Reports the time to encode typical responses (listings, ``stats``
+and instance details), and the size of the response with and
+without gzip compression::
+
+    $ python contrib/bench/jsonresponse.py [n_instances] [repeat]
+
+"""
+from __future__ import absolute_import
+
+import sys
+
+from importlib import import_module
+from timeit import Timer
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from django.utils.text import compress_string
+from kombu.utils import uuid
+
+from cyme.api.web import JSON_ENCODERS, select_json_encoder
+
+from serialization import instance, stats
+
+
+def responses(n):
+    names = [uuid() for _ in xrange(n)]
+    return [
+        ('instance listing', names),
+        ('paginated listing', {'names': names[:100], 'cursor': names[99]}),
+        ('instance details', instance(names[0])),
+        ('stats', stats()),
+        ('batch get', [{'ok': instance(name)} for name in names]),
+    ]
+
+
+def available():
+    for module, attr in JSON_ENCODERS:
+        try:
+            yield module, getattr(import_module(module), attr)
+        except ImportError:
+            pass
+
+
+def bench(encode, body, repeat):
+    payload = encode(body)
+    return (len(payload), len(compress_string(payload)),
+            min(Timer(lambda: encode(body)).repeat(3, repeat)) / repeat * 1e6)
+
+
+def main(n=1000, repeat=200):
+    encoders = list(available())
+    print('%-20s %-12s %10s %10s %12s' % (
+            'response', 'library', 'bytes', 'gzipped', 'encode (us)'))
+    for title, body in responses(n):
+        for name, encode in encoders:
+            size, gzipped, encode_time = bench(encode, body, repeat)
+            print('%-20s %-12s %10d %10d %12.1f' % (
+                    title, name, size, gzipped, encode_time))
+        print('')
+    print('selected: %s' % (select_json_encoder()[0], ))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
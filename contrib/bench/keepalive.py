@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Compares the throughput of the branch HTTP server
+(:class:`cyme.branch.httpd.HttpServer`) with keep-alive enabled
+and disabled.
+
+Starts the server in-process, and sends ping requests from
+``concurrency`` clients.  The clients reuse their connection if
+keep-alive is enabled, or connect again for every request otherwise::
+
+    $ python contrib/bench/keepalive.py [requests] [concurrency]
+
+"""
+from __future__ import absolute_import
+
+import eventlet
+eventlet.monkey_patch()
+
+import os
+import sys
+
+from httplib import HTTPConnection
+from time import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cyme.settings')
+
+from django.core.handlers.wsgi import WSGIHandler
+
+from cyme.branch.httpd import AdmissionControl, FastRouter, HttpServer
+
+
+def client(port, n, keepalive):
+    conn = HTTPConnection('127.0.0.1', port)
+    for i in xrange(n):
+        if not keepalive:
+            conn = HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/ping/')
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        if not keepalive:
+            conn.close()
+    conn.close()
+
+
+def bench(keepalive, n, concurrency):
+    server = HttpServer(('127.0.0.1', 0), keepalive=keepalive)
+    server.create_log = lambda: open(os.devnull, 'w')
+    router = FastRouter(WSGIHandler())
+    sock = server.listen()
+    port = sock.getsockname()[1]
+    g = eventlet.spawn(server.server, sock,
+                       AdmissionControl(router, route_name=router.route_name))
+    pool = eventlet.GreenPool(concurrency)
+    per_client = n // concurrency
+    time_start = time()
+    for _ in xrange(concurrency):
+        pool.spawn(client, port, per_client, keepalive)
+    pool.waitall()
+    elapsed = time() - time_start
+    g.kill()
+    sock.close()
+    return per_client * concurrency / elapsed
+
+
+def main(n=5000, concurrency=10):
+    print('%-12s %10s' % ('keep-alive', 'req/s'))
+    for keepalive in (True, False):
+        bench(keepalive, 100, 1)    # warm up
+        print('%-12s %10.1f' % (keepalive, bench(keepalive, n, concurrency)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
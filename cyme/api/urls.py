@@ -18,13 +18,27 @@ def _o_(u):
     return (u.replace('APP', uApp)
              .replace('!', uNowait))
 
+#: Views also served by the fast path of the HTTP server
+#: (:class:`cyme.branch.httpd.FastRouter`), bypassing the middleware.
+fast = {'ping': views.ping.as_view(),
+        'apply': views.apply.as_view(),
+        'apply_many': views.apply_many.as_view(),
+        'task_state': views.task_state.as_view(),
+        'task_result': views.task_result.as_view(),
+        'task_wait': views.task_wait.as_view(),
+        'wait_many': views.wait_many.as_view(),
+        'query_many': views.query_many.as_view()}
+
 urlpatterns = patterns('',
-    (r'^ping/$', views.ping.as_view()),
+    (r'^ping/$', fast['ping']),
     (r'^admin/doc/', include('django.contrib.admindocs.urls')),
 
     (r'^admin/', include(admin.site.urls)),
     (r'^branches/(?P<branch>.+?)?/?$', views.Branch.as_view()),
-    (_o_(r'^APP/queue/!(?P<rest>.+)'), views.apply.as_view()),
+    (_o_(r'^APP/queue/!(?P<rest>.+)'), fast['apply']),
+    (_o_(r'^APP/apply/?$'), fast['apply_many']),
+    (_o_(r'^APP/batch/(?P<actor>instances|queues)/?$'),
+        views.batch.as_view()),
     (_o_(r'^APP/queues/!/?$'), views.Queue.as_view()),
     (_o_(r'^APP/queues/!(?P<name>.+?)/?$'), views.Queue.as_view()),
     (_o_(r'^APP/instances/!(?P<name>.+?)/queues/(?P<queue>.+?)?/?$'),
@@ -34,8 +48,11 @@ urlpatterns = patterns('',
     (_o_(r'^APP/instances/!(?P<name>.+)?/stats/?'),
         views.instance_stats.as_view()),
     (_o_(r'^APP/instances/!(?P<name>.+?)?/?$'), views.Instance.as_view()),
-    (_o_(r'^APP/query/(?P<uuid>.+?)/state/?'), views.task_state.as_view()),
-    (_o_(r'^APP/query/(?P<uuid>.+?)/result/?'), views.task_result.as_view()),
-    (_o_(r'^APP/query/(?P<uuid>.+?)/wait/?'), views.task_wait.as_view()),
+    (_o_(r'^APP/query/wait/?$'), fast['wait_many']),
+    (_o_(r'^APP/query/(?P<what>states|results)/?$'), fast['query_many']),
+    (_o_(r'^APP/query/(?P<uuid>.+?)/state/?'), fast['task_state']),
+    (_o_(r'^APP/query/(?P<uuid>.+?)/result/?'), fast['task_result']),
+    (_o_(r'^APP/query/(?P<uuid>.+?)/wait/?'), fast['task_wait']),
+    (r'^operations/(?P<id>[^/]+)/?$', views.operation.as_view()),
     (_o_(r'^APP?/?$'), views.App.as_view()),
 )
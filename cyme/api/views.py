@@ -5,15 +5,36 @@ from __future__ import with_statement
 
 import re
 
+from collections import defaultdict
+
 from celery import current_app as celery
+from celery.exceptions import TimeoutError
 from celery.result import AsyncResult
+from django.http import HttpResponse, HttpResponseNotFound
 
 from . import web
+from cyme import conf
+from cyme.branch.cache import queries
 from cyme.branch.controller import apps, branches, instances, queues
+from cyme.branch.limits import rate_limits, validate as validate_limits
+from cyme.branch.operations import operations
+from cyme.branch.results import as_dict, fetch_many, results
 from cyme.tasks import webhook
 from cyme.utils import uuid
 
 
+def list_names(actor, limit=None, **filters):
+    """List the names of the entities managed by ``actor``.
+
+    Unless paginated, the names are streamed as the replies from the
+    branches are received, instead of waiting for all the replies.
+
+    """
+    if limit:
+        return actor.all(limit=limit, **filters)
+    return web.StreamingJsonResponse(actor.iterall(**filters))
+
+
 class Branch(web.ApiView):
 
     def get(self, request, branch=None):
@@ -23,12 +44,20 @@ class Branch(web.ApiView):
 class App(web.ApiView):
 
     def get(self, request, app=None):
-        return apps.get(app).as_dict() if app else apps.all()
+        if app:
+            return apps.get(app).as_dict()
+        params = self.list_params()
+        return self.Conditional(apps.etag(**params), list_names, apps,
+                                **params)
 
     def put(self, request, app=None):
-        return self.Created(apps.add(app or uuid(),
-                            **self.params('broker', 'arguments',
-                                          'extra_config')))
+        params = self.params('broker', 'arguments', 'extra_config',
+                             'rate_limit', 'queue_rate_limits')
+        try:
+            validate_limits(params['rate_limit'], params['queue_rate_limits'])
+        except ValueError, exc:
+            return self.BadRequest('Invalid rate limit: %s' % (exc, ))
+        return self.Created(apps.add(app or uuid(), **params))
     post = put
 
     def delete(self, request, app):
@@ -38,17 +67,26 @@ class App(web.ApiView):
 class Instance(web.ApiView):
 
     def get(self, request, app, name=None, nowait=False):
-        return instances.get(name) if name else instances.all(app=app)
+        if name:
+            return instances.get(name)
+        params = dict(self.list_params(('enabled', bool), 'queue'), app=app)
+        return self.Conditional(instances.etag(**params), list_names,
+                                instances, **params)
 
     def delete(self, request, app, name, nowait=False):
-        return self.Ok(instances.remove(name, nowait=nowait))
+        return self.Ok(self.schedule(
+                    queries.forgetting(instances.remove, name), name))
 
     def post(self, request, app, name=None, nowait=False):
-        return self.Created(instances.add(name=name, app=app,
-                                      nowait=nowait,
-                                      **self.params('broker', 'pool',
-                                                    'arguments',
-                                                    'extra_config')))
+        if self.nowait:
+            # the name is returned at once, so must be known.
+            name = name or uuid()
+        ret = self.schedule(instances.add, name=name, app=app,
+                            **self.params('broker', 'pool', 'arguments',
+                                          'extra_config'))
+        if self.nowait:
+            ret['name'] = name
+        return self.Created(ret)
 
     def put(self, *args, **kwargs):
         return self.NotImplemented('Operation is not idempotent: use POST')
@@ -57,33 +95,80 @@ class Instance(web.ApiView):
 class Consumer(web.ApiView):
 
     def get(self, request, app, name, queue=None, nowait=False):
-        return instances.consuming_from(name)
+        return queries.get('consuming_from', name,
+                           instances.consuming_from, name)
 
     def put(self, request, app, name, queue, nowait=False):
-        return self.Created(instances.add_consumer(name, queue, nowait=nowait))
+        return self.Created(self.schedule(
+                    queries.forgetting(instances.add_consumer, name),
+                    name, queue))
     post = put
 
     def delete(self, request, app, name, queue, nowait=False):
-        return self.Ok(instances.cancel_consumer(name, queue, nowait=nowait))
+        return self.Ok(self.schedule(
+                    queries.forgetting(instances.cancel_consumer, name),
+                    name, queue))
 
 
 class Queue(web.ApiView):
 
     def get(self, request, app, name=None):
-        return queues.get(name) if name else queues.all()
+        if name:
+            return queues.get(name)
+        params = self.list_params(('enabled', bool))
+        return self.Conditional(queues.etag(**params), list_names, queues,
+                                **params)
 
     def delete(self, request, app, name, nowait=False):
-        return self.Ok(queues.delete(name))
+        return self.Ok(self.schedule(queues.delete, name))
 
     def put(self, request, app, name, nowait=False):
-        return self.Created(queues.add(name, nowait=nowait,
+        return self.Created(self.schedule(queues.add, name,
                       **self.params('exchange', 'exchange_type',
                                     'routing_key', 'options')))
     post = put
 
 
+class batch(web.ApiView):
+    actors = {'instances': instances, 'queues': queues}
+
+    def post(self, request, app, actor):
+        try:
+            ops = self.json_body()
+        except ValueError:
+            ops = None
+        if not isinstance(ops, list):
+            return self.BadRequest('Expected list of operations.')
+        actor = self.actors[actor]
+        for i, op in enumerate(ops):
+            try:
+                actor.validate_op(op)
+            except ValueError, exc:
+                return self.BadRequest('Invalid operation at index %s: %s'
+                                            % (i, exc))
+        if actor is instances:
+            for i, op in enumerate(ops):
+                if isinstance(op, (list, tuple)):
+                    op = ops[i] = {'method': op[0],
+                                   'args': op[1] if len(op) > 1 else None}
+                if op['method'] == 'add':
+                    op['args'] = dict(op.get('args') or {})
+                    op['args'].setdefault('app', app)
+        return actor.batch(ops)
+
+
 class apply(web.ApiView):
+    """Apply webhook.
+
+    Form data is parsed and forwarded as ``data``, while other request
+    bodies (e.g. JSON or binary data) are forwarded to the webhook as-is
+    with their content type, without being parsed (see
+    ``CYME_APPLY_RAW_BODY`` and ``CYME_APPLY_MAX_BODY_SIZE``).
+
+    """
     get_methods = frozenset(['GET', 'HEAD'])
+    form_content_types = frozenset(['application/x-www-form-urlencoded',
+                                    'multipart/form-data'])
     re_find_queue = re.compile(r'/?(.+?)/?$')
     re_url_in_path = re.compile(r'(.+?/)(\w+://)(.+)')
 
@@ -95,58 +180,179 @@ class apply(web.ApiView):
                 return m.groups()[0], url
         return None, url
 
-    def dispatch(self, request, app, rest):
+    def dispatch(self, request, app, rest, nowait=False):
+        # webhooks are always applied without waiting (nowait is implied).
         gd = lambda m: getattr(request, m)
         queue, url = self.prepare_path(rest)
         app = apps.get(app)
-        broker = app.get_broker()
         method = request.method.upper()
+        max_size = conf.CYME_APPLY_MAX_BODY_SIZE
+        length = self.content_length(request)
+        # requests too large are rejected before being rate limited.
+        if max_size and length > max_size:
+            return self.EntityTooLarge()
+        params = gd(method) if method in self.get_methods else gd('GET')
+        data = headers = None
+        content_type = request.META.get('CONTENT_TYPE')
+        if method not in self.get_methods and self.is_raw(content_type):
+            # chunked requests have no content length, so at most one
+            # byte more than allowed is read to tell if too large.
+            if length:
+                data = request.read(length)
+            else:
+                data = request.read(max_size + 1) if max_size \
+                            else request.read()
+            if max_size and len(data) > max_size:
+                return self.EntityTooLarge()
+            headers = {'Content-Type': content_type}
+        elif method not in self.get_methods:
+            if max_size and not length and self.is_chunked(request):
+                # form data is parsed by Django, reading all of a body
+                # without a content length.
+                return self.LengthRequired()
+            data = gd(method)
+        retry_after = rate_limits.consume(app, queue)
+        if retry_after:
+            return self.TooManyRequests(retry_after)
+        broker = app.get_broker()
         pargs = {}
         if queue:
             queue = queues.get(queue)
             pargs.update(exchange=queue['exchange'],
                          exchange_type=queue['exchange_type'],
                          routing_key=queue['routing_key'])
-        params = gd(method) if method in self.get_methods else gd('GET')
-        data = gd(method) if method not in self.get_methods else None
 
         with broker.producers.acquire(block=True) as producer:
             publisher = celery.amqp.TaskPublisher(
                             connection=producer.connection,
                             channel=producer.channel)
-            result = webhook.apply_async((url, method, params, data),
+            result = webhook.apply_async((url, method, params, data,
+                                          headers),
                                          publisher=publisher, retry=True,
                                          **pargs)
             return self.Accepted({'uuid': result.task_id, 'url': url,
                                   'queue': queue, 'method': method,
-                                  'params': params, 'data': data,
+                                  'params': params,
+                                  # raw bodies are not sent back.
+                                  'data': None if headers else data,
                                   'broker': producer.connection.as_uri()})
 
-        def _parse_path_containing_url(self, rest):
-            m = self.re_url_in_path.match(rest)
-            if m:
-                first, scheme, last = m.groups()
-                if scheme:
-                    return first, scheme + last
-                return first, None
-            return rest, None
+    def is_raw(self, content_type):
+        """Returns true if a request body of ``content_type`` is
+        forwarded as-is."""
+        if not content_type:
+            return False
+        return conf.CYME_APPLY_RAW_BODY or (content_type.split(';')[0]
+                            .strip().lower() not in self.form_content_types)
+
+    def is_chunked(self, request):
+        return 'chunked' in request.META.get('HTTP_TRANSFER_ENCODING',
+                                             '').lower()
+
+    def content_length(self, request):
+        try:
+            return int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return 0
+
+    def _parse_path_containing_url(self, rest):
+        m = self.re_url_in_path.match(rest)
+        if m:
+            first, scheme, last = m.groups()
+            if scheme:
+                return first, scheme + last
+            return first, None
+        return rest, None
+
+
+class apply_many(web.ApiView):
+    """Apply many webhooks using one request.
+
+    The request body is a JSON list of webhooks to apply, with the
+    ``url`` and optionally the ``method``, ``params``, ``data`` and
+    ``queue`` of every webhook.  The tasks are published using one
+    producer, and the ids of the tasks are returned in the same order.
+
+    The webhooks are rate limited like :class:`apply`, either all of
+    them being accepted or the request being rejected.
+
+    """
+
+    def post(self, request, app):
+        try:
+            items = self.json_body()
+        except ValueError:
+            items = None
+        if not isinstance(items, list) or not all(
+                isinstance(item, dict) and item.get('url') for item in items):
+            return self.BadRequest('Expected list of {"url": ...} items.')
+        app = apps.get(app)
+        counts = defaultdict(int)
+        for item in items:
+            counts[item.get('queue')] += 1
+        retry_after = rate_limits.consume_many(app, counts)
+        if retry_after:
+            return self.TooManyRequests(retry_after)
+        broker = app.get_broker()
+        routes = {}
+        for name in set(item.get('queue') for item in items) - set([None]):
+            queue = queues.get(name)
+            routes[name] = dict(exchange=queue['exchange'],
+                                exchange_type=queue['exchange_type'],
+                                routing_key=queue['routing_key'])
+        uuids = []
+        with broker.producers.acquire(block=True) as producer:
+            publisher = celery.amqp.TaskPublisher(
+                            connection=producer.connection,
+                            channel=producer.channel)
+            for item in items:
+                method = (item.get('method') or 'GET').upper()
+                result = webhook.apply_async(
+                            (item['url'], method, item.get('params') or {},
+                             item.get('data')),
+                            publisher=publisher, retry=True,
+                            **routes.get(item.get('queue'), {}))
+                uuids.append(result.task_id)
+            return self.Accepted({'uuids': uuids,
+                                  'broker': producer.connection.as_uri()})
 
 
 class autoscale(web.ApiView):
 
     def get(self, request, app, name):
-        instance = instances.get(name)
+        instance = queries.get('autoscale', name, instances.get, name)
         return {'max': instance['max_concurrency'],
                 'min': instance['min_concurrency']}
 
     def post(self, request, app, name, nowait=False):
-        return self.Ok(instances.autoscale(name, nowait=nowait,
-                        **self.params(('max', int), ('min', int))))
+        return self.Ok(self.schedule(
+                    queries.forgetting(instances.autoscale, name), name,
+                    **self.params(('max', int), ('min', int))))
+
+
+class operation(web.ApiView):
+    """Get the state of an operation requested without waiting
+    for the result (``nowait``), by id.
+
+    If ``wait`` is set (in seconds), waits for the operation to finish
+    for at most this long (or ``CYME_WAIT_TIMEOUT``) before replying.
+
+    """
+
+    def get(self, request, id):
+        try:
+            op = operations.get(id)
+        except KeyError:
+            return HttpResponseNotFound()
+        wait = self.get_param(('wait', float))[1]
+        if wait:
+            op.wait(min(wait, conf.CYME_WAIT_TIMEOUT))
+        return op.as_dict()
 
 
 @web.simple_get
 def instance_stats(self, request, app, name):
-    return instances.stats(name)
+    return queries.get('stats', name, instances.stats, name)
 
 
 @web.simple_get
@@ -161,7 +367,97 @@ def task_result(self, request, app, uuid):
 
 @web.simple_get
 def task_wait(self, request, app, uuid):
-    return {'result': AsyncResult(uuid).get()}
+    try:
+        return {'result': AsyncResult(uuid).get(timeout=wait_timeout(self))}
+    except TimeoutError:
+        return web.HttpResponseTimeout()
+
+
+def wait_timeout(view):
+    """Returns the ``timeout`` requested, limited
+    to ``CYME_WAIT_TIMEOUT``."""
+    timeout = view.get_param(('timeout', float))[1]
+    if not timeout or timeout > conf.CYME_WAIT_TIMEOUT:
+        return conf.CYME_WAIT_TIMEOUT
+    return timeout
+
+
+def json_uuids(view):
+    """Returns the list of task uuids in the JSON body of the request,
+    given as a list or as the ``uuids`` key of an object."""
+    try:
+        uuids = view.json_body()
+    except ValueError:
+        return None
+    if isinstance(uuids, dict):
+        return uuids.get('uuids')
+    return uuids
+
+
+def is_uuid_list(uuids):
+    return isinstance(uuids, list) and uuids and all(
+                isinstance(uuid, basestring) for uuid in uuids)
+
+
+class query_many(web.ApiView):
+    """Get the state or the result of many tasks using one request.
+
+    The request body is a JSON list of task uuids, and a map
+    of ``{uuid: state}`` or ``{uuid: result}`` is returned.
+    The tasks are retrieved from the result backend in bulk
+    if supported (``mget``).
+
+    """
+
+    def post(self, request, app, what):
+        uuids = json_uuids(self)
+        if not is_uuid_list(uuids):
+            return self.BadRequest('Expected list of task uuids.')
+        key = 'state' if what == 'states' else 'result'
+        return dict((uuid, as_dict(uuid, meta)[key])
+                        for uuid, meta in fetch_many(uuids).iteritems())
+
+
+class wait_many(web.ApiView):
+    """Wait for the results of many tasks using one request.
+
+    The ids of the tasks are given by the ``uuids`` parameter
+    (a comma separated list), or as a JSON list in the body of a POST
+    request.  The results are streamed as the tasks complete, one
+    JSON object per line, or as server-sent events if the client
+    accepts ``text/event-stream``.  The ids of the tasks still pending
+    when the timeout is exceeded are sent last.
+
+    """
+
+    def get(self, request, app):
+        uuids = filter(None, (self.get_or_post('uuids') or '').split(','))
+        return self.stream(uuids)
+
+    def post(self, request, app):
+        return self.stream(json_uuids(self))
+
+    def stream(self, uuids):
+        if not is_uuid_list(uuids):
+            return self.BadRequest('Expected list of task uuids.')
+        sse = 'text/event-stream' in self.request.META.get('HTTP_ACCEPT', '')
+        response = HttpResponse(self._iterresults(uuids, sse),
+                                content_type=('text/event-stream' if sse
+                                              else 'application/x-json-stream'))
+        web.set_access_control_options(response)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def _iterresults(self, uuids, sse=False):
+        pending = set(uuids)
+        for uuid, meta in results.wait(uuids, timeout=wait_timeout(self)):
+            pending.discard(uuid)
+            data = web.encode(as_dict(uuid, meta))
+            yield 'data: %s\n\n' % (data, ) if sse else data + '\n'
+        if pending:
+            data = web.encode({'pending': sorted(pending)})
+            yield 'event: pending\ndata: %s\n\n' % (data, ) if sse \
+                    else data + '\n'
 
 
 @web.simple_get
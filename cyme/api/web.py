@@ -7,18 +7,28 @@
 from __future__ import absolute_import
 
 import httplib as http
+import re
 import sys
 
 from functools import partial
+from itertools import chain
+from math import ceil
+from importlib import import_module
 from traceback import format_exception
 
-from django.http import HttpResponse, HttpResponseNotFound
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotFound, HttpResponseNotModified)
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
 from django.views.generic.base import View
 
-from anyjson import serialize
+from anyjson import deserialize, serialize
 from cl.exceptions import NoReplyError, NoRouteError
 from kombu.utils.encoding import safe_repr
 
+from cyme import conf
+from cyme.branch.operations import operations
+
 # Cross Origin Resource Sharing
 # See: http://www.w3.org/TR/cors/
 ACCESS_CONTROL = {
@@ -28,11 +38,79 @@ ACCESS_CONTROL = {
 }
 
 
+#: JSON libraries that can be used to encode responses,
+#: and the name of their encode function, fastest first.
+JSON_ENCODERS = [('ujson', 'dumps'),
+                 ('yajl', 'dumps'),
+                 ('simplejson', 'dumps'),
+                 ('json', 'dumps')]
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def select_json_encoder(name=None):
+    """Returns a tuple of ``(name, encode)`` with the JSON library
+    to use for responses, which is ``name`` (default is
+    ``CYME_JSON_ENCODER``) if installed, or the fastest library
+    installed otherwise."""
+    name = name or conf.CYME_JSON_ENCODER
+    for module, attr in sorted(JSON_ENCODERS, key=lambda e: e[0] != name):
+        try:
+            return module, getattr(import_module(module), attr)
+        except ImportError:
+            pass
+    return 'anyjson', serialize
+json_encoder, encode = select_json_encoder()
+
+
+def maybe_gzip(request, response, min_size=None):
+    """Compress the response using gzip, if the client accepts it
+    and the response is larger than ``min_size`` bytes (default is
+    ``CYME_GZIP_MIN_SIZE``).  Streaming responses are not compressed."""
+    min_size = conf.CYME_GZIP_MIN_SIZE if min_size is None else min_size
+    if not min_size or not getattr(response, '_is_string', False) \
+            or response.has_header('Content-Encoding'):
+        return response
+    content = response.content
+    if len(content) < min_size:
+        return response
+    patch_vary_headers(response, ('Accept-Encoding', ))
+    if not re_accepts_gzip.search(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        return response
+    compressed = compress_string(content)
+    if len(compressed) < len(content):
+        response.content = compressed
+        response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = str(len(compressed))
+    return response
+
+
 class HttpResponseTimeout(HttpResponse):
     """The operation timed out."""
     status_code = http.REQUEST_TIMEOUT
 
 
+class HttpResponseTooManyRequests(HttpResponse):
+    """The rate limit was exceeded, the client should retry
+    after the number of seconds in the ``Retry-After`` header."""
+    status_code = 429  # not in httplib.
+
+    def __init__(self, retry_after, *args, **kwargs):
+        super(HttpResponseTooManyRequests, self).__init__(*args, **kwargs)
+        self['Retry-After'] = str(int(ceil(retry_after)))
+
+
+class HttpResponseEntityTooLarge(HttpResponse):
+    """The request body is larger than allowed."""
+    status_code = http.REQUEST_ENTITY_TOO_LARGE
+
+
+class HttpResponseLengthRequired(HttpResponse):
+    """The request body must have a content length."""
+    status_code = http.LENGTH_REQUIRED
+
+
 class HttpResponseNotImplemented(HttpResponse):
     """The requested action is not implemented.
     Used for async requests when the operation is inherently sync."""
@@ -57,11 +135,53 @@ def JsonResponse(data, status=http.OK, access_control=None, **kwargs):
     if data is None or not isinstance(data, (dict, list, tuple)):
         return data
     kwargs.setdefault('content_type', 'application/json')
-    response = HttpResponse(serialize(data),
+    response = HttpResponse(encode(data), status=status, **kwargs)
+    set_access_control_options(response, access_control)
+    response.csrf_exempt = True
+    return response
+
+
+def iterencode_lists(lists):
+    """Encode an iterable of lists as one JSON list, yielding the
+    items of every list as soon as the list is available.
+
+    The status of the response has already been sent when an error
+    is raised by the iterable, so the error is encoded as a last
+    ``{"nok": [...]}`` item, which keeps the document well-formed.
+
+    """
+    yield '['
+    sep = ''
+    try:
+        for items in lists:
+            if items:
+                yield sep + encode(list(items))[1:-1]
+                sep = ','
+    except Exception, exc:
+        yield sep + encode({'nok': [safe_repr(exc),
+                            ''.join(format_exception(*sys.exc_info()))]})
+    yield ']'
+
+
+def StreamingJsonResponse(lists, status=http.OK, access_control=None,
+                          **kwargs):
+    """Returns a response streaming the items of an iterable of lists
+    as one JSON list (see :func:`iterencode_lists`).
+
+    The first list is received before the response is returned,
+    so that an error raised by it is reported with an error status.
+
+    """
+    lists = iter(lists)
+    first = next(lists, None)
+    kwargs.setdefault('content_type', 'application/json')
+    response = HttpResponse(iterencode_lists(chain([first], lists)),
                             status=status, **kwargs)
     set_access_control_options(response, access_control)
     response.csrf_exempt = True
     return response
+
+
 Accepted = partial(JsonResponse, status=http.ACCEPTED)
 Created = partial(JsonResponse, status=http.CREATED)
 Error = partial(JsonResponse, status=http.INTERNAL_SERVER_ERROR)
@@ -70,7 +190,9 @@ Error = partial(JsonResponse, status=http.INTERNAL_SERVER_ERROR)
 class ApiView(View):
     nowait = False  # should the current operation be async?
     typemap = {int: lambda i: int(i) if i else None,
-               float: lambda f: float(f) if f else None}
+               float: lambda f: float(f) if f else None,
+               bool: lambda b: b.lower() in ('1', 'true', 'yes', 'on')
+                                    if b else None}
     _semipredicate = object()
 
     def dispatch(self, request, *args, **kwargs):
@@ -79,6 +201,8 @@ class ApiView(View):
             kwargs.pop('nowait', None)
             if self.nowait:
                 return self.NotImplemented('Operation cannot be async.')
+        elif self.nowait and not conf.CYME_ASYNC_OPERATIONS:
+            return self.NotImplemented('Async operations are disabled.')
         try:
             data = super(ApiView, self).dispatch(request, *args, **kwargs)
         except NoRouteError:
@@ -88,7 +212,22 @@ class ApiView(View):
         except Exception, exc:
             return Error({'nok': [safe_repr(exc),
                                   ''.join(format_exception(*sys.exc_info()))]})
-        return self.Response(data)
+        response = self.Response(data)
+        if response is not None:
+            return maybe_gzip(request, response)
+        return response
+
+    def schedule(self, fun, *args, **kwargs):
+        """Apply ``fun(*args, **kwargs)`` and return the result,
+        or if the request is async (``nowait``) apply it in the
+        background, and return the id of the operation so that it
+        can be tracked (see :mod:`cyme.branch.operations`)."""
+        if not self.nowait:
+            return fun(*args, **kwargs)
+        actor = getattr(getattr(fun, 'im_self', None), 'name', None)
+        name = '.'.join(filter(None, [actor, fun.__name__]))
+        op = operations.spawn(name, fun, *args, **kwargs)
+        return {'ok': 'operation scheduled', 'operation': op.id}
 
     def Response(self, *args, **kwargs):
         return JsonResponse(*args, **kwargs)
@@ -108,9 +247,41 @@ class ApiView(View):
             return self.Accepted(data, **kwargs)
         return Created(data, *args, **kwargs)
 
+    def Conditional(self, etag, fun, *args, **kwargs):
+        """Returns ``304 Not Modified`` if the client already has the
+        representation tagged ``etag`` (``If-None-Match``), or the
+        response of ``fun(*args, **kwargs)`` with the ``ETag`` header
+        otherwise (without the header if ``etag`` is :const:`None`)."""
+        if etag is None:
+            return self.Response(fun(*args, **kwargs))
+        etag = '"%s"' % (etag, )
+        matches = self.request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [tag.strip() for tag in matches.split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = self.Response(fun(*args, **kwargs))
+        response['ETag'] = etag
+        return response
+
     def NotImplemented(self, *args, **kwargs):
         return HttpResponseNotImplemented(*args, **kwargs)
 
+    def BadRequest(self, *args, **kwargs):
+        return HttpResponseBadRequest(*args, **kwargs)
+
+    def TooManyRequests(self, *args, **kwargs):
+        return HttpResponseTooManyRequests(*args, **kwargs)
+
+    def EntityTooLarge(self, *args, **kwargs):
+        return HttpResponseEntityTooLarge(*args, **kwargs)
+
+    def LengthRequired(self, *args, **kwargs):
+        return HttpResponseLengthRequired(*args, **kwargs)
+
+    def json_body(self):
+        """Returns the JSON decoded request body."""
+        return deserialize(self.request.raw_post_data)
+
     def get_or_post(self, key, default=None):
         for d in (self.request.GET, self.request.POST):
             try:
@@ -122,6 +293,14 @@ class ApiView(View):
     def params(self, *keys):
         return dict(self.get_param(key) for key in keys)
 
+    def list_params(self, *filters):
+        """Returns the pagination (``limit``, ``cursor``) and filter
+        parameters of a listing request, for the parameters given."""
+        params = self.params(('limit', int), 'cursor', 'prefix', 'branch',
+                             *filters)
+        return dict((key, value) for key, value in params.iteritems()
+                        if value is not None)
+
     def get_param(self, key, type=None):
         semipredicate = self._semipredicate
         if isinstance(key, (list, tuple)):
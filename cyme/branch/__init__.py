@@ -4,12 +4,17 @@
 
   It starts the HTTP server, the Supervisor, and one or more controllers.
 
+- If the max number of controllers is greater than the min,
+  controllers are added and retired at runtime by the controller scaler.
+
 """
 
 from __future__ import absolute_import
 
 import logging
 
+from itertools import count
+
 from celery import current_app as celery
 from celery.utils import LOG_LEVELS, term
 from cl.g import Event
@@ -40,6 +45,7 @@ class Branch(gThread):
     httpd_cls = '.httpd.HttpServer'
     supervisor_cls = '.supervisor.Supervisor'
     intsup_cls = '.intsup.gSup'
+    scaler_cls = '.scaler.ControllerScaler'
 
     _components_ready = {}
     _components_shutdown = {}
@@ -47,8 +53,11 @@ class Branch(gThread):
     _ready = False
 
     def __init__(self, addrport='', id=None, loglevel=logging.INFO,
-            logfile=None, without_httpd=False, numc=2, sup_interval=None,
-            ready_event=None, colored=None, **kwargs):
+            logfile=None, without_httpd=False, numc=2, maxc=None,
+            sup_interval=None, ready_event=None, colored=None,
+            http_backlog=None, http_idle_timeout=None,
+            without_http_keepalive=False, without_tcp_nodelay=False,
+            http_workers=None, http_max_connections=None, **kwargs):
         self.id = id or gen_unique_id()
         if isinstance(addrport, basestring):
             addr, _, port = addrport.partition(':')
@@ -59,23 +68,30 @@ class Branch(gThread):
         self.logfile = logfile
         self.loglevel = loglevel
         self.numc = numc
+        self.maxc = max(maxc or numc, numc)
         self.ready_event = ready_event
         self.exit_request = Event()
         self.colored = colored or term.colored(enabled=False)
         self.httpd = None
-        gSup = find_symbol(self, self.intsup_cls)
+        self.scaler = None
+        gSup = self.gSup = find_symbol(self, self.intsup_cls)
         if not self.without_httpd:
-            self.httpd = MockSup(instantiate(self, self.httpd_cls, addrport),
-                              signals.httpd_ready)
+            self.httpd = MockSup(instantiate(self, self.httpd_cls, addrport,
+                        backlog=http_backlog,
+                        idle_timeout=http_idle_timeout,
+                        keepalive=False if without_http_keepalive else None,
+                        nodelay=False if without_tcp_nodelay else None,
+                        workers=http_workers,
+                        max_connections=http_max_connections),
+                    signals.httpd_ready)
         self.supervisor = gSup(instantiate(self, self.supervisor_cls,
                                 sup_interval), signals.supervisor_ready)
-        self.controllers = [gSup(instantiate(self, self.controller_cls,
-                                   id='%s.%s' % (self.id, i),
-                                   connection=self.connection,
-                                   branch=self),
-                                 signals.controller_ready)
-                                for i in xrange(1, numc + 1)]
-        c = [self.supervisor] + self.controllers + [self.httpd]
+        self._next_controller_id = count(1).next
+        self.controllers = [self.create_controller() for i in xrange(numc)]
+        if self.maxc > self.numc:
+            self.scaler = gSup(instantiate(self, self.scaler_cls, self),
+                               signals.scaler_ready)
+        c = [self.supervisor] + self.controllers + [self.scaler, self.httpd]
         c = self.components = list(filter(None, c))
         self._components_ready = dict(zip([z.thread for z in c],
                                           [False] * len(c)))
@@ -85,6 +101,41 @@ class Branch(gThread):
         self._components_shutdown = dict(self._components_ready)
         super(Branch, self).__init__()
 
+    def create_controller(self, **kwargs):
+        return self.gSup(instantiate(self, self.controller_cls,
+                                     id='%s.%s' % (self.id,
+                                                   self._next_controller_id()),
+                                     connection=self.connection,
+                                     branch=self, **kwargs),
+                         signals.controller_ready)
+
+    def add_controller(self):
+        """Start a new controller, used to scale up at runtime.
+
+        The global actors are not bound to controllers added
+        at runtime, as these may be retired later.
+
+        """
+        controller = self.create_controller(binds_global_actors=False)
+        self.controllers.append(controller)
+        self.components.insert(self.components.index(self.controllers[-2]) + 1,
+                               controller)
+        self._components_ready[controller.thread] = True
+        controller.start()
+        return controller
+
+    def remove_controller(self, controller, drain_timeout=None):
+        """Drain and stop a controller previously added by
+        :meth:`add_controller`."""
+        self.controllers.remove(controller)
+        self.components.remove(controller)
+        try:
+            controller.thread.drain(drain_timeout)
+            controller.stop()
+        finally:
+            self._components_ready.pop(controller.thread, None)
+            self._components_shutdown.pop(controller.thread, None)
+
     def _component_ready(self, sender=None, **kwargs):
         if not self._ready:
             self._components_ready[sender] = True
@@ -102,6 +153,7 @@ class Branch(gThread):
         signals.controller_ready.connect(self._component_ready)
         signals.httpd_ready.connect(self._component_ready)
         signals.supervisor_ready.connect(self._component_ready)
+        signals.scaler_ready.connect(self._component_ready)
         signals.presence_ready.connect(self._component_ready)
         signals.branch_ready.connect(self.on_ready)
         signals.thread_post_shutdown.connect(self._component_shutdown)
@@ -111,6 +163,9 @@ class Branch(gThread):
         signals.branch_startup_request.send(sender=self)
         self.prepare_signals()
         self.info('Starting with id %r', self.id)
+        if self.httpd:
+            # must fork before any thread is started.
+            self.httpd.thread.fork_workers()
         [g.start() for g in self.components]
         self.exit_request.wait()
 
@@ -119,6 +174,8 @@ class Branch(gThread):
         super(Branch, self).stop()
 
     def after(self):
+        find_symbol(self, '.control.replies').stop()
+        find_symbol(self, '.results.results').stop()
         for component in reversed(self.components):
             if self._components_ready[component.thread]:
                 try:
@@ -138,10 +195,17 @@ class Branch(gThread):
         if self.httpd:
             url, port = self.httpd.thread.url, self.httpd.thread.port
         port = self.httpd.thread.port if self.httpd else None
+        queries = find_symbol(self, '.cache.queries')
+        rate_limits = find_symbol(self, '.limits.rate_limits')
         return {'id': self.id,
                 'loglevel': LOG_LEVELS[self.loglevel],
                 'numc': self.numc,
+                'maxc': self.maxc,
+                'controllers': len(self.controllers),
                 'sup_interval': self.supervisor.interval,
                 'logfile': self.logfile,
                 'port': port,
-                'url': url}
+                'url': url,
+                'http_workers': self.httpd.thread.workers if self.httpd else 0,
+                'query_cache': queries.stats(),
+                'rate_limits': rate_limits.stats()}
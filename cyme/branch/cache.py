@@ -0,0 +1,123 @@
+"""cyme.branch.cache
+
+- Caches the results of live queries to instances for a short time.
+
+- Concurrent identical queries share the same query in flight,
+  instead of every request sending a query to the instance.
+
+- Results are forgotten when the instance is changed by the branch,
+  including the results of queries in flight at the time.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+from functools import wraps
+from time import time
+
+from eventlet.event import Event
+from kombu.utils.compat import OrderedDict
+
+from cyme import conf
+
+
+class QueryCache(object):
+    """Cache of query results, by endpoint and key.
+
+    :keyword ttl: Time in seconds results are cached (int/float),
+        default is ``CYME_QUERY_CACHE_TTL``.  If zero the results are
+        not cached, but concurrent queries are still shared.
+
+    Keeps the number of ``hits`` (cached), ``shared`` (in flight)
+    and ``misses`` for every endpoint (see :meth:`stats`).
+
+    """
+
+    #: Max number of results cached, the oldest are removed first.
+    max_entries = 1000
+
+    def __init__(self, ttl=None):
+        self.ttl = conf.CYME_QUERY_CACHE_TTL if ttl is None else ttl
+        self._results = OrderedDict()
+        self._inflight = {}
+        self._stats = defaultdict(lambda: {'hits': 0,
+                                           'shared': 0,
+                                           'misses': 0})
+
+    def get(self, endpoint, key, fun, *args, **kwargs):
+        """Returns the result of ``fun(*args, **kwargs)``, which is
+        cached and shared by ``(endpoint, key)``."""
+        key, stats = (endpoint, key), self._stats[endpoint]
+        try:
+            expires, value = self._results[key]
+        except KeyError:
+            pass
+        else:
+            if expires > time():
+                stats['hits'] += 1
+                return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            stats['shared'] += 1
+            return inflight.wait()
+        stats['misses'] += 1
+        inflight = self._inflight[key] = Event()
+        try:
+            value = fun(*args, **kwargs)
+        except Exception, exc:
+            inflight.send_exception(exc)
+            raise
+        else:
+            # the result may predate the change if forgotten meanwhile.
+            if self.ttl and self._inflight.get(key) is inflight:
+                self._store(key, value)
+            inflight.send(value)
+            return value
+        finally:
+            if self._inflight.get(key) is inflight:
+                del(self._inflight[key])
+
+    def forget(self, endpoint, key):
+        """Forget the cached result, e.g. when changed.
+
+        A query already in flight is no longer shared with the
+        following requests, and its result is not cached.
+
+        """
+        key = (endpoint, key)
+        self._results.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def forget_all(self, key):
+        """Forget the cached results of all endpoints for ``key``."""
+        for endpoint in self._stats.keys():
+            self.forget(endpoint, key)
+
+    def forgetting(self, fun, key):
+        """Returns a function applying ``fun``, then forgetting the
+        cached results for ``key`` (see :meth:`forget_all`)."""
+
+        @wraps(fun)
+        def _forgetting(*args, **kwargs):
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                self.forget_all(key)
+        # operations are named after the actor (see ApiView.schedule).
+        _forgetting.im_self = getattr(fun, 'im_self', None)
+        return _forgetting
+
+    def stats(self):
+        return dict(self._stats)
+
+    def _store(self, key, value):
+        # results are kept in the order they expire.
+        now, results = time(), self._results
+        results.pop(key, None)
+        while results and (len(results) >= self.max_entries or
+                           results[next(iter(results))][0] <= now):
+            results.popitem(last=False)
+        results[key] = (now + self.ttl, value)
+
+queries = QueryCache()
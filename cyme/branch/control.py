@@ -0,0 +1,240 @@
+"""cyme.branch.control
+
+- Remote control commands sent to instances.
+
+- Commands are sent directly to the instance using its direct queue,
+  instead of broadcasting the command to all the instances on the broker
+  (see :func:`cyme.tasks.control`).
+
+- Replies are received by a long-lived consumer per broker,
+  instead of declaring and consuming from a new reply queue for
+  every command sent.
+
+- Commands sent to direct queues are transient and expire with their
+  timeout, so they do not pile up in the queues of instances that are
+  gone.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from time import time
+
+from celery import current_app as celery
+from cl.g import Event
+from eventlet import Timeout
+from kombu import Exchange, Queue
+from kombu.common import uuid
+from kombu.mixins import ConsumerMixin
+from kombu.pools import producers
+
+from .state import state
+from .thread import gThread
+
+from cyme.tasks import control
+
+
+class ReplyConsumer(ConsumerMixin, gThread):
+    """Consumes the replies to all remote control commands sent
+    to one broker.
+
+    :param connection: Connection to the broker.
+    :keyword mailbox: The remote control mailbox
+        (default is ``celery.control.mailbox``).
+
+    The worker replying to a command only echoes the routing key
+    it was given, so every command in progress is assigned a routing key
+    bound to the reply queue (called a slot), used as the correlation id.
+    Slots are reused, so the bindings are only created once.
+
+    A slot is not reused if the command timed out, until the late reply
+    has been received, or :attr:`late_reply_timeout` has passed
+    (destinations that are gone never reply).
+
+    """
+    connect_max_retries = celery.conf.BROKER_CONNECTION_MAX_RETRIES
+
+    #: Time in seconds a late reply is waited for before the slot
+    #: is reused.
+    late_reply_timeout = 30.0
+
+    def __init__(self, connection, mailbox=None):
+        self.connection = connection
+        self.mailbox = mailbox or celery.control.mailbox
+        self.queue = self.mailbox.get_reply_queue('cyme.%s' % (uuid(), ))
+        self._slots = set()
+        self._free = []
+        self._pending = {}
+        self._late = {}
+        self._consuming = Event()
+        gThread.__init__(self)
+
+    def get_consumers(self, Consumer, channel):
+        return [Consumer([self.queue], callbacks=[self.on_reply],
+                         no_ack=True)]
+
+    def on_consume_ready(self, connection, channel, consumers, **kwargs):
+        # the queue is deleted with the bindings if the connection
+        # was lost, so the slots must be bound again.
+        for key in self._slots:
+            self._bind(channel, key)
+        if not self._consuming.ready():
+            self._consuming.send(True)
+
+    def on_reply(self, body, message):
+        key = message.delivery_info.get('routing_key')
+        waiter = self._pending.pop(key, None)
+        if waiter is not None:
+            waiter.send(body)
+        elif self._late.pop(key, None) is not None:
+            self._free.append(key)
+
+    def call(self, destination, command, arguments=None, timeout=1,
+            queue=None):
+        """Send command to ``destination`` and wait for its reply.
+
+        :keyword queue: Name of the direct queue of the destination.
+            If set the command is sent to this queue, otherwise it is
+            broadcast to all instances using the remote control mailbox.
+
+        Returns the reply (a dictionary of ``{destination: reply}``),
+        or :const:`None` if no reply was received within ``timeout``.
+
+        """
+        with Timeout(timeout, False):
+            self._consuming.wait()
+            key = self._acquire_slot()
+            waiter = self._pending[key] = Event()
+            try:
+                if queue:
+                    self._publish_direct(key, queue, command, arguments,
+                                         timeout)
+                else:
+                    self._publish(key, destination, command, arguments)
+                reply = waiter.wait()
+                self._free.append(key)
+                return reply
+            finally:
+                if self._pending.pop(key, None) is not None:
+                    # timed out: a late reply may still be received.
+                    self._late[key] = time() + self.late_reply_timeout
+
+    def _publish(self, key, destination, command, arguments):
+        mailbox = self.mailbox
+        with producers[self.connection].acquire(block=True) as producer:
+            producer.publish({'method': command,
+                              'arguments': arguments or {},
+                              'destination': [destination],
+                              'reply_to': {
+                                'exchange': mailbox.reply_exchange.name,
+                                'routing_key': key}},
+                             exchange=mailbox.exchange.name,
+                             declare=[mailbox.exchange])
+
+    def _publish_direct(self, key, queue, command, arguments, timeout):
+        # sent as a task message, as this is what the worker
+        # expects to receive from its direct queue.
+        queue = Queue(queue, Exchange(queue, 'direct'), queue)
+        reply_to = {'exchange': self.mailbox.reply_exchange.name,
+                    'routing_key': key}
+        kwargs = {'method': command,
+                  'arguments': arguments or {},
+                  'reply_to': reply_to,
+                  'expires': time() + timeout if timeout else None}
+        properties = {}
+        if timeout:
+            # per-message TTL in milliseconds (RabbitMQ).
+            properties['expiration'] = str(int(timeout * 1000))
+        with producers[self.connection].acquire(block=True) as producer:
+            producer.publish({'task': control.name, 'id': uuid(),
+                              'args': [], 'kwargs': kwargs},
+                             exchange=queue.exchange.name,
+                             routing_key=queue.routing_key,
+                             delivery_mode='transient',
+                             declare=[queue], **properties)
+
+    def _acquire_slot(self):
+        if not self._free and self._late:
+            self._reclaim_late_slots()
+        try:
+            return self._free.pop()
+        except IndexError:
+            key = '%s.%s' % (self.queue.routing_key, len(self._slots))
+            with producers[self.connection].acquire(block=True) as producer:
+                self._bind(producer.channel, key)
+            self._slots.add(key)
+            return key
+
+    def _reclaim_late_slots(self):
+        now = time()
+        for key, deadline in self._late.items():
+            if deadline <= now:
+                del(self._late[key])
+                self._free.append(key)
+
+    def _bind(self, channel, key):
+        channel.queue_bind(queue=self.queue.name,
+                           exchange=self.mailbox.reply_exchange.name,
+                           routing_key=key)
+
+
+class Replies(object):
+    """Keeps one :class:`ReplyConsumer` for every broker used,
+    started when the first command is sent to the broker."""
+    Consumer = ReplyConsumer
+
+    #: Share of the timeout used waiting for the reply to a command
+    #: sent to the direct queue, the rest is used by the broadcast.
+    direct_share = 0.5
+
+    def __init__(self):
+        self.consumers = {}
+
+    def call(self, broker, destination, command, arguments=None, timeout=1,
+            queue=None):
+        """Send remote control command to the instance named
+        ``destination`` using ``broker``, and return its reply.
+
+        If the direct ``queue`` of the instance is given, the command is
+        sent to this queue first.  The command is broadcast if there is
+        no reply, as the instance may be started by an older version,
+        or the direct queue may be blocked by the messages it has
+        prefetched.
+
+        Both attempts share the same ``timeout``, so an instance that
+        is gone does not make the caller wait twice as long.
+
+        """
+        consumer = self.get(broker)
+        if queue:
+            started = time()
+            reply = consumer.call(destination, command, arguments,
+                                  timeout=timeout * self.direct_share,
+                                  queue=queue)
+            if reply:
+                return reply
+            timeout = max(timeout - (time() - started), 0)
+        return consumer.call(destination, command, arguments,
+                             timeout=timeout)
+
+    def get(self, broker):
+        try:
+            return self.consumers[broker.url]
+        except KeyError:
+            consumer = self.consumers[broker.url] = \
+                    self.Consumer(broker.connection)
+            consumer.start()
+            return consumer
+
+    def stop(self):
+        for consumer in self.consumers.values():
+            consumer.stop()
+        self.consumers.clear()
+
+    @property
+    def enabled(self):
+        # the consumers are only used in the cyme-branch process.
+        return state.is_branch
+
+replies = Replies()
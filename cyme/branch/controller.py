@@ -5,17 +5,26 @@
 """
 
 from __future__ import absolute_import
+from __future__ import with_statement
 
-from functools import partial
+import sys
 
+from hashlib import md5
+from time import time
+
+from cl.g import Event
 from cl.presence import AwareActorMixin, announce_after
 from cl.utils import flatten, first_or_raise, shortuuid
 from celery import current_app as celery
 from kombu import Exchange
 from kombu.common import uuid
+from kombu.utils import kwdict
+from kombu.utils.encoding import safe_repr
 
 from . import metrics
 from . import signals
+from .cache import queries
+from .presence import ModelNames, Presence
 from .state import state
 from .thread import gThread
 
@@ -33,10 +42,46 @@ class CymeActor(Actor, AwareActorMixin):
         self.retry = state.is_branch
         self.default_fields = {'actor_id': self.id}
 
+    def on_message(self, body, message):
+        # the agent keeps track of the time spent processing requests,
+        # used to decide when controllers should be added or retired.
+        agent = self.agent
+        agent.on_request_start()
+        time_start = time()
+        try:
+            return Actor.on_message(self, body, message)
+        finally:
+            agent.on_request_end(time() - time_start)
+
+
+class BatchState:
+    """Adds the ``batch`` method to the state of an actor."""
+
+    def batch(self, ops):
+        return [self.actor.apply_op(op) for op in ops]
+
+
+class ListState:
+    """Adds the ``names`` method to the state of an actor, used to list
+    entities with filters and pagination applied by the database
+    of every agent."""
+
+    def names(self, branch=None, limit=None, **query):
+        if branch and branch != self.agent.branch.id:
+            return []
+        # one more than the limit, so the caller knows if there
+        # are more names following the page.
+        return self.objects.names(limit=limit + 1 if limit else None,
+                                  **query)
+
 
 class ModelActor(CymeActor):
     model = None
 
+    #: Batch operations creating new entities, these can be
+    #: performed by any agent.
+    batch_creates = ('add', )
+
     def on_agent_ready(self):
         if self.name not in self._announced:
             self.log.info('%s: %s', self.name_plural,
@@ -48,6 +93,195 @@ class ModelActor(CymeActor):
         state.objects = self.model._default_manager
         return Actor.contribute_to_state(self, state)
 
+    def batch(self, ops, **kw):
+        """Perform a list of operations using as few messages as possible.
+
+        :param ops: List of operations, where every operation is a
+            dictionary with the keys ``method`` and ``args``.
+
+        The operations are grouped by the branch owning the entity
+        they operate on, and one agent of every branch receives a
+        single message with the operations in the order they were
+        listed.  Entities are created by a branch already receiving
+        operations if any, and the operations following can refer
+        to them.  See :meth:`validate_op` for the format.
+
+        Returns a list with a reply for every operation,
+        either ``{'ok': return_value}`` or ``{'nok': [exc, traceback]}``.
+
+        The cached query results of the entities are forgotten
+        after the operations (see :mod:`cyme.branch.cache`).
+
+        """
+        ops = [self._prepare_op(op) for op in ops]
+        try:
+            return self._batch(ops, **kw)
+        finally:
+            for name in set(op['args'].get('name') for op in ops):
+                queries.forget_all(name)
+
+    def _batch(self, ops, **kw):
+        if self.agent is None:
+            return self.throw('batch', {'ops': ops}, **kw)
+        groups, agents, replies = {}, [], [None] * len(ops)
+        # the owner of every entity is only resolved once, and the
+        # lookup may choose any of the controllers of the owning branch,
+        # so the first agent chosen for a branch receives all the
+        # operations for the branch, to be applied in order.
+        owners, branch_agents = {}, {}
+        for i, op in enumerate(ops):
+            name = op['args'].get('name')
+            agent = owners.get(name)
+            if agent is None:
+                agent = self._lookup_owner(name)
+            if agent is None and op['method'] in self.batch_creates:
+                agent = agents[0] if agents else self._any_agent()
+            if agent is None:
+                replies[i] = self._nok(self.NoRouteError(name))
+                continue
+            agent = branch_agents.setdefault(self._branch_of(agent), agent)
+            owners[name] = agent
+            if agent not in groups:
+                agents.append(agent)
+            groups.setdefault(agent, []).append(i)
+
+        # send the messages first, then collect the replies.
+        pending = [(groups[agent],
+                    self.call('batch', {'ops': [ops[i]
+                                                for i in groups[agent]]},
+                              routing_key=agent))
+                        for agent in agents]
+        for indices, r in pending:
+            try:
+                group_replies = r.get(**kw)
+            except self.NoReplyError, exc:
+                group_replies = [self._nok(exc)] * len(indices)
+            except self.Error, exc:
+                group_replies = [{'nok': [exc.exc, exc.traceback]}] \
+                                    * len(indices)
+            for i, reply in zip(indices, group_replies):
+                replies[i] = reply
+        return replies
+
+    def iterall(self, **filters):
+        """Iterate over the lists of names replied by every agent
+        (see :meth:`all`), as the replies are received."""
+        return self.scatter('all', filters)
+
+    def paginate(self, replies, limit=None):
+        """Merge the sorted names replied by all agents.
+
+        Returns the list of names if ``limit`` is not set, or a dictionary
+        with the first ``limit`` ``names``, and the ``cursor`` to use
+        for the next page (:const:`None` if this is the last page).
+
+        """
+        if not limit:
+            return flatten(replies)
+        names = sorted(set(flatten(replies)))
+        page = names[:limit]
+        return {'names': page,
+                'cursor': page[-1] if len(names) > limit else None}
+
+    def etag(self, **params):
+        """Returns an entity tag for a listing of the entities
+        (with ``params`` being the filters of the listing).
+
+        The tag changes whenever an entity is changed by this branch,
+        or by another branch as soon as the change is announced
+        (state changes wake up the other agents, see
+        :func:`~cl.presence.announce_after`).  Returns :const:`None` in the
+        HTTP workers, where changes are not tracked.
+
+        """
+        if state.is_http_worker:
+            return
+        tags = []
+        if self.agent is not None and self.meta_lookup_section:
+            tags = self.agent.presence.state.etags_for(self.name)
+        return md5(repr((self.name, ModelNames.for_model(self.model).etag,
+                         tags, sorted(params.items())))).hexdigest()
+
+    def apply_op(self, op):
+        """Perform a single batch operation using the local state."""
+        try:
+            method = op['method']
+            if method == 'batch':
+                raise KeyError(method)
+            return {'ok': self.lookup_action(method)(
+                            **kwdict(op.get('args') or {}))}
+        except self.Next:
+            return self._nok(self.NoRouteError(op['args'].get('name')))
+        except Exception, exc:
+            return self._nok(exc, self._get_traceback(sys.exc_info()))
+
+    def validate_op(self, op):
+        """Raises :exc:`ValueError` if ``op`` is not a valid batch
+        operation: a mapping with the ``method`` name and optionally
+        its ``args`` (a mapping), or a ``[method, args]`` list."""
+        if isinstance(op, (list, tuple)):
+            if not 0 < len(op) <= 2:
+                raise ValueError('expected [method, args]')
+            op = {'method': op[0], 'args': op[1] if len(op) > 1 else None}
+        if not isinstance(op, dict):
+            raise ValueError('expected {"method": ..., "args": {...}}')
+        unknown = set(op) - set(['method', 'args'])
+        if unknown:
+            raise ValueError('unknown keys: %s' % (
+                                ', '.join(sorted(map(str, unknown))), ))
+        if not isinstance(op.get('method'), basestring):
+            raise ValueError('method must be a string')
+        if op.get('args') is not None and not isinstance(op['args'], dict):
+            raise ValueError('args must be a mapping')
+
+    def _prepare_op(self, op):
+        if isinstance(op, (list, tuple)):
+            op = {'method': op[0], 'args': op[1] if len(op) > 1 else {}}
+        op = {'method': op['method'], 'args': dict(op.get('args') or {})}
+        if op['method'] in self.batch_creates:
+            # names must be known so that the following operations
+            # can be routed to the agent creating the entity.
+            op['args']['name'] = op['args'].get('name') or uuid()
+        return op
+
+    def _branch_of(self, agent):
+        # the ids of the controllers are "<branch id>.<n>".
+        return agent.rpartition('.')[0] or agent
+
+    def _lookup_owner(self, name):
+        try:
+            return self.lookup(name)
+        except KeyError:
+            pass
+
+    def _any_agent(self):
+        try:
+            for agent in self.agent.lookup_agents(lambda values: True,
+                                                  self.name,
+                                                  self.meta_lookup_section):
+                return agent
+        except KeyError:
+            pass
+        # observers (e.g. in the HTTP workers) cannot receive requests.
+        if any(actor.name == self.name for actor in self.agent.actors):
+            return self.agent.id
+
+    def _nok(self, exc, traceback=''):
+        return {'nok': [safe_repr(exc), traceback]}
+
+    @property
+    def meta(self):
+        if self.versioned_names is None:
+            return {}
+        return {self.meta_lookup_section: self.versioned_names.names}
+
+    @cached_property
+    def versioned_names(self):
+        """Cached and versioned names of the model objects, used to
+        send changes to the metadata as deltas."""
+        if self.meta_lookup_section:
+            return ModelNames.for_model(self.model)
+
     @cached_property
     def name(self):
         return unicode(self.model._meta.verbose_name.capitalize())
@@ -116,15 +350,22 @@ class App(ModelActor):
     exchange = Exchange('cyme.App')
     _cache = {}
 
-    class state:
+    class state(ListState):
 
-        def all(self):
-            return [app.name for app in self.objects.all()]
+        def all(self, branch=None, prefix=None, cursor=None, limit=None):
+            return self.names(branch=branch, prefix=prefix,
+                              cursor=cursor, limit=limit)
 
-        def add(self, name, broker=None, arguments=None, extra_config=None):
+        def add(self, name, broker=None, arguments=None, extra_config=None,
+                rate_limit=None, queue_rate_limits=None):
+            # the rate limits of an existing app may have changed.
+            self.actor._cache.pop(name, None)
             return self.objects.add(name, broker=broker,
-                                          arguments=arguments,
-                                          extra_config=extra_config).as_dict()
+                                    arguments=arguments,
+                                    extra_config=extra_config,
+                                    rate_limit=rate_limit,
+                                    queue_rate_limits=queue_rate_limits,
+                                    ).as_dict()
 
         def delete(self, name):
             return self.objects.filter(name=name).delete() and 'ok'
@@ -140,8 +381,10 @@ class App(ModelActor):
             return {'load_average': metrics.load_average(),
                     'disk_use': metrics.df(instance_dir).capacity}
 
-    def all(self):
-        return flatten(self.scatter('all'))
+    def all(self, limit=None, **filters):
+        """List app names, see :meth:`Instance.all`
+        (``prefix`` and ``branch`` filters only)."""
+        return self.paginate(self.iterall(limit=limit, **filters), limit)
 
     def add(self, name, **broker):
         self.scatter('add', dict({'name': name}, **broker), nowait=True)
@@ -158,6 +401,12 @@ class App(ModelActor):
         objects = self.state.objects
         if not name:
             return objects.get_default()
+        if state.is_http_worker:
+            # not told when the app is changed, so cannot be cached.
+            app = self._get(name)
+            if not app:
+                raise KeyError(name)
+            return objects.recreate(**app)
         if name not in self._cache:
             app = self._get(name)
             if not app:
@@ -184,13 +433,17 @@ class Instance(ModelActor):
     types = ('direct', 'scatter', 'round-robin')
     meta_lookup_section = 'instances'
 
-    class state:
+    class state(BatchState, ListState):
 
-        def all(self, app=None):
-            fun = self.objects.all
+        def all(self, app=None, enabled=None, queue=None, branch=None,
+                prefix=None, cursor=None, limit=None):
+            query = {}
             if app:
-                fun = partial(self.objects.filter, app=apps.get(app))
-            return [instance.name for instance in fun()]
+                query['app'] = apps.get(app)
+            if enabled is not None:
+                query['is_enabled'] = enabled
+            return self.names(branch=branch, queue=queue, prefix=prefix,
+                              cursor=cursor, limit=limit, **query)
 
         def get(self, name, app=None):
             try:
@@ -210,22 +463,28 @@ class Instance(ModelActor):
         def restart(self, name, app=None):
             return self.local.restart(name) and 'ok'
 
+        @announce_after
         def enable(self, name, app=None):
             return self.local.enable(name) and 'ok'
 
+        @announce_after
         def disable(self, name, app=None):
             return self.local.disable(name) and 'ok'
 
+        @announce_after
         def add_consumer(self, name, queue):
             return self.local.add_consumer(name, queue) and 'ok'
 
+        @announce_after
         def cancel_consumer(self, name, queue):
             return self.local.cancel_consumer(name, queue) and 'ok'
 
+        @announce_after
         def remove_queue_from_all(self, queue):
             return [instance.name for instance in
                         self.objects.remove_queue_from_instances(queue)]
 
+        @announce_after
         def autoscale(self, name, max=None, min=None):
             instance = self.local.get(name)
             instance.autoscale(max=max, min=min)
@@ -246,8 +505,21 @@ class Instance(ModelActor):
         return self.send_to_able('get',
                                  {'name': name, 'app': app}, to=name, **kw)
 
-    def all(self, app=None):
-        return flatten(self.scatter('all', {'app': app}))
+    def all(self, app=None, limit=None, **filters):
+        """List the names of the instances in all branches.
+
+        :keyword enabled: Only enabled (or disabled) instances.
+        :keyword queue: Only instances consuming from this queue.
+        :keyword branch: Only instances owned by this branch.
+        :keyword prefix: Only names starting with this prefix.
+        :keyword cursor: Only names following this name.
+        :keyword limit: Max number of names, see :meth:`paginate`.
+
+        The filters are applied by every branch before replying.
+
+        """
+        return self.paginate(self.iterall(app=app, limit=limit, **filters),
+                             limit)
 
     def add(self, name=None, app=None, nowait=False, **kwargs):
         if nowait:
@@ -292,10 +564,6 @@ class Instance(ModelActor):
 
     def stats(self, name, **kw):
         return self.send_to_able('stats', {'name': name}, to=name, **kw)
-
-    @property
-    def meta(self):
-        return {'instances': self.state.all()}
 instances = Instance()
 
 
@@ -307,10 +575,15 @@ class Queue(ModelActor):
     default_timeout = 2
     meta_lookup_section = 'queues'
 
-    class state:
+    class state(BatchState, ListState):
 
-        def all(self):
-            return [q.name for q in self.objects.all()]
+        def all(self, enabled=None, branch=None, prefix=None, cursor=None,
+                limit=None):
+            query = {}
+            if enabled is not None:
+                query['is_enabled'] = enabled
+            return self.names(branch=branch, prefix=prefix, cursor=cursor,
+                              limit=limit, **query)
 
         def get(self, name):
             try:
@@ -327,8 +600,10 @@ class Queue(ModelActor):
             self.objects.filter(name=name).delete()
             return 'ok'
 
-    def all(self):
-        return flatten(self.scatter('all'))
+    def all(self, limit=None, **filters):
+        """List queue names, see :meth:`Instance.all`
+        (``enabled``, ``prefix`` and ``branch`` filters only)."""
+        return self.paginate(self.iterall(limit=limit, **filters), limit)
 
     def get(self, name):
         try:
@@ -344,13 +619,17 @@ class Queue(ModelActor):
     def delete(self, name, **kw):
         instances.remove_queue_from_all(name, nowait=True)
         return self.send_to_able('delete', {'name': name}, to=name, **kw)
-
-    @property
-    def meta(self):
-        return {'queues': self.state.all()}
 queues = Queue()
 
 
+class ControllerPresence(Presence):
+
+    def send_heartbeat(self, full=False):
+        # a draining controller must not reappear to the other agents.
+        if not self.agent.draining:
+            return Presence.send_heartbeat(self, full=full)
+
+
 class Controller(AwareAgent, gThread):
     actors = [Branch(), App(), Instance(), Queue()]
     connect_max_retries = celery.conf.BROKER_CONNECTION_MAX_RETRIES
@@ -358,21 +637,80 @@ class Controller(AwareAgent, gThread):
     _ready_sent = False
     _presence_ready_sent = False
 
+    #: Set if the global actors should be bound to this controller
+    #: (false for controllers added at runtime, as they may be retired).
+    binds_global_actors = True
+
+    #: Set when the controller is about to be retired.
+    draining = False
+
+    #: Number of requests currently being processed.
+    active_requests = 0
+
+    #: Moving average of request processing time (in seconds as a float).
+    latency = 0.0
+
+    #: Time of the last processed request.
+    last_request = None
+
+    #: Smoothing factor used for :attr:`latency`.
+    latency_weight = 0.3
+
     def __init__(self, *args, **kwargs):
         self.branch = kwargs.pop('branch', None)
+        self.binds_global_actors = kwargs.pop('binds_global_actors',
+                                              self.binds_global_actors)
         AwareAgent.__init__(self, *args, **kwargs)
         gThread.__init__(self)
+        self.last_request = time()
+        self._consumers = []
+        self._drained = Event()
 
     def on_awake(self):
         # bind global actors to this agent,
         # so presence can be used.
-        for actor in (branches, apps, instances, queues):
-            actor.agent = self
+        if self.binds_global_actors:
+            for actor in (branches, apps, instances, queues):
+                actor.agent = self
+
+    def on_request_start(self):
+        self.active_requests += 1
+
+    def on_request_end(self, runtime):
+        self.active_requests -= 1
+        self.last_request = time()
+        w = self.latency_weight
+        self.latency = w * runtime + (1 - w) * self.latency
+
+    def drain(self, timeout=None):
+        """Stop accepting new requests, and wait for the requests already
+        received to be processed.
+
+        The controller announces itself as offline first, so that
+        other agents stop sending requests to it.
+
+        :keyword timeout: Max time to wait for (in seconds as a float).
+
+        """
+        if not self.draining:
+            self.draining = True
+            self.presence.send_offline()
+        with self.Timeout(timeout, False):
+            self._drained.wait()
+        return self._drained.ready()
+
+    def idle_since(self):
+        """Returns the number of seconds since the last request was
+        processed, or zero if the controller is processing requests."""
+        if self.active_requests:
+            return 0.0
+        return time() - self.last_request
 
     def on_connection_revived(self):
         state.on_broker_revive()
 
-    def on_consume_ready(self, *args, **kwargs):
+    def on_consume_ready(self, connection, channel, consumers, **kwargs):
+        self._consumers = consumers
         if not self._ready_sent:
             signals.controller_ready.send(sender=self)
             self._ready_sent = True
@@ -380,6 +718,12 @@ class Controller(AwareAgent, gThread):
 
     def on_iteration(self):
         self.respond_to_ping()
+        if self.draining and not self._drained.ready():
+            # called between messages, so there are no requests in progress,
+            # and cancelling from the thread owning the channel is safe.
+            for consumer in self._consumers:
+                self.maybe_conn_error(consumer.cancel)
+            self._drained.send(True)
 
     def on_connection_error(self, exc, interval):
         self.respond_to_ping()
@@ -399,6 +743,10 @@ class Controller(AwareAgent, gThread):
             signals.thread_shutdown_step.send(sender=self)
         super(Controller, self).stop()
 
+    @cached_property
+    def presence(self):
+        return ControllerPresence(self, on_awake=self.on_awake)
+
     @property
     def logger_name(self):
         return '#'.join([self.__class__.__name__, self._shortid()])
@@ -2,46 +2,491 @@
 
 - Our embedded WSGI server used to serve the HTTP API.
 
+- The most frequent requests (ping, apply and task queries) are routed
+  directly to their views, bypassing the Django middleware and
+  URL resolver.
+
+- The number of requests processed concurrently is limited, and the
+  requests exceeding the limit are rejected with
+  ``503 Service Unavailable`` after waiting for a while.
+
+- The API can be served by several processes listening on the same
+  port (``SO_REUSEPORT``), see :meth:`HttpServer.fork_workers`.
+  The worker processes are restarted if they exit.
+
 """
 
 from __future__ import absolute_import
+from __future__ import with_statement
+
+import errno
+import logging
+import os
+import signal
+import socket
+import sys
 
-from eventlet import listen
+from time import time
+
+from anyjson import serialize
+from celery import current_app as celery
+from celery.platforms import set_process_title
+from eventlet import Timeout, listen, sleep
 from eventlet import wsgi
+from eventlet.green import socket as green_socket
+from eventlet.hubs import get_hub
+from eventlet.semaphore import Semaphore
 
+from django import db
+from django.core import signals
+from django.core.exceptions import ImproperlyConfigured
 from django.core.handlers import wsgi as djwsgi
 from django.core.servers.basehttp import AdminMediaHandler
+from django.http import HttpResponseServerError
+from django.utils.encoding import force_unicode
+from django.utils.importlib import import_module
 from requests import get
 
+from .presence import ObserverAgent
+from .state import state
 from .thread import gThread
 from .signals import httpd_ready
 
+from cyme import conf
+
+#: Not defined by the socket module in Python 2.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                       15 if sys.platform.startswith('linux') else None)
+
+
+class FastRouter(object):
+    """WSGI application calling the views listed in
+    :attr:`cyme.api.urls.fast` directly.
+
+    :param handler: WSGI application handling all other requests
+        (the Django WSGI handler).
+    :keyword urlconf: Module with the ``urlpatterns`` and ``fast``
+        attributes (default is :mod:`cyme.api.urls`).
+
+    A request is only routed directly if the URL patterns listed
+    before the view in ``urlpatterns`` would not match it,
+    so that requests are dispatched to the same views as before.
+
+    """
+    request_class = djwsgi.WSGIRequest
+
+    def __init__(self, handler, urlconf='cyme.api.urls'):
+        self.handler = handler
+        urlconf = import_module(urlconf)
+        self.routes = self.get_routes(urlconf)
+        self.names = dict((view, name)
+                            for name, view in urlconf.fast.iteritems())
+        self.logger = logging.getLogger('cyme.branch.httpd')
+
+    def get_routes(self, urlconf):
+        fast = set(urlconf.fast.values())
+        routes, preceding = [], []
+        for pattern in urlconf.urlpatterns:
+            if getattr(pattern, 'callback', None) in fast:
+                routes.append((pattern.regex, pattern.callback,
+                               list(preceding)))
+            preceding.append(pattern.regex)
+        return routes
+
+    def match(self, path):
+        for regex, view, preceding in self.routes:
+            m = regex.search(path)
+            if m:
+                if any(p.search(path) for p in preceding):
+                    return
+                return view, m.groupdict()
+
+    def route_name(self, path):
+        """Returns the name of the fast view serving ``path``,
+        or :const:`None` if not served by the fast path."""
+        path = force_unicode(path)
+        route = self.match(path[1:] if path.startswith('/') else path)
+        if route is not None:
+            return self.names[route[0]]
+
+    def __call__(self, environ, start_response):
+        path = force_unicode(environ.get('PATH_INFO', '/'))
+        route = self.match(path[1:] if path.startswith('/') else path)
+        if route is None:
+            return self.handler(environ, start_response)
+        view, kwargs = route
+        signals.request_started.send(sender=self.__class__)
+        try:
+            response = view(self.request_class(environ), **kwargs)
+        except Exception:
+            self.logger.error('Internal Server Error: %s', path,
+                              exc_info=sys.exc_info())
+            response = HttpResponseServerError()
+        finally:
+            signals.request_finished.send(sender=self.__class__)
+        start_response('%s %s' % (response.status_code,
+                                  djwsgi.STATUS_CODE_TEXT.get(
+                                      response.status_code, 'UNKNOWN')),
+                       [(str(k), str(v)) for k, v in response.items()])
+        return response
+
+
+class AdmissionControl(object):
+    """WSGI middleware limiting the number of requests
+    processed concurrently.
+
+    :param app: The WSGI application.
+    :keyword route_name: Function returning the name of the route
+        serving a path, used for the per-route limits.
+    :keyword max_requests: Max requests processed concurrently
+        (default is ``CYME_HTTP_MAX_REQUESTS``).
+    :keyword route_limits: Max requests processed concurrently
+        by route name (default is ``CYME_HTTP_ROUTE_LIMITS``).
+    :keyword queue_timeout: Max time in seconds a request waits for
+        capacity (default is ``CYME_HTTP_QUEUE_TIMEOUT``).
+    :keyword max_waiting: Max requests waiting for capacity at once
+        (default is ``CYME_HTTP_MAX_WAITING``).
+
+    Requests waiting for longer than the timeout, or arriving when
+    too many requests are already waiting, are rejected with
+    ``503 Service Unavailable``, and a ``Retry-After`` header.
+    Requests to the routes in :attr:`unlimited` are always processed,
+    so the branch can still be pinged, and tasks applied.
+
+    A request is counted until its response body has been sent,
+    so streaming responses are included.
+
+    """
+
+    #: Routes never limited.
+    unlimited = frozenset(['ping', 'apply', 'apply_many'])
+
+    #: Value of the ``Retry-After`` header (in seconds as an int).
+    retry_after = 1
+
+    #: Number of requests rejected.
+    rejected = 0
+
+    #: Number of requests currently waiting for capacity.
+    waiting = 0
+
+    def __init__(self, app, route_name=None, max_requests=None,
+            route_limits=None, queue_timeout=None, max_waiting=None):
+        self.app = app
+        self.route_name = route_name or (lambda path: None)
+        self.max_requests = (conf.CYME_HTTP_MAX_REQUESTS
+                                if max_requests is None else max_requests)
+        self.semaphore = (Semaphore(self.max_requests)
+                            if self.max_requests else None)
+        route_limits = (conf.CYME_HTTP_ROUTE_LIMITS
+                            if route_limits is None else route_limits)
+        self.route_semaphores = dict((name, Semaphore(limit))
+                                for name, limit in route_limits.iteritems())
+        self.queue_timeout = (conf.CYME_HTTP_QUEUE_TIMEOUT
+                                if queue_timeout is None else queue_timeout)
+        self.max_waiting = (conf.CYME_HTTP_MAX_WAITING
+                                if max_waiting is None else max_waiting)
+        self.logger = logging.getLogger('cyme.branch.httpd')
+
+    def __call__(self, environ, start_response):
+        route = self.route_name(environ.get('PATH_INFO', '/'))
+        if route in self.unlimited:
+            return self.app(environ, start_response)
+        deadline = time() + self.queue_timeout
+        acquired = []
+        for semaphore in (self.route_semaphores.get(route), self.semaphore):
+            if semaphore is not None:
+                if not self._acquire(semaphore, deadline - time()):
+                    self._release(acquired)
+                    return self.reject(environ, start_response)
+                acquired.append(semaphore)
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._release(acquired)
+            raise
+        return ReleasingIterable(result, lambda: self._release(acquired))
+
+    def reject(self, environ, start_response):
+        self.rejected += 1
+        self.logger.warning('Overloaded: rejecting request for %s',
+                            environ.get('PATH_INFO'))
+        start_response('503 SERVICE UNAVAILABLE',
+                       [('Content-Type', 'application/json'),
+                        ('Retry-After', str(self.retry_after))])
+        return [serialize({'nok': 'Too many requests, try again later.'})]
+
+    def _acquire(self, semaphore, timeout):
+        if semaphore.acquire(blocking=False):
+            return True
+        if timeout <= 0 or (self.max_waiting is not None and
+                                self.waiting >= self.max_waiting):
+            return False
+        self.waiting += 1
+        try:
+            with Timeout(timeout, False):
+                return semaphore.acquire()
+            return False
+        finally:
+            self.waiting -= 1
+
+    def _release(self, acquired):
+        for semaphore in acquired:
+            semaphore.release()
+        acquired[:] = []
+
+
+class ReleasingIterable(object):
+    """Response body calling ``release`` when closed by the server."""
+
+    def __init__(self, iterable, release):
+        self.iterable = iterable
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.release()
+
 
 class HttpServer(gThread):
+    """The HTTP server thread.
+
+    :keyword addrport: Tuple of ``(host, port)`` to listen on.
+    :keyword backlog: Max pending connections
+        (default is ``CYME_HTTP_BACKLOG``).
+    :keyword keepalive: Keep connections open between requests
+        (default is ``CYME_HTTP_KEEPALIVE``).
+    :keyword nodelay: Set ``TCP_NODELAY`` on connections
+        (default is ``CYME_HTTP_NODELAY``).
+    :keyword idle_timeout: Close connections idle for this long
+        (default is ``CYME_HTTP_IDLE_TIMEOUT``).
+    :keyword max_connections: Max connections served at once
+        (default is ``CYME_HTTP_MAX_CONNECTIONS``).
+    :keyword workers: Number of processes serving requests, including
+        this one (default is ``CYME_HTTP_WORKERS``).  More than one
+        requires ``CYME_RATE_LIMITS`` and ``CYME_ASYNC_OPERATIONS``
+        to be disabled, as these are kept in memory by every process
+        (raises :exc:`~django.core.exceptions.ImproperlyConfigured`).
+
+    """
     joinable = False
 
-    def __init__(self, addrport=None):
+    #: Set in the worker processes, to the number of the worker.
+    worker_index = None
+
+    #: Time in seconds to wait before restarting a worker that exited.
+    restart_delay = 1.0
+
+    def __init__(self, addrport=None, backlog=None, keepalive=None,
+            nodelay=None, idle_timeout=None, workers=None,
+            max_connections=None):
         host, port = addrport or ('', 8000)
         if host == 'localhost':
             # dnspython bug?
             host = '127.0.0.1'
         self.host, self.port = self.addrport = (host, port)
+        self.backlog = backlog or conf.CYME_HTTP_BACKLOG
+        self.keepalive = (conf.CYME_HTTP_KEEPALIVE
+                            if keepalive is None else keepalive)
+        self.nodelay = conf.CYME_HTTP_NODELAY if nodelay is None else nodelay
+        self.idle_timeout = (conf.CYME_HTTP_IDLE_TIMEOUT
+                                if idle_timeout is None else idle_timeout)
+        self.max_connections = (max_connections or
+                                conf.CYME_HTTP_MAX_CONNECTIONS)
+        self.workers = max(workers or conf.CYME_HTTP_WORKERS, 1)
+        if self.workers > 1 and (conf.CYME_RATE_LIMITS or
+                                 conf.CYME_ASYNC_OPERATIONS):
+            raise ImproperlyConfigured(
+                'CYME_HTTP_WORKERS is %s, but rate limits and async '
+                'operations are kept in memory by every process: set '
+                'CYME_RATE_LIMITS and CYME_ASYNC_OPERATIONS to False '
+                'to use several HTTP workers.' % (self.workers, ))
+        self.workers_pid = None
         super(HttpServer, self).__init__()
 
     def server(self, sock, handler):
         return wsgi.server(sock, handler,
                            log=self.create_log(),
-                           protocol=self.create_http_protocol())
+                           protocol=self.create_http_protocol(),
+                           keepalive=self.keepalive,
+                           socket_timeout=self.idle_timeout or None,
+                           max_size=self.max_connections)
+
+    def listen(self):
+        """Returns the socket to accept connections from."""
+        if self.workers > 1:
+            sock = self.listen_shared()
+        else:
+            sock = listen(self.addrport, backlog=self.backlog)
+        if self.nodelay:
+            # inherited by the accepted sockets.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def listen_shared(self):
+        """Returns a socket listening on a port shared with the other
+        worker processes, the connections being distributed between
+        the processes by the kernel."""
+        if SO_REUSEPORT is None:
+            raise NotImplementedError(
+                'SO_REUSEPORT is not supported by this platform')
+        sock = green_socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        sock.bind(self.addrport)
+        sock.listen(self.backlog)
+        return sock
+
+    def fork_workers(self):
+        """Start the worker processes serving requests in addition to
+        this process (``workers - 1``).
+
+        Must be called before any other thread is started, as the
+        threads would also run in the worker processes.
+
+        The workers only serve HTTP requests, forwarding the requests
+        to the actors using the broker, as any client does.  They follow
+        the agents using presence without announcing themselves (see
+        :class:`~cyme.branch.presence.ObserverAgent`).
+        They are forked by a process started here, which forks them
+        again if they exit (see :meth:`supervise_workers`).
+
+        """
+        if self.workers > 1:
+            pid = os.fork()
+            if not pid:
+                self.supervise_workers()  # never returns
+            self.workers_pid = pid
+
+    def supervise_workers(self):
+        """Fork the worker processes, and fork them again if they exit
+        until stopped (in the process started by :meth:`fork_workers`)."""
+        workers, stopping = {}, []
+
+        def stop(*args):
+            stopping.append(True)
+            for pid in workers:
+                self._kill(pid)
+
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, stop)
+            set_process_title('cyme-branch', info='http workers')
+            self.reset_hub()
+            for index in xrange(1, self.workers):
+                workers[self.fork_worker(index)] = index
+            while workers:
+                try:
+                    pid, status = os.waitpid(-1, 0)
+                except OSError, exc:
+                    if exc.errno == errno.EINTR:
+                        continue
+                    raise
+                index = workers.pop(pid, None)
+                if index is None or stopping:
+                    continue
+                self.error('HTTP worker %s exited (status %s), restarting',
+                           index, status)
+                sleep(self.restart_delay)
+                if not stopping:
+                    workers[self.fork_worker(index)] = index
+        except BaseException, exc:
+            self.error('HTTP workers supervisor exited: %r', exc,
+                       exc_info=True)
+        finally:
+            os._exit(0)
+
+    def fork_worker(self, index):
+        pid = os.fork()
+        if not pid:
+            self.run_worker(index)  # never returns
+        return pid
+
+    def run_worker(self, index):
+        self.worker_index = index
+        state.is_http_worker = True
+        exitcode = 0
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: os._exit(0))
+            set_process_title('cyme-branch', info='http worker %s' % index)
+            self.after_fork()
+            self.run()
+        except BaseException, exc:
+            exitcode = 1
+            self.error('HTTP worker %s exited: %r', index, exc,
+                       exc_info=True)
+        finally:
+            os._exit(exitcode)
+
+    def after_fork(self):
+        # connections cannot be shared with the parent process
+        # (the broker connections are not established yet).
+        from .controller import apps, branches, instances, queues
+        db.close_connection()
+        self.reset_hub()
+        # the agents are followed to know how many replies to wait for.
+        agent = ObserverAgent(celery.broker_connection())
+        for actor in (apps, branches, instances, queues):
+            actor.connection = celery.broker_connection()
+            actor.agent = agent
+        agent.presence.start()
+
+    def reset_hub(self):
+        # the epoll/kqueue instance of the hub is shared with the parent
+        # process, so the events for our sockets would be received by both.
+        hub = get_hub()
+        poll = getattr(hub, 'poll', None)
+        if hasattr(poll, 'close'):
+            hub.poll = poll.__class__()
+            hub.modify = getattr(hub.poll, 'modify', hub.poll.register)
+
+    def stop_workers(self):
+        if self.workers_pid:
+            # the supervisor stops the workers before exiting.
+            self._kill(self.workers_pid)
+            try:
+                os.waitpid(self.workers_pid, 0)
+            except OSError, exc:
+                if exc.errno != errno.ECHILD:
+                    raise
+            self.workers_pid = None
+
+    def _kill(self, pid, signum=signal.SIGTERM):
+        try:
+            os.kill(pid, signum)
+        except OSError, exc:
+            if exc.errno != errno.ESRCH:
+                raise
 
     def run(self):
-        handler = AdminMediaHandler(djwsgi.WSGIHandler())
-        sock = listen(self.addrport)
+        router = FastRouter(AdminMediaHandler(djwsgi.WSGIHandler()))
+        handler = AdmissionControl(router, route_name=router.route_name)
+        if handler.max_requests and handler.max_waiting is not None and \
+                self.max_connections <= (handler.max_requests +
+                                         handler.max_waiting):
+            self.warn('max_connections (%s) should be well above '
+                      'max_requests + max_waiting (%s)',
+                      self.max_connections,
+                      handler.max_requests + handler.max_waiting)
+        sock = self.listen()
         g = self.spawn(self.server, sock, handler)
         self.info('ready')
-        httpd_ready.send(sender=self, addrport=self.addrport,
-                         handler=handler, sock=sock)
+        if self.worker_index is None:
+            httpd_ready.send(sender=self, addrport=self.addrport,
+                             handler=handler, sock=sock)
         return g.wait()
 
+    def after(self):
+        self.stop_workers()
+
     def _do_ping(self, timeout):
         return get(self.url + '/ping/', timeout=timeout).ok
 
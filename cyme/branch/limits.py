@@ -0,0 +1,135 @@
+"""cyme.branch.limits
+
+- Rate limits of the webhooks applied by apps, and optionally
+  by queue (see :attr:`cyme.models.App.rate_limit` and
+  :attr:`cyme.models.App.queue_rate_limits`).
+
+- Limits use the format of Celery task rate limits
+  (e.g. ``"100/s"``, ``"10/m"``), and are enforced by every branch
+  using token buckets kept in memory.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+from anyjson import deserialize
+from celery.datastructures import TokenBucket
+from celery.utils.timeutils import rate
+
+from cyme import conf
+
+
+def validate(rate_limit=None, queue_rate_limits=None):
+    """Raises :exc:`ValueError` if the rate limit cannot be parsed,
+    or if the rate limits of the queues are not a JSON encoded object
+    mapping queue names to rate limits."""
+    try:
+        if rate_limit:
+            rate(rate_limit)
+        if queue_rate_limits:
+            limits = deserialize(queue_rate_limits)
+            if not isinstance(limits, dict):
+                raise ValueError('Queue rate limits must be an object.')
+            for queue, limit in limits.iteritems():
+                if limit is not None and not isinstance(limit, basestring):
+                    raise ValueError('Rate limit of %r is not a string.' % (
+                                        queue, ))
+                if limit:
+                    rate(limit)
+    except (TypeError, KeyError, ValueError), exc:
+        raise ValueError(exc)
+
+
+class RateLimits(object):
+    """Token buckets for the rate limits of apps and queues.
+
+    :keyword burst: Number of seconds worth of requests that can be
+        accepted at once (default is ``CYME_RATE_LIMIT_BURST``).
+    :keyword enabled: If disabled all requests are accepted
+        (default is ``CYME_RATE_LIMITS``).
+
+    The number of ``accepted`` and ``rejected`` webhooks is counted
+    for every app (see :meth:`stats`).
+
+    """
+    Bucket = TokenBucket
+
+    def __init__(self, burst=None, enabled=None):
+        self.burst = conf.CYME_RATE_LIMIT_BURST if burst is None else burst
+        self.enabled = conf.CYME_RATE_LIMITS if enabled is None else enabled
+        self._buckets = {}
+        self._counters = defaultdict(lambda: {'accepted': 0,
+                                              'rejected': 0})
+
+    def consume(self, app, queue=None):
+        """Consume one request for ``app`` (and ``queue`` if given).
+
+        Returns zero if the request is accepted, or the number of
+        seconds until the request can be accepted if rejected.
+
+        """
+        return self.consume_many(app, {queue: 1})
+
+    def consume_many(self, app, counts):
+        """Consume the webhooks for ``app`` counted by queue
+        (``{queue: n}``, where the queue is :const:`None` for webhooks
+        not sent to a queue), either all of them or none.
+
+        Returns zero if accepted, or the number of seconds until the
+        webhooks can be accepted if rejected.  More webhooks than a
+        bucket can hold are accepted once the bucket is full, delaying
+        the following requests until the tokens are refilled.
+
+        """
+        if not self.enabled:
+            return 0
+        total = sum(counts.itervalues())
+        wanted = [(self.bucket((app.name, None), app.rate_limit), total)]
+        queue_limits = app.get_queue_rate_limits() if any(counts) else {}
+        for queue, n in counts.iteritems():
+            if queue:
+                wanted.append((self.bucket((app.name, queue),
+                                           queue_limits.get(queue)), n))
+        wanted = [(bucket, n) for bucket, n in wanted if bucket is not None]
+        # the webhooks must be accepted by all the buckets
+        # before consuming from any of them.
+        wait = max([bucket.expected_time(min(n, bucket.capacity))
+                        for bucket, n in wanted] or [0])
+        counters = self._counters[app.name]
+        if wait:
+            counters['rejected'] += total
+            return wait
+        for bucket, n in wanted:
+            if not bucket.can_consume(n):
+                # more than the bucket can hold: owed by the next requests.
+                bucket._tokens -= n
+        counters['accepted'] += total
+        return 0
+
+    def bucket(self, key, limit):
+        """Returns the bucket for ``key``, or :const:`None`
+        if there is no limit."""
+        if not limit:
+            self._buckets.pop(key, None)
+            return
+        try:
+            current, bucket = self._buckets[key]
+        except KeyError:
+            pass
+        else:
+            if current == limit:
+                return bucket
+        fill_rate = rate(limit)
+        if not fill_rate:
+            return
+        bucket = self.Bucket(fill_rate,
+                             capacity=max(1, fill_rate * self.burst))
+        self._buckets[key] = (limit, bucket)
+        return bucket
+
+    def stats(self):
+        return dict(self._counters)
+
+rate_limits = RateLimits()
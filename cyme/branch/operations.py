@@ -0,0 +1,122 @@
+"""cyme.branch.operations
+
+- Operations requested without waiting for the result (``nowait``)
+  are applied in the background by the branch receiving the request,
+  and can be tracked using the id returned.
+
+- The table of operations is kept in memory and bounded, so the
+  oldest finished operations are forgotten.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import sys
+
+from time import time
+from traceback import format_exception
+
+from eventlet import Timeout, spawn
+from eventlet.event import Event
+from kombu.utils.compat import OrderedDict
+from kombu.utils.encoding import safe_repr
+
+from cyme import conf
+from cyme.utils import uuid
+
+PENDING = 'PENDING'
+STARTED = 'STARTED'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+
+
+class Operation(object):
+    """An operation applied in the background."""
+
+    def __init__(self, name, id=None):
+        self.name = name
+        self.id = id or uuid()
+        self.state = PENDING
+        self.created = time()
+        self.started = self.finished = None
+        self.result = self.error = None
+        self._done = Event()
+
+    def apply(self, fun, *args, **kwargs):
+        self.state, self.started = STARTED, time()
+        try:
+            self.result = fun(*args, **kwargs)
+            self.state = SUCCESS
+        except Exception, exc:
+            self.error = [safe_repr(exc),
+                          ''.join(format_exception(*sys.exc_info()))]
+            self.state = FAILURE
+        finally:
+            self.finished = time()
+            self._done.send(True)
+
+    def wait(self, timeout=None):
+        """Wait for the operation to finish, for at most ``timeout``
+        seconds.  Returns :const:`True` if finished."""
+        with Timeout(timeout, False):
+            self._done.wait()
+        return self.ready()
+
+    def ready(self):
+        return self._done.ready()
+
+    def as_dict(self):
+        return {'id': self.id,
+                'name': self.name,
+                'state': self.state,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+                'result': self.result,
+                'error': self.error}
+
+
+class Operations(object):
+    """Table of the operations applied in the background.
+
+    :keyword max_size: Max number of operations kept
+        (default is ``CYME_OPERATIONS_MAX``).
+
+    """
+    Operation = Operation
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or conf.CYME_OPERATIONS_MAX
+        self._operations = OrderedDict()
+
+    def spawn(self, name, fun, *args, **kwargs):
+        """Apply ``fun(*args, **kwargs)`` in the background,
+        and return the :class:`Operation`."""
+        op = self.Operation(name)
+        self._operations[op.id] = op
+        self._evict()
+        spawn(op.apply, fun, *args, **kwargs)
+        return op
+
+    def get(self, id):
+        """Returns the operation by id, or raises :exc:`KeyError`
+        if unknown or forgotten."""
+        return self._operations[id]
+
+    def _evict(self):
+        # forget the oldest finished operations first,
+        # or the oldest operations if none have finished.
+        excess = len(self._operations) - self.max_size
+        if excess > 0:
+            finished = [id for id, op in self._operations.iteritems()
+                            if op.ready()][:excess]
+            for id in finished:
+                self._operations.pop(id, None)
+            while len(self._operations) > self.max_size:
+                self._operations.popitem(last=False)
+
+    def __len__(self):
+        return len(self._operations)
+
+operations = Operations()
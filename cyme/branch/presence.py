@@ -0,0 +1,319 @@
+"""cyme.branch.presence
+
+- Presence sending incremental metadata.
+
+- The names of the instances and queues owned by a branch are cached
+  and versioned, so that announcements only contain the names
+  added and removed since the previous announcement.
+
+- An agent missing an announcement will detect the gap in versions,
+  and request the owner to send the full metadata again.
+
+- Processes without actors (the HTTP workers) can follow the agents
+  without announcing themselves, see :class:`ObserverAgent`.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from time import time
+
+from cl import presence
+from django.db.models.signals import post_delete, post_save
+
+from cyme.utils import cached_property, uuid
+from cyme.utils.actors import AwareAgent, select_serializer
+
+
+class ModelNames(object):
+    """Cached set of the names of all the objects of a model.
+
+    The set is versioned, and a log of the most recent changes is kept
+    so that the changes since a previous version can be found.
+
+    The :attr:`revision` is increased whenever any object is changed,
+    not only the names, and is used for the entity tags of the listings
+    (see :attr:`etag`).
+
+    """
+
+    #: Max number of changes to keep, agents knowing an older version
+    #: must receive the full set.
+    max_changes = 256
+
+    _registry = {}
+
+    def __init__(self, model):
+        self.model = model
+        self.version = 0
+        self.revision = 0
+        # revisions restart from zero with the process,
+        # so the tags must also include an id unique to this process.
+        self.epoch = uuid()
+        self.changes = deque()
+        # loaded before connecting, so that every save following
+        # is seen as a change (a lazy load would include it already).
+        self.by_pk = dict(model._default_manager.values_list('id', 'name'))
+        post_save.connect(self._on_save, sender=model, weak=False)
+        post_delete.connect(self._on_delete, sender=model, weak=False)
+
+    @classmethod
+    def for_model(cls, model):
+        """Returns the shared instance for ``model``."""
+        try:
+            return cls._registry[model]
+        except KeyError:
+            return cls._registry.setdefault(model, cls(model))
+
+    def delta(self, since):
+        """Returns a tuple of the names ``(added, removed)`` since
+        version ``since``, or :const:`None` if the changes are no longer
+        available."""
+        if since == self.version:
+            return [], []
+        if since > self.version or \
+                not self.changes or self.changes[0][0] > since + 1:
+            return None
+        first, last = {}, {}
+        for version, name, is_added in self.changes:
+            if version > since:
+                first.setdefault(name, is_added)
+                last[name] = is_added
+        # names both added and removed since are not included.
+        return (sorted(name for name, is_added in last.iteritems()
+                            if is_added),
+                sorted(name for name, is_added in last.iteritems()
+                            if not is_added and not first[name]))
+
+    def _changed(self, name, is_added):
+        self.version += 1
+        self.changes.append((self.version, name, is_added))
+        if len(self.changes) > self.max_changes:
+            self.changes.popleft()
+
+    def _on_save(self, instance=None, **kwargs):
+        self.revision += 1
+        by_pk = self.by_pk
+        previous = by_pk.get(instance.pk)
+        if previous != instance.name:
+            by_pk[instance.pk] = instance.name
+            if previous is not None:
+                self._changed(previous, False)
+            self._changed(instance.name, True)
+
+    def _on_delete(self, instance=None, **kwargs):
+        self.revision += 1
+        name = self.by_pk.pop(instance.pk, None)
+        if name is not None:
+            self._changed(name, False)
+
+    @property
+    def etag(self):
+        """Tag changing whenever any object is changed."""
+        return '%s.%s' % (self.epoch, self.revision)
+
+    @property
+    def names(self):
+        return self.by_pk.values()
+
+
+class State(presence.State):
+    """Presence state, applying the metadata deltas received."""
+
+    #: Min time in seconds between resync requests sent to the same agent.
+    resync_interval = 5.0
+
+    def __init__(self, presence):
+        super(State, self).__init__(presence)
+        self.handlers['resync'] = self.when_resync
+        self._versions = defaultdict(dict)
+        self._etags = defaultdict(dict)
+        self._resync_requested = {}
+
+    def when_online(self, agent=None, **kw):
+        super(State, self).when_online(agent, **kw)
+        if agent != self.presence.agent.id:
+            # new agents must receive the full metadata.
+            self.presence.send_heartbeat(full=True)
+
+    def when_wakeup(self, agent=None, **kw):
+        # the event carries the changes that made the agent wake us up.
+        self._update_agent(agent, kw)
+        super(State, self).when_wakeup(**kw)
+
+    def when_resync(self, agent=None, target=None, **kw):
+        # requests without target are sent by observers.
+        if target in (None, self.presence.agent.id):
+            self.presence.send_heartbeat(full=True)
+
+    def update_meta_for(self, agent, meta):
+        self._agents[agent].setdefault('meta', {}).update(meta)
+
+    def apply_meta_delta(self, agent, delta):
+        meta = self._agents[agent].setdefault('meta', {})
+        versions = self._versions[agent]
+        gap = False
+        for actor, d in delta.iteritems():
+            version = d['version']
+            if 'etag' in d:
+                self._etags[agent][actor] = d['etag']
+            if 'full' in d:
+                meta[actor] = dict((section, set(values))
+                                for section, values in d['full'].iteritems())
+                versions[actor] = version
+            elif versions.get(actor) == version:
+                pass
+            elif actor in meta and versions.get(actor) == d.get('base'):
+                for section, names in d.get('added', {}).iteritems():
+                    meta[actor].setdefault(section, set()).update(names)
+                for section, names in d.get('removed', {}).iteritems():
+                    meta[actor].get(section, set()).difference_update(names)
+                versions[actor] = version
+            else:
+                gap = True
+        if gap:
+            self.request_resync(agent)
+
+    def etags_for(self, actor):
+        """Returns a sorted list of ``(agent, etag)`` tuples with the
+        last tag announced for ``actor`` by every live agent."""
+        return sorted((agent, self._etags[agent].get(actor))
+                        for agent, info in self.agents.iteritems() if info)
+
+    def request_resync(self, agent):
+        if time() > self._resync_requested.get(agent, 0) + \
+                self.resync_interval:
+            self._resync_requested[agent] = time()
+            self.debug('version gap: requesting resync from %s', agent)
+            self.presence.send_resync_request(agent)
+
+    def _update_agent(self, agent, kw):
+        kw = dict(kw)
+        delta = kw.pop('meta_delta', None)
+        super(State, self)._update_agent(agent, kw)
+        if delta:
+            self.apply_meta_delta(agent, delta)
+
+    def _remove_agent(self, agent):
+        super(State, self)._remove_agent(agent)
+        self._versions.pop(agent, None)
+        self._etags.pop(agent, None)
+
+
+class Presence(presence.Presence):
+    """Presence sending metadata of actors with versioned names
+    as deltas (see :attr:`ModelActor.versioned_names`)."""
+    State = State
+
+    def __init__(self, *args, **kwargs):
+        super(Presence, self).__init__(*args, **kwargs)
+        self._announced = {}
+
+    @cached_property
+    def serializer(self):
+        return select_serializer()
+
+    def create_event(self, type, full=False):
+        event = super(Presence, self).create_event(type)
+        event['meta_delta'] = self.meta_delta(full)
+        return event
+
+    def meta(self):
+        return dict((actor.name, actor.meta) for actor in self.agent.actors
+                        if self.versioned_names(actor) is None)
+
+    def meta_delta(self, full=False):
+        delta = {}
+        for actor in self.agent.actors:
+            names = self.versioned_names(actor)
+            if names is not None:
+                delta[actor.name] = self._actor_delta(actor, names, full)
+        return delta
+
+    def _actor_delta(self, actor, names, full=False):
+        version, base = names.version, self._announced.get(actor.name)
+        changes = None
+        if not full and base is not None:
+            changes = names.delta(base)
+        self._announced[actor.name] = version
+        if changes is None:
+            return {'version': version, 'etag': names.etag,
+                    'full': actor.meta}
+        d = {'version': version, 'etag': names.etag, 'base': base}
+        added, removed = changes
+        section = actor.meta_lookup_section
+        if added:
+            d['added'] = {section: added}
+        if removed:
+            d['removed'] = {section: removed}
+        return d
+
+    def _announce(self, event, producer=None):
+        producer.publish(event, exchange=self.exchange.name,
+                                routing_key=self.agent.id,
+                                serializer=self.serializer)
+
+    def versioned_names(self, actor):
+        return getattr(actor, 'versioned_names', None)
+
+    def send_heartbeat(self, full=False):
+        return self.announce(self.create_event('heartbeat', full=full))
+
+    def send_online(self):
+        return self.announce(self.create_event('online', full=True))
+
+    def send_resync_request(self, agent):
+        return self.announce(self.Event(agent=self.agent.id,
+                                        event='resync',
+                                        target=agent,
+                                        ts=time()))
+
+
+class Observer(Presence):
+    """Presence following the other agents without announcing itself,
+    so that it is not seen as an agent by the others.
+
+    The agents are asked to send their full metadata when started,
+    instead of waiting for their next heartbeat.
+
+    """
+
+    @contextmanager
+    def extra_context(self, connection, channel):
+        self.send_resync_request(None)
+        yield
+
+    def send_heartbeat(self, full=False):
+        pass
+
+    def send_online(self):
+        pass
+
+    def send_offline(self):
+        pass
+
+
+class ObserverAgent(AwareAgent):
+    """Agent without actors, used to send requests to the agents known
+    by presence (see :class:`Observer`), e.g. by the HTTP workers.
+
+    Until an agent is known the requests are sent to all agents,
+    waiting for the replies until the timeout.
+
+    """
+    actors = []
+
+    def get_default_scatter_limit(self, actor):
+        if self.presence.can(actor):
+            return super(ObserverAgent, self).get_default_scatter_limit(actor)
+
+    def lookup_agent(self, pred, *sections):
+        if self.presence.state.agents:
+            return super(ObserverAgent, self).lookup_agent(pred, *sections)
+
+    @cached_property
+    def presence(self):
+        return Observer(self)
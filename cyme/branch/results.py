@@ -0,0 +1,165 @@
+"""cyme.branch.results
+
+- Waits for the results of many tasks at once.
+
+- All the requests waiting for task results share one polling loop,
+  so the result backend is polled once every interval for all the
+  pending tasks, instead of once for every task and request.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+from time import sleep, time
+
+from celery import current_app as celery
+from celery import states
+from celery.backends.base import KeyValueStoreBackend
+from eventlet.queue import Empty, LightQueue
+from kombu.utils.encoding import safe_repr
+
+from cyme import conf
+
+from .thread import gThread
+
+
+def fetch_many(task_ids, backend=None):
+    """Returns a dictionary of ``{task_id: meta}`` with the metadata
+    of all the tasks in ``task_ids``.
+
+    The metadata is retrieved using one operation if the backend
+    supports it (``mget``), or one task at a time otherwise.
+
+    """
+    backend = backend or celery.backend
+    metas, missing = {}, []
+    cache = getattr(backend, '_cache', {})
+    for task_id in task_ids:
+        cached = cache.get(task_id)
+        if cached and cached['status'] in states.READY_STATES:
+            metas[task_id] = cached
+        else:
+            missing.append(task_id)
+    if missing and isinstance(backend, KeyValueStoreBackend):
+        try:
+            values = backend.mget([backend.get_key_for_task(task_id)
+                                    for task_id in missing])
+        except NotImplementedError:
+            pass
+        else:
+            found = backend._mget_to_results(values, missing)
+            cache.update((task_id, meta) for task_id, meta in found.iteritems()
+                            if meta['status'] in states.READY_STATES)
+            metas.update(found)
+            for task_id in missing:
+                metas.setdefault(task_id, {'status': states.PENDING,
+                                           'result': None})
+            return metas
+    for task_id in missing:
+        metas[task_id] = backend.get_task_meta(task_id)
+    return metas
+
+
+def as_dict(task_id, meta):
+    """Returns the task metadata as a JSON serializable dictionary."""
+    result = meta.get('result')
+    if isinstance(result, BaseException):
+        result = safe_repr(result)
+    return {'uuid': task_id, 'state': meta['status'], 'result': result}
+
+
+class ResultPoller(gThread):
+    """Polls the result backend for the tasks being waited for.
+
+    :keyword interval: Time in seconds between polls (int/float),
+        default is ``CYME_RESULT_POLL_INTERVAL``.
+    :keyword backend: The result backend (default is ``celery.backend``).
+
+    """
+
+    def __init__(self, interval=None, backend=None):
+        self.interval = interval or conf.CYME_RESULT_POLL_INTERVAL
+        self._backend = backend
+        self._waiters = defaultdict(set)
+        super(ResultPoller, self).__init__()
+
+    def run(self):
+        while not self.should_stop:
+            if self._waiters:
+                try:
+                    self.poll()
+                except Exception, exc:
+                    self.error('Cannot poll result backend: %r', exc,
+                               exc_info=True)
+            sleep(self.interval)
+
+    def poll(self):
+        """Retrieve the state of all the tasks being waited for,
+        and notify the waiters of the tasks that are ready."""
+        metas = fetch_many(list(self._waiters), self.backend)
+        for task_id, meta in metas.iteritems():
+            if meta['status'] in states.READY_STATES:
+                for queue in self._waiters.pop(task_id, ()):
+                    queue.put((task_id, meta))
+
+    def wait(self, task_ids, timeout=None):
+        """Iterate over ``(task_id, meta)`` tuples for the tasks
+        in ``task_ids`` as they become ready.
+
+        Stops when all the tasks are ready, or when ``timeout``
+        (in seconds as an int/float) is exceeded.
+
+        """
+        pending = set(task_ids)
+        queue = LightQueue()
+        for task_id in pending:
+            self._waiters[task_id].add(queue)
+        deadline = time() + timeout if timeout else None
+        try:
+            while pending:
+                remaining = deadline - time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    task_id, meta = queue.get(timeout=remaining)
+                except Empty:
+                    break
+                pending.discard(task_id)
+                yield task_id, meta
+        finally:
+            for task_id in pending:
+                waiters = self._waiters.get(task_id)
+                if waiters is not None:
+                    waiters.discard(queue)
+                    if not waiters:
+                        self._waiters.pop(task_id, None)
+
+    @property
+    def backend(self):
+        return self._backend or celery.backend
+
+    @property
+    def logger_name(self):
+        return 'Results'
+
+
+class Results(object):
+    """Keeps the :class:`ResultPoller` shared by all waiters,
+    started when the first waiter arrives."""
+    Poller = ResultPoller
+    poller = None
+
+    def wait(self, task_ids, timeout=None):
+        """See :meth:`ResultPoller.wait`."""
+        if self.poller is None:
+            self.poller = self.Poller()
+            self.poller.start()
+        return self.poller.wait(task_ids, timeout=timeout)
+
+    def stop(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+
+results = Results()
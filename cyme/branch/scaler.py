@@ -0,0 +1,128 @@
+"""cyme.branch.scaler
+
+- Adds and retires controllers at runtime, based on the
+  request backlog and the time it takes to process requests.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from time import sleep, time
+
+from kombu.pools import connections
+
+from .signals import scaler_ready
+from .thread import gThread
+
+
+class ControllerScaler(gThread):
+    """Keeps the number of controllers between ``min`` and ``max``.
+
+    :param branch: The :class:`~cyme.branch.Branch` owning the controllers.
+    :keyword interval: Interval between samples in seconds (int/float).
+
+    A new controller is added if the number of requests waiting
+    in the round-robin queues exceeds :attr:`backlog_per_controller`
+    for every controller, or if the requests takes longer than
+    :attr:`max_latency` to process on average.
+
+    The last controller added is retired when there are no
+    waiting requests, and it has been idle for :attr:`idle_time`
+    seconds.  The controller is drained before it is stopped,
+    so requests it has already received are not lost.
+
+    """
+
+    #: Default interval (time in seconds as a float between samples).
+    interval = 5.0
+
+    #: Add a controller when there are more requests than this
+    #: waiting per controller.
+    backlog_per_controller = 2
+
+    #: Add a controller when the average time to process a request
+    #: exceeds this (in seconds as a float).
+    max_latency = 1.0
+
+    #: Retire controllers that has been idle for this long (in seconds).
+    idle_time = 60.0
+
+    #: Max time to wait for a controller to drain (in seconds).
+    drain_timeout = 30.0
+
+    #: Min time between scaling decisions (in seconds).
+    cooldown = 10.0
+
+    _last_scaled = 0.0
+
+    def __init__(self, branch, interval=None):
+        self.branch = branch
+        self.interval = interval or self.interval
+        super(ControllerScaler, self).__init__()
+
+    def before(self):
+        self.start_periodic_timer(self.interval, self.maybe_scale)
+
+    def run(self):
+        self.info('started')
+        scaler_ready.send(sender=self)
+        while not self.should_stop:
+            self.respond_to_ping()
+            sleep(1.0)
+
+    def maybe_scale(self):
+        if time() - self._last_scaled < self.cooldown:
+            return
+        branch = self.branch
+        controllers = [c.thread for c in branch.controllers]
+        backlog = self.backlog()
+        if len(controllers) < branch.maxc and self.is_overloaded(controllers,
+                                                                 backlog):
+            self.info('backlog=%s latency=%s: adding controller',
+                      backlog, round(self.latency(controllers), 3))
+            branch.add_controller()
+            self._last_scaled = time()
+        elif len(controllers) > branch.numc and not backlog:
+            retiring = branch.controllers[-1]
+            if retiring.thread.idle_since() > self.idle_time:
+                self.info('idle: retiring controller %s', retiring.thread.id)
+                branch.remove_controller(retiring,
+                                         drain_timeout=self.drain_timeout)
+                self._last_scaled = time()
+
+    def is_overloaded(self, controllers, backlog):
+        return (backlog > self.backlog_per_controller * len(controllers)
+                or self.latency(controllers) > self.max_latency)
+
+    def latency(self, controllers):
+        # only controllers active since the last sample are considered,
+        # as the average is not updated while a controller is idle.
+        return max([c.latency for c in controllers
+                        if c.idle_since() < self.interval] or [0.0])
+
+    def backlog(self):
+        """Returns the number of requests waiting in the round-robin
+        queues of the controller actors."""
+        total = 0
+        with connections[self.branch.connection].acquire(block=True) as conn:
+            for queue in self.rr_queues():
+                # passive declare closes the channel if the queue
+                # does not exist, so we need a new channel every time.
+                channel = conn.channel()
+                try:
+                    total += queue(channel).queue_declare(passive=True)[1]
+                except conn.channel_errors:
+                    pass
+                finally:
+                    channel.close()
+        return total
+
+    def rr_queues(self):
+        for actor in self.branch.controllers[0].thread.actors:
+            if 'round-robin' in actor.types:
+                yield actor.get_rr_queue()
+
+    @property
+    def logger_name(self):
+        return 'Scaler'
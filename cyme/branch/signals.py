@@ -19,6 +19,12 @@ httpd_ready = Signal(providing_args=['addrport', 'handler', 'sock'])
 #:     :sender: is the :class:`~cyme.supervisor.Supervisor` instance.
 supervisor_ready = Signal()
 
+#: Sent when the controller scaler is ready.
+#: Arguments:
+#:
+#:     :sender: is the :class:`~cyme.branch.scaler.ControllerScaler` instance.
+scaler_ready = Signal()
+
 #: Sent when a controller is ready.
 #:
 #: Arguments:
@@ -21,6 +21,10 @@ class State(object):
     #: set to true if the process is a cyme-branch
     is_branch = False
 
+    #: set to true if the process is an HTTP worker of a cyme-branch,
+    #: which is not an agent so is not told about changes by presence.
+    is_http_worker = False
+
     def on_broker_revive(self, *args, **kwargs):
         self.broker_last_revived = time()
         self.supervisor.resume()
@@ -101,6 +101,15 @@ This will shutdown and delete an instance::
     >>> i.delete()
 
 
+Connections
+~~~~~~~~~~~
+
+Connections are kept alive and reused by all the clients (and apps)
+using the same branch, up to ``pool_size`` connections per branch::
+
+    >>> client = Client('http://localhost:8000', pool_size=20, timeout=10)
+
+
 """
 
 from __future__ import absolute_import
@@ -236,24 +245,93 @@ class Client(base.Client):
                                     routing_key=routing_key,
                                     options=options)
 
-    def __init__(self, url=None, app=None, info=None):
-        super(Client, self).__init__(url)
+    def __init__(self, url=None, app=None, info=None, **kwargs):
+        super(Client, self).__init__(url, **kwargs)
         self.app = app
         self.instances = self.Instances(self)
         self.queues = self.Queues(self)
         self.info = info or {}
 
     def add(self, name, broker=None, arguments=None, extra_config=None,
-            nowait=False):
+            nowait=False, rate_limit=None, queue_rate_limits=None):
+        """Add app, or change the rate limits of an existing app.
+
+        :keyword rate_limit: Max rate of webhooks applied by the app
+            (e.g. ``"100/s"``), an empty string removes the limit.
+        :keyword queue_rate_limits: Dictionary of ``{queue: rate_limit}``
+            with the max rates of webhooks applied to queues.
+
+        """
+        if queue_rate_limits is not None:
+            queue_rate_limits = self.serialize(queue_rate_limits)
         return self.create_model(name, self.root('POST',
                                  self.maybe_async(name, nowait),
                                  data={'broker': broker,
                                        'arguments': arguments,
-                                       'extra_config': extra_config}))
+                                       'extra_config': extra_config,
+                                       'rate_limit': rate_limit,
+                                       'queue_rate_limits':
+                                            queue_rate_limits}))
 
     def get(self, name=None):
         return self.create_model(name, self.root('GET', name or self.app))
 
+    def apply_many(self, items):
+        """Apply many webhooks using one request.
+
+        Every item is a dictionary with the ``url`` of the webhook,
+        and optionally the HTTP ``method``, ``params``, ``data`` and
+        the ``queue`` to send the task to::
+
+            >>> app.apply_many([
+            ...     {'url': 'http://example.com/a', 'queue': 'tasks'},
+            ...     {'url': 'http://example.com/b', 'method': 'POST',
+            ...      'data': {'x': 1}}])
+            {'uuids': [...], 'broker': 'amqp://guest@localhost:5672//'}
+
+        """
+        return self.POST(Path('apply'), data=self.serialize(items))
+
+    def states(self, uuids):
+        """Get the state of many tasks using one request.
+
+        Returns a dictionary of ``{uuid: state}``::
+
+            >>> app.states(['...', '...'])
+            {'...': 'SUCCESS', '...': 'PENDING'}
+
+        """
+        return self.POST(Path('query') / 'states',
+                         data=self.serialize(list(uuids)))
+
+    def results(self, uuids):
+        """Get the result of many tasks using one request.
+
+        Returns a dictionary of ``{uuid: result}``, where the result
+        is :const:`None` if the task is not ready.
+
+        """
+        return self.POST(Path('query') / 'results',
+                         data=self.serialize(list(uuids)))
+
+    def operation(self, id, wait=None):
+        """Get the state of an operation requested using ``nowait``,
+        by the id returned.
+
+        If ``wait`` is set, the branch waits for the operation to finish
+        for at most ``wait`` seconds before replying::
+
+            >>> op = app.instances.delete('foo', nowait=True)
+            >>> app.operation(op['operation'], wait=10)['state']
+            'SUCCESS'
+
+        Operations are tracked by the branch receiving the request,
+        so the client must be connected to the same branch.
+
+        """
+        return self.root('GET', Path('operations') / id,
+                         params={'wait': wait} if wait else None)
+
     def delete(self, name=None):
         return self.root('DELETE', name or self.app)
 
@@ -276,8 +354,11 @@ class Client(base.Client):
     def create_model(self, name, info):
         return self.clone(app=name, info=base.AttributeDict(info))
 
-    def clone(self, app=None, info=None):
-        return self.__class__(url=self.url, app=app, info=info)
+    def clone(self, app=None, info=None, **kwargs):
+        return self.__class__(url=self.url, app=app, info=info,
+                              pool_size=self.pool_size,
+                              timeout=self.timeout,
+                              session=self.session, **kwargs)
 
     def __repr__(self):
         url = self.build_url('')
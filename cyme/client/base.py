@@ -1,11 +1,14 @@
 """cyme.client.base"""
 
 from __future__ import absolute_import
+from __future__ import with_statement
 
 import anyjson
 import requests
 
+from threading import Lock
 from urllib import quote
+from urlparse import urlsplit
 
 from celery.datastructures import AttributeDict
 from dictshield.document import Document
@@ -81,8 +84,16 @@ class Section(Base):
             setattr(self, attr, getattr(self.client, attr))
         self.path = Path(self.name) if self.path is None else self.path
 
-    def all_names(self):
-        return self.GET(self.path)
+    def all_names(self, **params):
+        """List names, optionally filtered and paginated, e.g.::
+
+            >>> app.instances.all_names(enabled=True, limit=100)
+            {'names': [...], 'cursor': '...'}
+
+        Returns a list of names if no ``limit`` is given.
+
+        """
+        return self.GET(self.path, params=params or None)
 
     def all(self):
         return (self.get(name) for name in self.all_names())
@@ -101,6 +112,23 @@ class Section(Base):
             name = name.name
         return self.DELETE(self.maybe_async(name, nowait))
 
+    def batch(self, ops):
+        """Perform a list of operations in as few round-trips as possible.
+
+        Every operation is a ``(method, args)`` tuple, e.g.::
+
+            >>> app.instances.batch([
+            ...     ('add', {'name': 'i1'}),
+            ...     ('add_consumer', {'name': 'i1', 'queue': 'tasks'}),
+            ...     ('autoscale', {'name': 'i1', 'max': 10, 'min': 2})])
+            [{'ok': {...}}, {'ok': 'ok'}, {'ok': {'max': 10, 'min': 2}}]
+
+        """
+        return self.POST(Path('batch') / self.name,
+                         data=self.serialize([{'method': method,
+                                               'args': args or {}}
+                                                for method, args in ops]))
+
     def create_model(self, *args, **kwargs):
         model = self.Model(self,
                             **self.Model(self, *args, **kwargs).to_python())
@@ -116,11 +144,58 @@ class Section(Base):
         return repr(list(self.all()))
 
 
+class Sessions(object):
+    """HTTP sessions shared by all clients connecting to the same
+    server (scheme, host and port), so that connections are kept alive
+    and reused between requests."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._mutex = Lock()
+
+    def get(self, url, pool_size=10, timeout=None, headers=None):
+        scheme, netloc = urlsplit(url)[:2]
+        key = (scheme, netloc, pool_size, timeout)
+        try:
+            return self._sessions[key]
+        except KeyError:
+            with self._mutex:
+                if key not in self._sessions:
+                    self._sessions[key] = requests.session(
+                            headers=headers, timeout=timeout,
+                            config={'keep_alive': True,
+                                    'pool_maxsize': pool_size})
+                return self._sessions[key]
+
+    def clear(self):
+        with self._mutex:
+            self._sessions.clear()
+
+sessions = Sessions()
+
+
 class Client(Base):
+    """Client for the HTTP API at ``url``.
+
+    :keyword pool_size: Max number of connections kept alive
+        for every server (default is 10).
+    :keyword timeout: Timeout of requests in seconds (int/float),
+        default is to wait forever.
+    :keyword session: The :class:`requests.Session` used,
+        shared by all clients using the same server and settings
+        by default.
+
+    """
     default_url = 'http://127.0.0.1:8000'
+    pool_size = 10
+    timeout = None
 
-    def __init__(self, url=None):
+    def __init__(self, url=None, pool_size=None, timeout=None, session=None):
         self.url = url.rstrip('/') if url else self.default_url
+        self.pool_size = pool_size or self.pool_size
+        self.timeout = timeout or self.timeout
+        if session is not None:
+            self.session = session
 
     def GET(self, path, params=None, type=None):
         return self.request('GET', path, params, None, type)
@@ -138,6 +213,8 @@ class Client(Base):
         return self._request(method, self.build_url(path), params, data, type)
 
     def _prepare(self, d):
+        if isinstance(d, basestring):
+            return d
         if d:
             return dict((key, value if value is not None else '')
                             for key, value in d.iteritems())
@@ -149,9 +226,8 @@ class Client(Base):
             print('<REQ> %s %r data=%r params=%r' % (method, url,  # noqa+
                                                      data, params))
         type = type or AttributeDict
-        r = requests.request(method, str(url),
-                             headers=self.headers,
-                             params=params, data=data)
+        r = self.session.request(method, str(url),
+                                 params=params, data=data)
         data = None
         if DEBUG:
             print('<RES> %r' % (r.text, ))  # noqa+
@@ -170,6 +246,11 @@ class Client(Base):
     def __repr__(self):
         return '<Client: %r>' % (self.url, )
 
+    @cached_property
+    def session(self):
+        return sessions.get(self.url, self.pool_size, self.timeout,
+                            headers=self.headers)
+
     @cached_property
     def headers(self):
         return {'Accept': 'application/json',
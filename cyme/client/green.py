@@ -0,0 +1,111 @@
+"""cyme.client.green
+
+- Python client for the Cyme HTTP API, applying many requests
+  concurrently from one process using green threads (eventlet).
+
+- The green client has the same API as :class:`cyme.client.Client`
+  (apps, instances, queues and consumers), and also the :meth:`spawn`,
+  :meth:`map` and :meth:`gather` helpers to apply requests concurrently.
+
+- The socket module must be patched by eventlet
+  (:func:`eventlet.monkey_patch`), otherwise requests block each other.
+
+Examples
+~~~~~~~~
+
+    >>> import eventlet
+    >>> eventlet.monkey_patch()
+
+    >>> client = GreenClient('http://localhost:8000', concurrency=200)
+    >>> app = client.get('foo')
+
+    >>> instances = app.map(lambda name: app.instances.add(name),
+    ...                     ['i%s' % i for i in xrange(1000)])
+
+    >>> app.gather([app.spawn(app.instances.autoscale, i.name, max=10)
+    ...                 for i in instances])
+    [{'max': 10, 'min': 1}, ...]
+
+"""
+
+from __future__ import absolute_import
+
+import warnings
+
+from eventlet import GreenPool
+from eventlet.patcher import is_monkey_patched
+
+from . import Client
+
+#: Set when warned that the socket module is not patched.
+_warned_unpatched = False
+
+
+class GreenClient(Client):
+    """Client applying requests concurrently using green threads.
+
+    :keyword concurrency: Max number of requests in progress at once,
+        also the max number of connections kept alive for every server
+        (default is 100).
+    :keyword pool: The :class:`~eventlet.greenpool.GreenPool` to use,
+        by default a new pool of ``concurrency`` green threads.
+
+    Apps returned by the client share its pool of green threads,
+    so the concurrency limit applies to all of them.
+
+    See :class:`cyme.client.Client` for the other arguments.
+
+    """
+    concurrency = 100
+
+    def __init__(self, url=None, app=None, info=None, concurrency=None,
+            pool=None, **kwargs):
+        global _warned_unpatched
+        if not _warned_unpatched and not is_monkey_patched('socket'):
+            warnings.warn('GreenClient: the socket module is not patched '
+                          'by eventlet, requests will not be concurrent.')
+            _warned_unpatched = True
+        self.concurrency = concurrency or self.concurrency
+        kwargs.setdefault('pool_size', self.concurrency)
+        super(GreenClient, self).__init__(url, app, info, **kwargs)
+        self.pool = GreenPool(self.concurrency) if pool is None else pool
+
+    def spawn(self, fun, *args, **kwargs):
+        """Apply ``fun(*args, **kwargs)`` in a green thread.
+
+        Returns the :class:`~eventlet.greenthread.GreenThread`,
+        waits if the max number of requests are already in progress.
+
+        """
+        return self.pool.spawn(fun, *args, **kwargs)
+
+    def map(self, fun, *iterables):
+        """Apply ``fun`` concurrently to every item of ``iterables``,
+        and return the list of results (in the same order)."""
+        return list(self.pool.imap(fun, *iterables))
+
+    def gather(self, threads, return_exceptions=False):
+        """Wait for the green threads started by :meth:`spawn`,
+        and return the list of results (in the same order).
+
+        :keyword return_exceptions: If set the exception raised by a
+            thread is returned as its result, instead of being raised.
+
+        """
+        results = []
+        for thread in threads:
+            try:
+                results.append(thread.wait())
+            except Exception, exc:
+                if not return_exceptions:
+                    raise
+                results.append(exc)
+        return results
+
+    def clone(self, app=None, info=None, **kwargs):
+        return super(GreenClient, self).clone(app=app, info=info,
+                                              concurrency=self.concurrency,
+                                              pool=self.pool, **kwargs)
+
+    def __repr__(self):
+        return '<Green%s' % (super(GreenClient, self).__repr__()[1:], )
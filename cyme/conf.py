@@ -9,3 +9,107 @@ from .utils import Path
 CYME_INSTANCE_DIR = Path(getattr(settings,
                         'CYME_INSTANCE_DIR', 'instances')).absolute()
 CYME_DEFAULT_POOL = getattr(settings, 'CYME_DEFAULT_POOL', 'processes')
+
+#: Serializer used for actor requests and presence announcements.
+#: Replies are always sent using the serializer of the request, so
+#: branches can be upgraded one at a time.  Falls back to json if the
+#: serializer is not available.
+CYME_ACTOR_SERIALIZER = getattr(settings, 'CYME_ACTOR_SERIALIZER', 'json')
+
+#: Max time in seconds a request waits for task results (int/float),
+#: also the default if the request does not specify a timeout.
+CYME_WAIT_TIMEOUT = getattr(settings, 'CYME_WAIT_TIMEOUT', 30.0)
+
+#: Interval in seconds between polls of the result backend
+#: for the tasks being waited for (int/float).
+CYME_RESULT_POLL_INTERVAL = getattr(settings,
+                                    'CYME_RESULT_POLL_INTERVAL', 0.5)
+
+#: JSON library used to encode API responses (``ujson``, ``yajl``,
+#: ``simplejson`` or ``json``).  The fastest library installed is used
+#: if not set, or if the library is not installed.
+CYME_JSON_ENCODER = getattr(settings, 'CYME_JSON_ENCODER', None)
+
+#: API responses larger than this (in bytes) are compressed using gzip,
+#: if accepted by the client.  Set to :const:`None` to disable.
+CYME_GZIP_MIN_SIZE = getattr(settings, 'CYME_GZIP_MIN_SIZE', 1024)
+
+#: Max number of HTTP requests processed concurrently by a branch
+#: (:const:`None` for no limit).  Ping and apply requests are never
+#: limited.
+CYME_HTTP_MAX_REQUESTS = getattr(settings, 'CYME_HTTP_MAX_REQUESTS', 1000)
+
+#: Max number of concurrent requests for the routes served by the fast
+#: path, by name (see :attr:`cyme.api.urls.fast`), e.g.
+#: ``{'wait_many': 100}``.
+CYME_HTTP_ROUTE_LIMITS = getattr(settings, 'CYME_HTTP_ROUTE_LIMITS', {})
+
+#: Max time in seconds a request waits for capacity before being
+#: rejected with ``503 Service Unavailable`` (int/float).
+CYME_HTTP_QUEUE_TIMEOUT = getattr(settings, 'CYME_HTTP_QUEUE_TIMEOUT', 5.0)
+
+#: Max number of HTTP requests waiting for capacity at once
+#: (:const:`None` for no limit), requests exceeding this are rejected
+#: immediately.
+CYME_HTTP_MAX_WAITING = getattr(settings, 'CYME_HTTP_MAX_WAITING', 1000)
+
+#: Max number of pending connections on the HTTP server socket
+#: (also limited by the ``net.core.somaxconn`` sysctl on Linux).
+CYME_HTTP_BACKLOG = getattr(settings, 'CYME_HTTP_BACKLOG', 1024)
+
+#: Keep HTTP connections open between requests.
+CYME_HTTP_KEEPALIVE = getattr(settings, 'CYME_HTTP_KEEPALIVE', True)
+
+#: Disable Nagle's algorithm for HTTP connections (``TCP_NODELAY``),
+#: so small responses are sent immediately.
+CYME_HTTP_NODELAY = getattr(settings, 'CYME_HTTP_NODELAY', True)
+
+#: Close HTTP connections idle for this long (in seconds as an int/float),
+#: :const:`None` to keep idle connections open.
+CYME_HTTP_IDLE_TIMEOUT = getattr(settings, 'CYME_HTTP_IDLE_TIMEOUT', 60.0)
+
+#: Max number of HTTP connections served at once by a process, further
+#: connections waiting in the backlog.  Should be well above
+#: ``CYME_HTTP_MAX_REQUESTS`` plus ``CYME_HTTP_MAX_WAITING``, so that
+#: the connections are never all busy with requests waiting for capacity.
+CYME_HTTP_MAX_CONNECTIONS = getattr(settings, 'CYME_HTTP_MAX_CONNECTIONS',
+                                    4096)
+
+#: Number of processes serving the HTTP API, all listening on the same
+#: port (using ``SO_REUSEPORT``, requires Linux 3.9 or later).
+#: More than one requires ``CYME_RATE_LIMITS`` and
+#: ``CYME_ASYNC_OPERATIONS`` to be set to :const:`False` (both are
+#: enabled by default), as these are kept in memory by every process.
+CYME_HTTP_WORKERS = getattr(settings, 'CYME_HTTP_WORKERS', 1)
+
+#: Allow operations to be requested without waiting for the result
+#: (``nowait``).  The operations are kept in memory by the process
+#: serving the request, so cannot be used with ``CYME_HTTP_WORKERS``.
+CYME_ASYNC_OPERATIONS = getattr(settings, 'CYME_ASYNC_OPERATIONS', True)
+
+#: Max number of operations requested without waiting for the result
+#: (``nowait``) kept by a branch, so their state can be queried.
+CYME_OPERATIONS_MAX = getattr(settings, 'CYME_OPERATIONS_MAX', 1000)
+
+#: Time in seconds the results of live queries to instances
+#: (stats, consumers and autoscale settings) are cached (int/float).
+#: Concurrent identical queries are always shared.
+CYME_QUERY_CACHE_TTL = getattr(settings, 'CYME_QUERY_CACHE_TTL', 1.0)
+
+#: Enforce the rate limits of apps and queues.  The limits are enforced
+#: using buckets kept in memory by the process serving the request,
+#: so cannot be used with ``CYME_HTTP_WORKERS``.
+CYME_RATE_LIMITS = getattr(settings, 'CYME_RATE_LIMITS', True)
+
+#: Burst allowed by the rate limits of apps and queues, as the number
+#: of seconds worth of requests that can be accepted at once (int/float).
+CYME_RATE_LIMIT_BURST = getattr(settings, 'CYME_RATE_LIMIT_BURST', 1.0)
+
+#: Max size in bytes of the request bodies of webhooks applied
+#: (int, zero or :const:`None` for no limit).
+CYME_APPLY_MAX_BODY_SIZE = getattr(settings, 'CYME_APPLY_MAX_BODY_SIZE',
+                                   1024 * 1024)
+
+#: Forward all request bodies to the webhook as-is, including form data.
+#: Bodies that are not form data are always forwarded as-is.
+CYME_APPLY_RAW_BODY = getattr(settings, 'CYME_APPLY_RAW_BODY', False)
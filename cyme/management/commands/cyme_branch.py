@@ -18,6 +18,38 @@ Options
 
     Disable the HTTP server thread.
 
+.. cmdoption:: --http-backlog
+
+    Max number of pending connections to the HTTP server.
+    Default is ``CYME_HTTP_BACKLOG`` (1024).
+
+.. cmdoption:: --http-idle-timeout
+
+    Close HTTP connections idle for this many seconds (0 for never).
+    Default is ``CYME_HTTP_IDLE_TIMEOUT`` (60).
+
+.. cmdoption:: --http-max-connections
+
+    Max number of HTTP connections served at once by a process.
+    Default is ``CYME_HTTP_MAX_CONNECTIONS`` (4096).
+
+.. cmdoption:: --without-http-keepalive
+
+    Close HTTP connections after every request.
+
+.. cmdoption:: --without-tcp-nodelay
+
+    Do not set ``TCP_NODELAY`` on HTTP connections.
+
+.. cmdoption:: --http-workers
+
+    Number of processes serving the HTTP API on the same port
+    (using ``SO_REUSEPORT``, Linux 3.9 or later).
+    Default is ``CYME_HTTP_WORKERS`` (1).  More than one requires
+    ``CYME_RATE_LIMITS`` and ``CYME_ASYNC_OPERATIONS`` to be disabled
+    (both are enabled by default).
+    Workers that exit are restarted.
+
 .. cmdoption:: -l, --loglevel
 
     Set custom log level. One of DEBUG/INFO/WARNING/ERROR/CRITICAL.
@@ -38,6 +70,13 @@ Options
     requests.  Each controller requires one AMQP connection.
     Default is 2.
 
+.. cmdoption:: --maxc
+
+    Max number of controllers.  If this is greater than :option:`--numc`
+    then controllers will be added at runtime when the request
+    backlog grows, and retired again when idle.
+    Default is to only start :option:`--numc` controllers.
+
 .. cmdoption:: --sup-interval
 
     Supervisor schedule Interval in seconds.  Default is 5.
@@ -101,6 +140,27 @@ class Command(CymeCommand):
         Option('--without-httpd',
                default=False, action='store_true', dest='without_httpd',
                help='Disable HTTP server'),
+        Option('--http-backlog',
+               default=None, action='store', type='int', dest='http_backlog',
+               help='Max pending HTTP connections.  Default is 1024'),
+        Option('--http-idle-timeout',
+               default=None, action='store', type='float',
+               dest='http_idle_timeout',
+               help='Close HTTP connections idle for this long.'),
+        Option('--http-max-connections',
+               default=None, action='store', type='int',
+               dest='http_max_connections',
+               help='Max HTTP connections served at once.'),
+        Option('--without-http-keepalive',
+               default=False, action='store_true',
+               dest='without_http_keepalive',
+               help='Close HTTP connections after every request.'),
+        Option('--without-tcp-nodelay',
+               default=False, action='store_true', dest='without_tcp_nodelay',
+               help='Do not set TCP_NODELAY on HTTP connections.'),
+        Option('--http-workers',
+               default=None, action='store', type='int', dest='http_workers',
+               help='Number of processes serving HTTP requests.'),
        Option('-l', '--loglevel',
               default='WARNING', action='store', dest='loglevel',
               help='Choose between DEBUG/INFO/WARNING/ERROR/CRITICAL'),
@@ -110,6 +170,9 @@ class Command(CymeCommand):
        Option('-C', '--numc',
               default=2, action='store', type='int', dest='numc',
               help='Number of controllers to start.  Default is 2'),
+       Option('--maxc',
+              default=None, action='store', type='int', dest='maxc',
+              help='Max number of controllers to scale up to at runtime.'),
        Option('--sup-interval',
               default=60, action='store', type='int', dest='sup_interval',
               help='Supervisor schedule interval.  Default is every minute.'),
@@ -180,6 +243,9 @@ class Command(CymeCommand):
         branch = self.branch
         addr, port = branch.addrport
         con = branch.controllers
+        controllers = len(con)
+        if branch.maxc > branch.numc:
+            controllers = '%s..%s' % (branch.numc, branch.maxc)
         try:
             pres_interval = con[0].thread.presence.interval
         except AttributeError:
@@ -194,7 +260,7 @@ class Command(CymeCommand):
                          'port': port or 8000,
                          'sup.interval': sup.interval,
                          'presence.interval': pres_interval,
-                         'controllers': len(con),
+                         'controllers': controllers,
                          'instance_dir': self.instance_dir}
 
     def install_signal_handlers(self):
@@ -78,6 +78,10 @@ class App(models.Model):
     broker = models.ForeignKey(Broker, null=True, blank=True)
     arguments = models.TextField(_(u'arguments'), null=True, blank=True)
     extra_config = models.TextField(_(u'extra config'), null=True, blank=True)
+    rate_limit = models.CharField(_(u'rate limit'), max_length=128,
+                                  null=True, blank=True)
+    queue_rate_limits = models.TextField(_(u'queue rate limits'),
+                                         null=True, blank=True)
 
     class Meta:
         verbose_name = _(u'app')
@@ -91,11 +95,29 @@ class App(models.Model):
             return self.Broker._default_manager.get_default()
         return self.broker
 
+    def get_queue_rate_limits(self):
+        """Returns the rate limits of the queues, as a dictionary
+        of ``{queue_name: rate_limit}``.
+
+        The value is parsed once, until :attr:`queue_rate_limits`
+        is changed.
+
+        """
+        source, limits = getattr(self, '_queue_rate_limits', (None, {}))
+        if source != self.queue_rate_limits:
+            limits = {}
+            if self.queue_rate_limits:
+                limits = deserialize(self.queue_rate_limits)
+            self._queue_rate_limits = (self.queue_rate_limits, limits)
+        return limits
+
     def as_dict(self):
         return {'name': self.name,
                 'broker': self.get_broker().url,
                 'arguments': self.arguments,
-                'extra_config': self.extra_config}
+                'extra_config': self.extra_config,
+                'rate_limit': self.rate_limit,
+                'queue_rate_limits': self.queue_rate_limits}
 
 
 class Queue(models.Model):
@@ -215,6 +237,11 @@ class Instance(models.Model):
         """Returns instance statistics (like ``celeryctl inspect stats``)."""
         return self._query('stats', **kwargs)
 
+    def status(self, **kwargs):
+        """Returns the status of the instance in one reply
+        (see :func:`cyme.tasks.cyme_status`)."""
+        return self._query('cyme_status', **kwargs)
+
     def _update_autoscale(self, max=None, min=None):
         if max is not None:
             self.max_concurrency = max
@@ -266,6 +293,56 @@ class Instance(models.Model):
 
     def add_queue(self, q, **kwargs):
         """Add queue for this instance by name."""
+        declaration = self._consumer_declaration(q)
+        if declaration is not None:
+            return self._consumer_reply(declaration['queue'],
+                        self.update_consumers(add=[declaration], **kwargs))
+
+    def cancel_queue(self, queue, **kwargs):
+        """Cancel queue for this instance by :class:`Queue`."""
+        queue = queue.name if isinstance(queue, self.Queue) else queue
+        return self._consumer_reply(queue,
+                    self.update_consumers(cancel=[queue], **kwargs))
+
+    def update_consumers(self, add=(), cancel=(), **kwargs):
+        """Start and stop consuming from several queues using
+        one remote control command.
+
+        :keyword add: Queues to start consuming from
+            (:class:`Queue`, queue names, or declarations returned by
+            :meth:`_consumer_declaration`).
+        :keyword cancel: Queues to stop consuming from
+            (:class:`Queue` or queue names).
+
+        Returns a dictionary with the reply for every queue, or
+        :const:`None` if the instance did not reply.
+
+        """
+        add = filter(None, [q if isinstance(q, dict)
+                                else self._consumer_declaration(q)
+                                    for q in add])
+        cancel = [q.name if isinstance(q, self.Queue) else q
+                        for q in cancel]
+        if not add and not cancel:
+            return {}
+        reply = self._query('cyme_update_consumers',
+                            dict(add=add, cancel=cancel), **kwargs)
+        if reply is None or 'ok' in reply:
+            return reply and reply['ok']
+        # started by an older version: one command for every queue.
+        results = {}
+        for declaration in add:
+            results[declaration['queue']] = self._query('add_consumer',
+                                                        declaration, **kwargs)
+        for queue in cancel:
+            results[queue] = self._query('cancel_consumer',
+                                         dict(queue=queue), **kwargs)
+        return results
+
+    def _consumer_reply(self, queue, results):
+        return results.get(queue) if results else None
+
+    def _consumer_declaration(self, q):
         if isinstance(q, self.Queue):
             q = q.as_dict()
         else:
@@ -282,17 +359,11 @@ class Instance(models.Model):
         options = deserialize(q['options']) if q.get('options') else {}
         exchange = q['exchange'] if q['exchange'] else name
         routing_key = q['routing_key'] if q['routing_key'] else name
-        return self._query('add_consumer',
-                           dict(queue=q['name'],
-                                exchange=exchange,
-                                exchange_type=q['exchange_type'],
-                                routing_key=routing_key,
-                                **options), **kwargs)
-
-    def cancel_queue(self, queue, **kwargs):
-        """Cancel queue for this instance by :class:`Queue`."""
-        queue = queue.name if isinstance(queue, self.Queue) else queue
-        return self._query('cancel_consumer', dict(queue=queue), **kwargs)
+        return dict(queue=name,
+                    exchange=exchange,
+                    exchange_type=q['exchange_type'],
+                    routing_key=routing_key,
+                    **options)
 
     def getpid(self):
         """Get the process id for this instance by reading its pid file.
@@ -328,6 +399,10 @@ class Instance(models.Model):
         """Send remote control command and wait for this instances reply."""
         timeout = kwargs.setdefault('timeout', 3)
         name = self.name
+        if 'connection' not in kwargs and self.replies.enabled:
+            reply = self.replies.call(self.broker, name, cmd, args, timeout,
+                                      queue=self.direct_queue)
+            return self.my_reply([reply] if reply else None)
         producer = None
         if 'connection' not in kwargs:
             producer = self.broker.producers.acquire(block=True, timeout=3)
@@ -352,6 +427,10 @@ class Instance(models.Model):
             if name in reply:
                 return reply[name]
 
+    @cached_property
+    def replies(self):
+        return find_symbol(self, 'cyme.branch.control.replies')
+
     @cached_property
     def multi(self):
         env = os.environ.copy()
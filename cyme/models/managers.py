@@ -12,11 +12,35 @@ from __future__ import absolute_import
 
 from anyjson import serialize
 from celery import current_app as celery
+from django.db.models import Q
 from djcelery.managers import ExtendedManager
 
 from cyme.utils import cached_property, uuid
 
 
+class NamedManager(ExtendedManager):
+    """Manager for models with a unique ``name`` field."""
+
+    def names(self, cursor=None, limit=None, prefix=None, queryset=None,
+            **query):
+        """Returns the names of the objects matching ``query``,
+        ordered by name.
+
+        :keyword cursor: Only return the names following this name.
+        :keyword limit: Max number of names to return.
+        :keyword prefix: Only return the names starting with this prefix.
+        :keyword queryset: Query set to filter (default is all objects).
+
+        """
+        qs = (self.all() if queryset is None else queryset).filter(**query)
+        if prefix:
+            qs = qs.filter(name__startswith=prefix)
+        if cursor:
+            qs = qs.filter(name__gt=cursor)
+        qs = qs.order_by('name').values_list('name', flat=True)
+        return list(qs[:limit] if limit else qs)
+
+
 class BrokerManager(ExtendedManager):
 
     def get_default(self):
@@ -27,18 +51,26 @@ class BrokerManager(ExtendedManager):
         return celery.broker_connection().as_uri()
 
 
-class AppManager(ExtendedManager):
+class AppManager(NamedManager):
 
     def from_json(self, name=None, broker=None):
         return {'name': name, 'broker': self.get_broker(broker)}
 
     def recreate(self, name=None, broker=None, arguments=None,
-            extra_config=None):
+            extra_config=None, rate_limit=None, queue_rate_limits=None):
         d = self.from_json(name, broker)
-        return self.get_or_create(name=d['name'],
+        app, created = self.get_or_create(name=d['name'],
                                   defaults={'broker': d['broker'],
                                             'arguments': arguments,
-                                            'extra_config': extra_config})[0]
+                                            'extra_config': extra_config,
+                                            'rate_limit': rate_limit,
+                                            'queue_rate_limits':
+                                                queue_rate_limits})
+        if not created:
+            # the limits received are always the current limits.
+            self.set_rate_limits(app, rate_limit or '',
+                                 queue_rate_limits or '')
+        return app
 
     def instance(self, name=None, broker=None):
         return self.model(**self.from_json(name, broker))
@@ -46,12 +78,32 @@ class AppManager(ExtendedManager):
     def get_broker(self, url):
         return self.Brokers.get_or_create(url=url)[0]
 
-    def add(self, name=None, broker=None, arguments=None, extra_config=None):
+    def add(self, name=None, broker=None, arguments=None, extra_config=None,
+            rate_limit=None, queue_rate_limits=None):
         broker = self.get_broker(broker) if broker else None
-        return self.get_or_create(name=name, defaults={
+        app, created = self.get_or_create(name=name, defaults={
                 'broker': broker,
                 'arguments': arguments,
-                'extra_config': extra_config})[0]
+                'extra_config': extra_config,
+                'rate_limit': rate_limit,
+                'queue_rate_limits': queue_rate_limits})
+        if not created and (rate_limit is not None or
+                            queue_rate_limits is not None):
+            self.set_rate_limits(app, rate_limit, queue_rate_limits)
+        return app
+
+    def set_rate_limits(self, app, rate_limit=None, queue_rate_limits=None):
+        """Change the rate limits of an existing app
+        (an empty string removes the limit)."""
+        changed = False
+        for attr, value in (('rate_limit', rate_limit),
+                            ('queue_rate_limits', queue_rate_limits)):
+            if value is not None and (value or None) != getattr(app, attr):
+                setattr(app, attr, value or None)
+                changed = True
+        if changed:
+            app.save()
+        return app
 
     def get_default(self):
         return self.get_or_create(name='cyme')[0]
@@ -61,11 +113,24 @@ class AppManager(ExtendedManager):
         return self.model.Broker._default_manager
 
 
-class InstanceManager(ExtendedManager):
+class InstanceManager(NamedManager):
 
     def enabled(self):
         return self.filter(is_enabled=True)
 
+    def consuming_from(self, queue):
+        """Returns the instances consuming from ``queue``."""
+        # queues are stored as a comma separated list.
+        return self.filter(Q(_queues=queue) |
+                           Q(_queues__startswith=queue + ',') |
+                           Q(_queues__endswith=',' + queue) |
+                           Q(_queues__contains=',' + queue + ','))
+
+    def names(self, queue=None, **kwargs):
+        if queue:
+            kwargs['queryset'] = self.consuming_from(queue)
+        return super(InstanceManager, self).names(**kwargs)
+
     def _maybe_queues(self, queues):
         if isinstance(queues, basestring):
             queues = queues.split(',')
@@ -125,7 +190,7 @@ class InstanceManager(ExtendedManager):
         return instances
 
 
-class QueueManager(ExtendedManager):
+class QueueManager(NamedManager):
 
     def enabled(self):
         return self.filter(is_enabled=True)
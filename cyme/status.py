@@ -117,42 +117,66 @@ class Status(LogMixin):
     def _do_verify_instance(self, instance, ratelimit=False):
         if not self.paused:
             if instance.is_enabled and instance.pk:
-                if not self.ib(instance.alive):
+                status = self.get_status(instance)
+                if status is None:
                     self._do_restart_instance(instance, ratelimit=ratelimit)
-                self._verify_instance_processes(instance)
-                self._verify_instance_queues(instance)
+                    status = {}
+                self._verify_instance_processes(instance,
+                                                status.get('autoscaler'))
+                self._verify_instance_queues(instance, status.get('queues'))
             else:
                 if self.ib(instance.alive):
                     self._do_stop_instance(instance)
 
-    def _verify_instance_queues(self, instance):
+    def get_status(self, instance):
+        """Returns the reply to the ``cyme_status`` command sent to the
+        instance, an empty dictionary if the instance is alive but does not
+        support the command, or :const:`None` if the instance is not
+        alive."""
+        if not instance.responds_to_signal():
+            return None
+        status = self.ib(instance.status)
+        if not isinstance(status, dict):
+            return None
+        if 'error' in status:
+            # started by an older version.
+            return {}
+        return status
+
+    def _verify_instance_queues(self, instance, consuming_from=None):
         """Verify that the queues the instance is consuming from matches
         the queues listed in the model."""
         queues = set(instance.queues)
-        reply = self.ib(instance.consuming_from)
-        if reply is None:
-            return
-        consuming_from = set(reply.keys())
-
+        if consuming_from is None:
+            reply = self.ib(instance.consuming_from)
+            if reply is None:
+                return
+            consuming_from = reply.keys()
+        consuming_from = set(consuming_from)
+
+        add, cancel = [], []
         for queue in consuming_from ^ queues:
             if queue in queues:
                 self.info('%s: instance.consume_from: %s' % (instance, queue))
-                self.ib(instance.add_queue, queue)
+                add.append(queue)
             elif queue == instance.direct_queue:
                 pass
             else:
                 self.info(
                     '%s: instance.cancel_consume: %s' % (instance, queue))
-                self.ib(instance.cancel_queue, queue)
+                cancel.append(queue)
+        if add or cancel:
+            self.ib(instance.update_consumers, add, cancel)
 
-    def _verify_instance_processes(self, instance):
+    def _verify_instance_processes(self, instance, current=None):
         """Verify that the max/min concurrency settings of the
         instance matches that which is specified in the model."""
         max, min = instance.max_concurrency, instance.min_concurrency
-        try:
-            current = self.insured(instance, instance.stats)['autoscaler']
-        except (TypeError, KeyError):
-            return
+        if not current:
+            try:
+                current = self.insured(instance, instance.stats)['autoscaler']
+            except (TypeError, KeyError):
+                return
         if max != current['max'] or min != current['min']:
             self.info('%s: instance.set_autoscale max=%r min=%r' % (
                 instance, max, min))
@@ -6,10 +6,23 @@
   present in the query string of the request, nor in the data returned
   in the response.
 
+- Remote control commands sent directly to an instance using its
+  direct queue, see :func:`control`.
+
+- The ``cyme_status`` and ``cyme_update_consumers`` remote control
+  commands used by the supervisor.
+
 """
 from __future__ import absolute_import
 
+import os
+
+from time import time
+
 from celery.task import task
+from celery.worker import state
+from celery.worker.control import Panel
+from kombu.utils import kwdict
 from requests import request
 
 from . import __version__
@@ -32,3 +45,113 @@ def webhook(url, method='GET', params={}, data={}, headers=None, **kwargs):
     headers = {} if headers is None else headers
     return response_to_dict(request(method, url, params=params, data=data,
                                     headers=dict(headers, **DEFAULT_HEADERS)))
+
+
+def control_strategy(task, app, consumer):
+    """Execution strategy for :func:`control`.
+
+    The command is applied by the consumer as soon as the message is
+    received, like commands received by the remote control mailbox,
+    instead of being executed by the pool.
+
+    """
+    node = consumer.pidbox_node
+    logger = consumer.logger
+    connection_errors = consumer.connection_errors
+
+    def control_message_handler(M, B, A):
+        A(logger, connection_errors)
+        kwargs = B.get('kwargs') or {}
+        expires = kwargs.get('expires')
+        if expires and time() > expires:
+            return      # the sender is no longer waiting for the reply.
+        try:
+            reply = node.handle(kwargs['method'],
+                                kwdict(kwargs.get('arguments') or {}))
+        except Exception, exc:
+            reply = {'error': repr(exc)}
+        reply_to = kwargs.get('reply_to')
+        if reply_to:
+            node.mailbox._publish_reply({node.hostname: reply},
+                                        reply_to['exchange'],
+                                        reply_to['routing_key'],
+                                        channel=M.channel)
+
+    return control_message_handler
+
+
+class NotExecutable(Exception):
+    """The task only defines a message format, and cannot be executed."""
+
+
+@task(Strategy='cyme.tasks:control_strategy', ignore_result=True)
+def control(method, arguments=None, reply_to=None, expires=None):
+    """Remote control command sent to the direct queue of
+    an instance (``dq.<name>``).
+
+    Unlike broadcast commands, the message is only delivered to the
+    instance it is meant for.  The task is registered so that the worker
+    uses :func:`control_strategy` for its messages, which handles the
+    command as soon as it is received, so messages are never passed
+    on to the pool.
+
+    The body is only a sentinel, raising :exc:`NotExecutable` if
+    the task is applied locally (e.g. eagerly).
+
+    """
+    raise NotExecutable('control commands are handled by the worker '
+                        'consumer (see control_strategy)')
+
+
+@Panel.register
+def cyme_status(panel, **kwargs):
+    """Remote control command returning what the supervisor needs to know
+    about a worker in one reply, instead of sending ``ping``,
+    ``stats`` and ``active_queues``.
+
+    Returns a dictionary with the ``pid`` of the worker, the
+    ``autoscaler`` settings (``current``, ``min`` and ``max``), the names
+    of the ``queues`` consumed from, and the number of ``active`` and
+    ``reserved`` tasks, and the ``total`` number of tasks processed.
+
+    """
+    consumer = panel.consumer
+    autoscaler = consumer.controller.autoscaler
+    task_consumer = consumer.task_consumer
+    return {'pid': os.getpid(),
+            'autoscaler': autoscaler.info() if autoscaler else {},
+            'queues': [queue.name for queue in task_consumer.queues]
+                            if task_consumer else [],
+            'active': len(state.active_requests),
+            'reserved': len(state.reserved_requests),
+            'total': sum(state.total_count.itervalues())}
+
+
+@Panel.register
+def cyme_update_consumers(panel, add=(), cancel=(), **kwargs):
+    """Remote control command adding and cancelling consumers
+    in one message, instead of sending one ``add_consumer`` or
+    ``cancel_consumer`` command for every queue.
+
+    :keyword add: List of queue declarations, as accepted by
+        the ``add_consumer`` command.
+    :keyword cancel: List of names of the queues to stop consuming from.
+
+    Returns ``{"ok": results}``, where results is a dictionary
+    with the reply for every queue.
+
+    """
+    results = {}
+    for declaration in add:
+        results[declaration['queue']] = _handle(panel, 'add_consumer',
+                                                declaration)
+    for queue in cancel:
+        results[queue] = _handle(panel, 'cancel_consumer', {'queue': queue})
+    return {'ok': results}
+
+
+def _handle(panel, method, arguments):
+    try:
+        return Panel.data[method](panel, **kwdict(arguments))
+    except Exception, exc:
+        return {'error': repr(exc)}
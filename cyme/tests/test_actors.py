@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+
+from celery.tests.utils import unittest
+from kombu.serialization import registry
+
+from cyme.utils.actors import register_msgpack, select_serializer
+
+
+class test_select_serializer(unittest.TestCase):
+
+    def test_available(self):
+        self.assertEqual(select_serializer('json'), 'json')
+        self.assertEqual(select_serializer('pickle'), 'pickle')
+
+    def test_fallback(self):
+        self.assertEqual(select_serializer('nonexisting'), 'json')
+
+    def test_msgpack(self):
+        if not register_msgpack():
+            raise unittest.SkipTest('msgpack not installed')
+        self.assertEqual(select_serializer('msgpack'), 'msgpack')
+        body = {'ok': [u'a', u'b'], 'n': 1}
+        content_type, encoding, data = registry.encode(body, 'msgpack')
+        self.assertEqual(content_type, 'application/x-msgpack')
+        decoded = registry.decode(data, content_type, encoding)
+        self.assertEqual(list(decoded['ok']), body['ok'])
+        self.assertEqual(decoded['n'], 1)
@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+
+from celery.tests.utils import unittest
+from eventlet import sleep, spawn
+from mock import Mock
+
+from cyme.branch.cache import QueryCache
+
+
+class test_QueryCache(unittest.TestCase):
+
+    def test_cached(self):
+        cache = QueryCache(ttl=10)
+        fun = Mock(return_value=42)
+        self.assertEqual(cache.get('stats', 'foo', fun, 'foo'), 42)
+        self.assertEqual(cache.get('stats', 'foo', fun, 'foo'), 42)
+        fun.assert_called_once_with('foo')
+        self.assertEqual(cache.stats()['stats'],
+                         {'hits': 1, 'shared': 0, 'misses': 1})
+        cache.forget('stats', 'foo')
+        cache.get('stats', 'foo', fun, 'foo')
+        self.assertEqual(fun.call_count, 2)
+
+    def test_shared(self):
+        cache = QueryCache(ttl=0)
+        calls = []
+
+        def query():
+            calls.append(1)
+            sleep(0.1)
+            return len(calls)
+        threads = [spawn(cache.get, 'stats', 'foo', query)
+                        for i in xrange(3)]
+        self.assertEqual([t.wait() for t in threads], [1, 1, 1])
+        self.assertEqual(cache.stats()['stats']['shared'], 2)
+        # not cached when ttl is zero.
+        self.assertEqual(cache.get('stats', 'foo', query), 2)
+
+    def test_forget_inflight(self):
+        cache = QueryCache(ttl=10)
+        values = iter([1, 2])
+
+        def query():
+            sleep(0.1)
+            return next(values)
+        first = spawn(cache.get, 'stats', 'foo', query)
+        sleep(0)
+        # changed while the first query is in flight.
+        cache.forget('stats', 'foo')
+        second = spawn(cache.get, 'stats', 'foo', query)
+        self.assertEqual(first.wait(), 1)
+        self.assertEqual(second.wait(), 2)
+        # only the result of the second query is cached.
+        self.assertEqual(cache.get('stats', 'foo', query), 2)
+
+    def test_forgetting(self):
+        cache = QueryCache(ttl=10)
+        cache.get('stats', 'foo', Mock(return_value=1))
+        cache.get('autoscale', 'foo', Mock(return_value=2))
+        cache.get('stats', 'bar', Mock(return_value=3))
+        fun = Mock(return_value='ok')
+        fun.__name__ = 'remove'
+        self.assertEqual(cache.forgetting(fun, 'foo')('foo'), 'ok')
+        fun.assert_called_once_with('foo')
+        self.assertEqual(cache._results.keys(), [('stats', 'bar')])
+
+    def test_error_shared(self):
+        cache = QueryCache(ttl=10)
+
+        def fail():
+            sleep(0.1)
+            raise KeyError('foo')
+
+        def get():
+            # caught so the hub does not print the traceback.
+            try:
+                cache.get('stats', 'foo', fail)
+            except KeyError, exc:
+                return exc
+        threads = [spawn(get) for i in xrange(2)]
+        for thread in threads:
+            self.assertIsInstance(thread.wait(), KeyError)
+        self.assertEqual(cache.stats()['stats']['shared'], 1)
+        self.assertFalse(cache._results)
+
+    def test_max_entries(self):
+        cache = QueryCache(ttl=10)
+        cache.max_entries = 2
+        for key in ('a', 'b', 'c'):
+            cache.get('stats', key, Mock(return_value=key))
+        self.assertEqual(cache._results.keys(),
+                         [('stats', 'b'), ('stats', 'c')])
+        cache.get('stats', 'b', Mock(return_value='b'))
+        self.assertEqual(len(cache._results), 2)
+
+    def test_expired_removed(self):
+        cache = QueryCache(ttl=10)
+        cache.get('stats', 'a', Mock(return_value='a'))
+        cache._results[('stats', 'a')] = (0, 'a')
+        cache.get('stats', 'b', Mock(return_value='b'))
+        self.assertEqual(cache._results.keys(), [('stats', 'b')])
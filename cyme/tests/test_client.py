@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import warnings
+
+from celery.tests.utils import unittest
+from eventlet.debug import hub_exceptions
+from mock import Mock, patch
+
+from cyme.client import Client, green
+from cyme.client.base import Sessions
+from cyme.client.green import GreenClient
+
+
+class test_Client(unittest.TestCase):
+
+    def test_shared_session(self):
+        client = Client('http://localhost:8000', timeout=3)
+        app = client.create_model('foo', {'name': 'foo'})
+        self.assertIs(app.session, client.session)
+        self.assertEqual(app.timeout, 3)
+        self.assertIs(Client('http://localhost:8000/', timeout=3).session,
+                      client.session)
+        self.assertIsNot(Client('http://localhost:8001').session,
+                         client.session)
+        self.assertEqual(client.session.headers['Accept'],
+                         'application/json')
+
+    def test_request(self):
+        session = Mock()
+        session.request.return_value.ok = True
+        session.request.return_value.text = '{"ok": "pong"}'
+        client = Client('http://localhost:8000', session=session)
+        self.assertEqual(client.root('GET', 'ping')['ok'], 'pong')
+        session.request.assert_called_with('GET',
+                                           'http://localhost:8000/ping/',
+                                           params=None, data=None)
+
+
+class test_Sessions(unittest.TestCase):
+
+    def test_get(self):
+        sessions = Sessions()
+        s = sessions.get('http://a:8000/foo', pool_size=3)
+        self.assertIs(sessions.get('http://a:8000/bar', pool_size=3), s)
+        self.assertEqual(s.config['pool_maxsize'], 3)
+        self.assertIsNot(sessions.get('http://a:8000', pool_size=4), s)
+        sessions.clear()
+        self.assertIsNot(sessions.get('http://a:8000/foo', pool_size=3), s)
+
+
+class test_GreenClient(unittest.TestCase):
+
+    def test_gather(self):
+        client = GreenClient('http://localhost:8000', concurrency=2)
+        app = client.create_model('foo', {'name': 'foo'})
+        self.assertIs(app.pool, client.pool)
+        self.assertEqual(app.session.config['pool_maxsize'], 2)
+        self.assertEqual(app.map(lambda x: x * 2, range(5)),
+                         [0, 2, 4, 6, 8])
+
+        def fail():
+            raise KeyError('foo')
+        # the hub prints the traceback of the failed thread otherwise.
+        hub_exceptions(False)
+        self.addCleanup(hub_exceptions, True)
+        threads = [app.spawn(lambda: 1), app.spawn(fail)]
+        self.assertEqual(app.gather(threads[:1]), [1])
+        with self.assertRaises(KeyError):
+            app.gather(threads)
+        results = app.gather(threads, return_exceptions=True)
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], KeyError)
+
+    @patch('cyme.client.green.is_monkey_patched')
+    @patch('cyme.client.green.GreenPool')
+    def test_clone(self, GreenPool, is_monkey_patched):
+        is_monkey_patched.return_value = False
+        green._warned_unpatched = False
+        with warnings.catch_warnings(record=True) as log:
+            warnings.simplefilter('always')
+            client = GreenClient('http://localhost:8000', concurrency=2)
+            app = client.create_model('foo', {'name': 'foo'})
+        # warned once, and the pool is shared by the apps.
+        self.assertEqual(len(log), 1)
+        self.assertEqual(GreenPool.call_count, 1)
+        self.assertIs(app.pool, client.pool)
+        self.assertEqual(app.concurrency, 2)
@@ -0,0 +1,179 @@
+from __future__ import absolute_import
+
+from celery.tests.utils import unittest
+from eventlet.event import Event
+from mock import Mock, patch
+
+from cyme.branch import control
+from cyme.branch import thread
+from cyme.tasks import control_strategy, cyme_status, cyme_update_consumers
+
+
+def reply_message(key):
+    message = Mock()
+    message.delivery_info = {'routing_key': key}
+    return message
+
+
+class test_ReplyConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self._Events = thread.Event, control.Event
+        thread.Event = control.Event = Event
+        self.consumer = control.ReplyConsumer(Mock(), mailbox=Mock())
+        self.consumer._consuming.send(True)
+        self.consumer._bind = Mock()
+        self.consumer._publish = Mock()
+        self.consumer._publish_direct = Mock()
+        self.slot = self.consumer._acquire_slot
+
+    def tearDown(self):
+        thread.Event, control.Event = self._Events
+
+    def replies_with(self, body):
+
+        def publish(key, *args):
+            self.consumer.on_reply(body, reply_message(key))
+        self.consumer._publish.side_effect = publish
+        self.consumer._publish_direct.side_effect = publish
+
+    def test_call(self):
+        self.replies_with({'foo': 'pong'})
+        self.assertEqual(self.consumer.call('foo', 'ping'), {'foo': 'pong'})
+        self.assertEqual(self.consumer.call('foo', 'ping'), {'foo': 'pong'})
+        # the slot is reused.
+        self.assertEqual(len(self.consumer._slots), 1)
+        self.assertEqual(self.consumer._bind.call_count, 1)
+
+    def test_call_direct(self):
+        self.replies_with({'foo': 'pong'})
+        self.assertEqual(self.consumer.call('foo', 'ping', queue='dq.foo'),
+                         {'foo': 'pong'})
+        self.assertTrue(self.consumer._publish_direct.call_count)
+        self.assertFalse(self.consumer._publish.call_count)
+
+    def test_timeout(self):
+        self.assertIsNone(self.consumer.call('foo', 'ping', timeout=0.01))
+        key, = self.consumer._late
+        # slot is not reused before the late reply is received.
+        self.assertNotEqual(self.slot(), key)
+        self.consumer.on_reply({'foo': 'pong'}, reply_message(key))
+        self.assertFalse(self.consumer._late)
+        self.assertEqual(self.slot(), key)
+
+    def test_late_reply_timeout(self):
+        self.consumer.late_reply_timeout = 0
+        self.assertIsNone(self.consumer.call('foo', 'ping', timeout=0.01))
+        key, = self.consumer._late
+        # the late reply is no longer waited for.
+        self.assertEqual(self.slot(), key)
+        self.assertFalse(self.consumer._late)
+        self.assertEqual(len(self.consumer._slots), 1)
+
+    def test_on_consume_ready_binds_slots(self):
+        self.slot()
+        self.slot()
+        channel = Mock()
+        self.consumer._bind.reset_mock()
+        self.consumer.on_consume_ready(Mock(), channel, [])
+        self.assertEqual(self.consumer._bind.call_count, 2)
+
+
+class test_publish_direct(unittest.TestCase):
+
+    @patch('cyme.branch.control.producers')
+    def test_expires(self, producers):
+        consumer = control.ReplyConsumer.__new__(control.ReplyConsumer)
+        consumer.connection, consumer.mailbox = Mock(), Mock()
+        consumer._publish_direct('k', 'dq.foo', 'ping', None, 2)
+        producer = producers.__getitem__.return_value.acquire.return_value \
+                        .__enter__.return_value
+        kwargs = producer.publish.call_args[1]
+        self.assertEqual(kwargs['delivery_mode'], 'transient')
+        self.assertEqual(kwargs['expiration'], '2000')
+
+
+class test_Replies(unittest.TestCase):
+
+    @patch('cyme.branch.control.time')
+    def test_call_falls_back_to_broadcast(self, time):
+        time.side_effect = [100.0, 100.5]
+        replies = control.Replies()
+        consumer = replies.get = Mock()
+        consumer.return_value.call.side_effect = [None, {'foo': 'pong'}]
+        self.assertEqual(replies.call(Mock(), 'foo', 'ping', timeout=1,
+                                      queue='dq.foo'),
+                         {'foo': 'pong'})
+        calls = consumer.return_value.call.call_args_list
+        self.assertEqual(calls[0][1]['queue'], 'dq.foo')
+        self.assertNotIn('queue', calls[1][1])
+        # the broadcast only gets the time left.
+        self.assertEqual(calls[0][1]['timeout'], 0.5)
+        self.assertEqual(calls[1][1]['timeout'], 0.5)
+
+
+class test_control_strategy(unittest.TestCase):
+
+    def setUp(self):
+        self.consumer = Mock()
+        self.node = self.consumer.pidbox_node
+        self.node.hostname = 'foo'
+        self.node.handle.return_value = 'pong'
+        self.handler = control_strategy(Mock(), Mock(), self.consumer)
+        self.message = Mock()
+
+    def body(self, **kwargs):
+        return {'task': 'cyme.tasks.control', 'id': 'id', 'args': [],
+                'kwargs': dict({'method': 'ping',
+                                'reply_to': {'exchange': 'x',
+                                             'routing_key': 'k'}},
+                               **kwargs)}
+
+    def test_reply(self):
+        ack = Mock()
+        self.handler(self.message, self.body(), ack)
+        self.assertTrue(ack.call_count)
+        self.node.handle.assert_called_with('ping', {})
+        self.node.mailbox._publish_reply.assert_called_with(
+                {'foo': 'pong'}, 'x', 'k', channel=self.message.channel)
+
+    def test_error(self):
+        self.node.handle.side_effect = KeyError('ping')
+        self.handler(self.message, self.body(), Mock())
+        reply = self.node.mailbox._publish_reply.call_args[0][0]
+        self.assertIn('error', reply['foo'])
+
+    def test_expired(self):
+        self.handler(self.message, self.body(expires=1.0), Mock())
+        self.assertFalse(self.node.handle.call_count)
+
+
+class test_cyme_status(unittest.TestCase):
+
+    def test_status(self):
+        panel = Mock()
+        queue = Mock()
+        queue.name = 'dq.foo'
+        panel.consumer.task_consumer.queues = [queue]
+        panel.consumer.controller.autoscaler.info.return_value = {'max': 10}
+        status = cyme_status(panel)
+        self.assertEqual(status['queues'], ['dq.foo'])
+        self.assertEqual(status['autoscaler'], {'max': 10})
+        self.assertIn('pid', status)
+
+
+class test_cyme_update_consumers(unittest.TestCase):
+
+    def test_update(self):
+        panel = Mock()
+        panel.consumer.task_consumer.consuming_from.return_value = False
+        panel.consumer.task_consumer.cancel_by_queue.side_effect = \
+                KeyError('video')
+        results = cyme_update_consumers(panel,
+                        add=[{'queue': 'images', 'exchange': 'images',
+                              'routing_key': 'images'}],
+                        cancel=['video'])['ok']
+        self.assertIn('ok', results['images'])
+        self.assertIn('error', results['video'])
+        self.assertTrue(
+            panel.consumer.task_consumer.add_consumer_from_dict.call_count)
@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from celery.tests.utils import unittest
+from mock import Mock
+
+from cyme.branch.cache import queries
+from cyme.branch.controller import Instance
+
+
+class test_ModelActor_batch(unittest.TestCase):
+
+    def setUp(self):
+        self.actor = Instance()
+        self.actor.agent = Mock()
+        self.actor.agent.lookup_agents.return_value = iter(['B.1'])
+        self.owners = {'i1': 'A.1', 'i2': 'A.2', 'i3': 'C.1'}
+
+        def lookup(name):
+            try:
+                return self.owners[name]
+            except KeyError:
+                raise KeyError(name)
+        self.actor.lookup = lookup
+
+        def call(method, args, routing_key=None):
+            r = Mock()
+            r.get.return_value = [{'ok': (routing_key, op['method'])}
+                                    for op in args['ops']]
+            return r
+        self.actor.call = Mock()
+        self.actor.call.side_effect = call
+
+    def test_grouped_by_branch(self):
+        replies = self.actor.batch([
+            ('restart', {'name': 'i1'}),
+            ('add', {'name': 'new'}),
+            ('add_consumer', {'name': 'new', 'queue': 'q'}),
+            ('restart', {'name': 'i3'}),
+            ('restart', {'name': 'i2'}),
+            ('enable', {'name': 'i1'})])
+        # i1 and i2 are owned by controllers of the same branch,
+        # and new is created by a branch already receiving the batch.
+        self.assertEqual(replies, [{'ok': ('A.1', 'restart')},
+                                   {'ok': ('A.1', 'add')},
+                                   {'ok': ('A.1', 'add_consumer')},
+                                   {'ok': ('C.1', 'restart')},
+                                   {'ok': ('A.1', 'restart')},
+                                   {'ok': ('A.1', 'enable')}])
+        self.assertEqual(self.actor.call.call_count, 2)
+
+    def test_owner_resolved_once(self):
+        # the lookup may return a different controller of the owning
+        # branch every time.
+        controllers = iter(['A.1', 'A.2'])
+        self.actor.lookup = lambda name: next(controllers)
+        replies = self.actor.batch([('restart', {'name': 'i1'}),
+                                    ('enable', {'name': 'i1'})])
+        self.assertEqual(replies, [{'ok': ('A.1', 'restart')},
+                                   {'ok': ('A.1', 'enable')}])
+        self.assertEqual(self.actor.call.call_count, 1)
+
+    def test_forgets_cached_queries(self):
+        queries.get('consuming_from', 'i1', Mock(return_value=['q']))
+        self.actor.batch([('add_consumer', {'name': 'i1', 'queue': 'q2'})])
+        self.assertNotIn(('consuming_from', 'i1'), queries._results)
+
+    def test_unknown_name(self):
+        replies = self.actor.batch([{'method': 'restart',
+                                     'args': {'name': 'nope'}}])
+        self.assertIn('nok', replies[0])
+        self.assertFalse(self.actor.call.called)
+
+    def test_add_without_name(self):
+        replies = self.actor.batch([('add', {})])
+        self.assertEqual(replies, [{'ok': ('B.1', 'add')}])
+        ops = self.actor.call.call_args[0][1]['ops']
+        self.assertTrue(ops[0]['args']['name'])
+
+
+    def test_validate_op(self):
+        self.actor.validate_op({'method': 'restart', 'args': {'name': 'x'}})
+        self.actor.validate_op(['restart', {'name': 'x'}])
+        self.actor.validate_op({'method': 'all'})
+        for op in ('restart', [], {'args': {}}, {'method': 1},
+                   {'method': 'restart', 'args': []},
+                   {'method': 'restart', 'name': 'x'}):
+            with self.assertRaises(ValueError):
+                self.actor.validate_op(op)
+
+
+class test_ModelActor_paginate(unittest.TestCase):
+
+    def test_paginate(self):
+        actor = Instance()
+        replies = [['c', 'a', 'e'], ['b', 'd']]
+        self.assertEqual(sorted(actor.paginate(replies)),
+                         ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(actor.paginate(replies, limit=2),
+                         {'names': ['a', 'b'], 'cursor': 'b'})
+        self.assertEqual(actor.paginate(replies, limit=5),
+                         {'names': ['a', 'b', 'c', 'd', 'e'], 'cursor': None})
+
+
+class test_Instance_state(unittest.TestCase):
+
+    def setUp(self):
+        self.actor = Instance()
+        self.actor.agent = Mock()
+        self.state = self.actor.state
+        self.state.local = Mock()
+
+    def test_changes_announced(self):
+        self.state.enable('i1')
+        self.state.autoscale('i1', max=4)
+        self.assertEqual(self.actor.agent.presence.wakeup.call_count, 2)
+
+    def test_reads_not_announced(self):
+        self.state.restart('i1')
+        self.state.stats('i1')
+        self.assertFalse(self.actor.agent.presence.wakeup.called)
@@ -0,0 +1,260 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import socket
+
+from StringIO import StringIO
+
+from celery.tests.utils import unittest
+from cl.utils import flatten
+from django.core.exceptions import ImproperlyConfigured
+from eventlet import Timeout, sleep, spawn
+from eventlet.event import Event
+from kombu import BrokerConnection
+from mock import Mock, patch
+
+from cyme.api import urls
+from cyme.branch import httpd, thread
+from cyme.branch.controller import Queue, apps, branches, instances, queues
+from cyme.branch.httpd import AdmissionControl, FastRouter, HttpServer
+from cyme.branch.presence import ObserverAgent
+
+
+class test_FastRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = Mock()
+        self.router = FastRouter(self.handler)
+
+    def assertRoutes(self, path, view, **kwargs):
+        route = self.router.match(path)
+        self.assertTrue(route, path)
+        self.assertIs(route[0], urls.fast[view])
+        for key, value in kwargs.iteritems():
+            self.assertEqual(route[1][key], value)
+
+    def test_match(self):
+        self.assertRoutes('ping/', 'ping')
+        self.assertRoutes('foo/query/id/state/', 'task_state',
+                          app='foo', uuid='id')
+        self.assertRoutes('foo/query/id/result', 'task_result')
+        self.assertRoutes('foo/apply/', 'apply_many', app='foo')
+        self.assertRoutes('foo/queue/bar/http://x.com/', 'apply',
+                          app='foo', rest='bar/http://x.com/')
+
+    def test_route_name(self):
+        self.assertEqual(self.router.route_name('/ping/'), 'ping')
+        self.assertIsNone(self.router.route_name('/foo/instances/'))
+
+    def test_no_match(self):
+        # handled by preceding url patterns.
+        self.assertIsNone(self.router.match('admin/query/id/state/'))
+        self.assertIsNone(self.router.match('branches/queue/x'))
+        # not served by the fast path.
+        self.assertIsNone(self.router.match('foo/instances/'))
+        self.assertIsNone(self.router.match('ping'))
+
+    def test_call(self):
+        start_response = Mock()
+        response = self.router({'REQUEST_METHOD': 'GET',
+                                'PATH_INFO': '/ping/',
+                                'wsgi.input': StringIO()}, start_response)
+        self.assertIn('pong', ''.join(response))
+        self.assertEqual(start_response.call_args[0][0], '200 OK')
+        self.assertFalse(self.handler.call_count)
+
+    def test_call_fallback(self):
+        env = {'PATH_INFO': '/admin/'}
+        self.router(env, Mock())
+        self.assertTrue(self.handler.call_count)
+
+
+class test_AdmissionControl(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Mock()
+        self.app.return_value = ['ok']
+        routes = {'/ping/': 'ping', '/wait/': 'wait_many'}
+        self.control = AdmissionControl(self.app, route_name=routes.get,
+                                        max_requests=2,
+                                        route_limits={'wait_many': 1},
+                                        queue_timeout=0)
+
+    def request(self, path):
+        start_response = Mock()
+        return (self.control({'PATH_INFO': path}, start_response),
+                start_response)
+
+    def test_limits(self):
+        r1, _ = self.request('/wait/')
+        # limited by the route.
+        r2, start_response = self.request('/wait/')
+        self.assertTrue(start_response.call_args[0][0].startswith('503'))
+        self.assertIn(('Retry-After', '1'), start_response.call_args[0][1])
+        r3, _ = self.request('/other/')
+        # limited by max_requests.
+        self.request('/other/')
+        self.assertEqual(self.control.rejected, 2)
+        # ping is never limited.
+        r4, start_response = self.request('/ping/')
+        self.assertEqual(r4, ['ok'])
+        # capacity is released when the response is closed.
+        r1.close()
+        r5, _ = self.request('/other/')
+        self.assertEqual(list(r5), ['ok'])
+        self.assertEqual(self.control.rejected, 2)
+
+    def test_max_waiting(self):
+        control = AdmissionControl(self.app, max_requests=1,
+                                   queue_timeout=10, max_waiting=1)
+        control({'PATH_INFO': '/a/'}, Mock())
+        waiter = spawn(control, {'PATH_INFO': '/b/'}, Mock())
+        sleep(0)
+        self.assertEqual(control.waiting, 1)
+        # rejected immediately as a request is already waiting.
+        start_response = Mock()
+        control({'PATH_INFO': '/c/'}, start_response)
+        self.assertTrue(start_response.call_args[0][0].startswith('503'))
+        self.assertEqual(control.rejected, 1)
+        waiter.kill()
+        self.assertEqual(control.waiting, 0)
+
+    def test_no_limit(self):
+        control = AdmissionControl(self.app, max_requests=0,
+                                   route_limits={})
+        self.assertIsNone(control.semaphore)
+        for i in xrange(10):
+            control({'PATH_INFO': '/a/'}, Mock())
+        self.assertEqual(control.rejected, 0)
+
+
+class test_HttpServer(unittest.TestCase):
+
+    def setUp(self):
+        self._Event = thread.Event
+        thread.Event = Event
+
+    def tearDown(self):
+        thread.Event = self._Event
+
+    def test_options(self):
+        server = HttpServer(('localhost', 0), backlog=10, keepalive=False,
+                            idle_timeout=30, max_connections=100)
+        self.assertEqual(server.addrport, ('127.0.0.1', 0))
+        self.assertFalse(server.keepalive)
+        self.assertEqual(server.idle_timeout, 30)
+        self.assertEqual(server.max_connections, 100)
+        sock = server.listen()
+        try:
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP,
+                                            socket.TCP_NODELAY))
+        finally:
+            sock.close()
+
+    def test_server(self):
+        server = HttpServer(('localhost', 0), idle_timeout=0)
+        _server = httpd.wsgi.server
+        httpd.wsgi.server = Mock()
+        try:
+            server.server(Mock(), Mock())
+            kwargs = httpd.wsgi.server.call_args[1]
+            self.assertIsNone(kwargs['socket_timeout'])
+            self.assertEqual(kwargs['max_size'], server.max_connections)
+        finally:
+            httpd.wsgi.server = _server
+
+    @patch('cyme.conf.CYME_ASYNC_OPERATIONS', False)
+    @patch('cyme.conf.CYME_RATE_LIMITS', False)
+    def test_shared_port(self):
+        first = HttpServer(('localhost', 0), workers=2)
+        sock = first.listen()
+        try:
+            port = sock.getsockname()[1]
+            second = HttpServer(('localhost', port), workers=2)
+            second.listen().close()
+        finally:
+            sock.close()
+
+    def test_workers_require_stateless(self):
+        # rate limits and async operations are enabled by default.
+        with self.assertRaises(ImproperlyConfigured):
+            HttpServer(('localhost', 0), workers=2)
+        with patch('cyme.conf.CYME_RATE_LIMITS', False):
+            with self.assertRaises(ImproperlyConfigured):
+                HttpServer(('localhost', 0), workers=2)
+
+    @patch('cyme.branch.httpd.ObserverAgent')
+    @patch('cyme.branch.httpd.db')
+    def test_after_fork(self, db, ObserverAgent):
+        actors = (apps, branches, instances, queues)
+        saved = [(actor.agent, actor.connection) for actor in actors]
+        server = HttpServer(('localhost', 0))
+        server.reset_hub = Mock()
+        try:
+            server.after_fork()
+            for actor in actors:
+                self.assertIs(actor.agent, ObserverAgent.return_value)
+            ObserverAgent.return_value.presence.start.assert_called_with()
+        finally:
+            for actor, (agent, connection) in zip(actors, saved):
+                actor.agent, actor.connection = agent, connection
+
+    @patch('cyme.branch.httpd.set_process_title')
+    @patch('cyme.branch.httpd.signal')
+    @patch('cyme.branch.httpd.os')
+    def test_supervise_workers(self, os, signal, set_process_title):
+        server = HttpServer(('localhost', 0))
+        server.workers, server.restart_delay = 3, 0
+        server.reset_hub = Mock()
+        server.fork_worker = Mock(side_effect=[101, 102, 103])
+        exits = [(101, 256)]
+
+        def waitpid(pid, options):
+            if exits:
+                return exits.pop()
+            # stopped while waiting.
+            stop = signal.signal.call_args[0][1]
+            stop()
+            os.waitpid.side_effect = [(102, 0), (103, 0)]
+            return os.waitpid(pid, options)
+        os.waitpid.side_effect = waitpid
+        server.supervise_workers()
+        # the worker that exited was restarted once.
+        self.assertEqual([c[0][0] for c in server.fork_worker.call_args_list],
+                         [1, 2, 1])
+        self.assertEqual(sorted(c[0][0] for c in os.kill.call_args_list),
+                         [102, 103])
+        os._exit.assert_called_with(0)
+
+
+class test_worker_listing(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = ObserverAgent(BrokerConnection('memory://'))
+        self.actor = Queue(BrokerConnection('memory://'))
+        self.actor.agent = self.agent
+
+    def collect_replies(self, replies):
+
+        def collect(conn, channel, queue, limit=None, timeout=None, **kw):
+            # like kombu: waits for more replies until the limit.
+            for i, reply in enumerate(replies):
+                yield reply
+                if i + 1 == limit:
+                    return
+            sleep(timeout)
+        return collect
+
+    def test_listing(self):
+        for agent in ('A.1', 'B.1'):
+            self.agent.presence.state.update_agent(agent, actors=['Queue'])
+        replies = [{'ok': ['a']}, {'ok': ['b']}]
+        with patch('cl.actors.collect_replies',
+                   self.collect_replies(replies)):
+            with Timeout(1):
+                self.assertEqual(sorted(flatten(self.actor.iterall())),
+                                 ['a', 'b'])
+
+    def test_no_agents_known(self):
+        self.assertIsNone(self.agent.get_default_scatter_limit('Queue'))
+        self.assertIsNone(self.actor.lookup('foo'))
@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from celery.tests.utils import unittest
+from mock import Mock
+
+from cyme.branch.limits import RateLimits, validate
+
+
+def App(name='foo', rate_limit=None, queue_rate_limits=None):
+    app = Mock()
+    app.name = name
+    app.rate_limit = rate_limit
+    app.get_queue_rate_limits.return_value = queue_rate_limits or {}
+    return app
+
+
+class test_RateLimits(unittest.TestCase):
+
+    def test_unlimited(self):
+        limits = RateLimits(burst=1)
+        for i in xrange(100):
+            self.assertEqual(limits.consume(App(), 'tasks'), 0)
+        self.assertEqual(limits.stats()['foo']['accepted'], 100)
+
+    def test_app_limit(self):
+        limits = RateLimits(burst=1)
+        app = App(rate_limit='2/s')
+        self.assertEqual(limits.consume(app), 0)
+        self.assertEqual(limits.consume(app), 0)
+        retry_after = limits.consume(app)
+        self.assertTrue(0 < retry_after <= 0.5)
+        self.assertEqual(limits.stats()['foo'],
+                         {'accepted': 2, 'rejected': 1})
+
+    def test_queue_limit(self):
+        limits = RateLimits(burst=3600)
+        app = App(rate_limit='10/h', queue_rate_limits={'tasks': '1/h'})
+        self.assertEqual(limits.consume(app, 'tasks'), 0)
+        self.assertTrue(limits.consume(app, 'tasks'))
+        # rejected requests do not consume from the app bucket.
+        for i in xrange(9):
+            self.assertEqual(limits.consume(app, 'other'), 0)
+        self.assertTrue(limits.consume(app, 'other'))
+
+    def test_consume_many(self):
+        limits = RateLimits(burst=3600)
+        app = App(rate_limit='10/h', queue_rate_limits={'tasks': '2/h'})
+        self.assertEqual(limits.consume_many(app, {'tasks': 1, None: 5}), 0)
+        # rejected as a whole, when one of the buckets cannot accept.
+        self.assertTrue(limits.consume_many(app, {'tasks': 2, None: 1}))
+        self.assertTrue(limits.consume_many(app, {None: 5}))
+        self.assertEqual(limits.consume_many(app, {None: 4}), 0)
+        self.assertEqual(limits.stats()['foo'],
+                         {'accepted': 10, 'rejected': 8})
+
+    def test_consume_more_than_capacity(self):
+        limits = RateLimits(burst=1)
+        app = App(rate_limit='2/s')
+        # accepted as the bucket is full, and owed by the next requests.
+        self.assertEqual(limits.consume_many(app, {None: 4}), 0)
+        self.assertTrue(1 < limits.consume(app) <= 1.5)
+
+    def test_disabled(self):
+        limits = RateLimits(burst=1, enabled=False)
+        app = App(rate_limit='1/h')
+        for i in xrange(10):
+            self.assertEqual(limits.consume(app), 0)
+
+    def test_limit_changed(self):
+        limits = RateLimits(burst=1)
+        self.assertEqual(limits.consume(App(rate_limit='1/m')), 0)
+        self.assertTrue(limits.consume(App(rate_limit='1/m')))
+        self.assertEqual(limits.consume(App(rate_limit='1/s')), 0)
+        self.assertEqual(limits.consume(App(rate_limit='')), 0)
+
+    def test_validate(self):
+        validate('10/s', '{"tasks": "1/m"}')
+        with self.assertRaises(ValueError):
+            validate('10/fortnight')
+        with self.assertRaises(ValueError):
+            validate(None, '{"tasks": "x"}')
+        with self.assertRaises(ValueError):
+            validate(None, '[["tasks", "1/m"]]')
+        with self.assertRaises(ValueError):
+            validate(None, '{"tasks": 10}')
@@ -3,7 +3,18 @@ from __future__ import absolute_import
 from celery.tests.utils import unittest
 from mock import Mock
 
-from cyme.models import Instance, Queue
+from cyme.models import App, Instance, Queue
+
+
+class test_App(unittest.TestCase):
+
+    def test_queue_rate_limits(self):
+        app = App(name='foo', queue_rate_limits='{"tasks": "1/m"}')
+        limits = app.get_queue_rate_limits()
+        self.assertEqual(limits, {'tasks': '1/m'})
+        self.assertIs(app.get_queue_rate_limits(), limits)
+        app.queue_rate_limits = None
+        self.assertEqual(app.get_queue_rate_limits(), {})
 
 
 class test_Queue(unittest.TestCase):
@@ -20,6 +31,15 @@ class test_Queue(unittest.TestCase):
         x = Queue.objects.enabled()
         self.assertEqual(x[0], q1)
 
+    def test_names(self):
+        for name in ('a1', 'a2', 'a3', 'b1'):
+            Queue.objects.add(name)
+        names = Queue.objects.names
+        self.assertEqual(names(prefix='a'), ['a1', 'a2', 'a3'])
+        self.assertEqual(names(limit=2), ['a1', 'a2'])
+        self.assertEqual(names(cursor='a2', limit=2), ['a3', 'b1'])
+        Queue.objects.all().delete()
+
 
 class test_Instance(unittest.TestCase):
 
@@ -36,6 +56,14 @@ class test_Instance(unittest.TestCase):
     def test__unicode__(self):
         self.assertTrue(unicode(Instance(name='foo')))
 
+    def test_names_queue(self):
+        for name, queues in (('i1', 'foo'), ('i2', 'bar,foo,baz'),
+                             ('i3', 'foobar'), ('i4', 'bar,foo')):
+            Instance.objects.create(name=name, _queues=queues,
+                                    app=App.objects.get_default())
+        self.assertEqual(Instance.objects.names(queue='foo'),
+                         ['i1', 'i2', 'i4'])
+
     def test_add(self):
         n1 = Instance.objects.add()
         self.assertTrue(n1.name)
@@ -65,11 +93,21 @@ class test_Instance(unittest.TestCase):
         q = Queue.objects.create(name='xiziasd')
         q.save()
 
-        n.add_queue(q)
-        n._query.assert_called_with('add_consumer', dict(queue=q.name,
-                                    exchange=q.name, routing_key=q.name,
-                                    exchange_type=None))
+        declaration = dict(queue=q.name, exchange=q.name,
+                           routing_key=q.name, exchange_type=None)
+        n._query.return_value = {'ok': {q.name: {'ok': 'consuming'}}}
+        self.assertEqual(n.add_queue(q), {'ok': 'consuming'})
+        n._query.assert_called_with('cyme_update_consumers',
+                                    dict(add=[declaration], cancel=[]))
 
+        n.cancel_queue(q)
+        n._query.assert_called_with('cyme_update_consumers',
+                                    dict(add=[], cancel=[q.name]))
+
+        # instances started by older versions
+        n._query.return_value = {'error': "KeyError('cyme_update_consumers')"}
+        n.add_queue(q)
+        n._query.assert_called_with('add_consumer', declaration)
         n.cancel_queue(q)
         n._query.assert_called_with('cancel_consumer', dict(queue=q.name))
 
@@ -0,0 +1,42 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from celery.tests.utils import unittest
+from eventlet import sleep
+
+from cyme.branch.operations import FAILURE, SUCCESS, Operations
+
+
+class test_Operations(unittest.TestCase):
+
+    def test_spawn(self):
+        ops = Operations(max_size=10)
+        op = ops.spawn('add', lambda x, y: x + y, 2, 2)
+        self.assertIs(ops.get(op.id), op)
+        self.assertTrue(op.wait(1))
+        d = op.as_dict()
+        self.assertEqual(d['state'], SUCCESS)
+        self.assertEqual(d['result'], 4)
+        self.assertTrue(d['finished'] >= d['started'] >= d['created'])
+
+    def test_failure(self):
+
+        def fail():
+            raise KeyError('foo')
+        op = Operations(max_size=10).spawn('fail', fail)
+        op.wait(1)
+        self.assertEqual(op.state, FAILURE)
+        self.assertIn('KeyError', op.error[0])
+
+    def test_evict(self):
+        ops = Operations(max_size=2)
+        first = ops.spawn('sleep', sleep, 10)
+        done = ops.spawn('noop', lambda: None)
+        done.wait(1)
+        ops.spawn('noop', lambda: None)
+        # the finished operation is forgotten first.
+        self.assertEqual(len(ops), 2)
+        self.assertIs(ops.get(first.id), first)
+        with self.assertRaises(KeyError):
+            ops.get(done.id)
+        first._done.send(True)
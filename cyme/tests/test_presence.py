@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+
+from celery.tests.utils import unittest
+from mock import Mock
+
+from cyme.branch.presence import ModelNames, State
+
+
+class Obj(object):
+
+    def __init__(self, pk, name):
+        self.pk = pk
+        self.name = name
+
+
+class test_ModelNames(unittest.TestCase):
+
+    def setUp(self):
+        model = Mock()
+        model._default_manager.values_list.return_value = [(1, 'a')]
+        self.names = ModelNames(model)
+
+    def test_changes(self):
+        self.assertEqual(self.names.names, ['a'])
+        self.names._on_save(instance=Obj(2, 'b'))
+        self.names._on_save(instance=Obj(2, 'b'))  # not changed
+        self.assertEqual(self.names.version, 1)
+        self.names._on_save(instance=Obj(1, 'A'))  # renamed
+        self.names._on_delete(instance=Obj(2, 'b'))
+        self.assertEqual(self.names.version, 4)
+        self.assertEqual(self.names.delta(0), (['A'], ['a']))
+        self.assertEqual(self.names.delta(1), (['A'], ['a', 'b']))
+        self.assertEqual(self.names.delta(4), ([], []))
+        self.assertIsNone(self.names.delta(5))
+
+    def test_saved_before_first_use(self):
+        db = {1: 'a'}
+        model = Mock()
+        model._default_manager.values_list.side_effect = \
+                lambda *fields: db.items()
+        names = ModelNames(model)
+        db[2] = 'b'
+        names._on_save(instance=Obj(2, 'b'))
+        self.assertEqual(names.version, 1)
+        self.assertEqual(names.delta(0), (['b'], []))
+
+    def test_etag(self):
+        etag = self.names.etag
+        self.names._on_save(instance=Obj(1, 'a'))  # name not changed
+        self.assertEqual(self.names.version, 0)
+        self.assertNotEqual(self.names.etag, etag)
+
+    def test_delta_expired(self):
+        self.names.max_changes = 2
+        for i in xrange(3):
+            self.names._on_save(instance=Obj(i + 10, str(i)))
+        self.assertIsNone(self.names.delta(0))
+        self.assertEqual(self.names.delta(1), (['1', '2'], []))
+
+
+class test_State(unittest.TestCase):
+
+    def setUp(self):
+        self.presence = Mock()
+        self.presence.interval = 10
+        self.presence.agent.id = 'me'
+        self.state = State(self.presence)
+
+    def meta(self, agent='A'):
+        return self.state._agents[agent]['meta']['Instance']['instances']
+
+    def test_apply(self):
+        apply = self.state.apply_meta_delta
+        apply('A', {'Instance': {'version': 3, 'full': {'instances': ['x']}}})
+        apply('A', {'Instance': {'version': 4, 'base': 3,
+                                 'added': {'instances': ['y']}}})
+        apply('A', {'Instance': {'version': 5, 'base': 4,
+                                 'removed': {'instances': ['x']}}})
+        apply('A', {'Instance': {'version': 5, 'base': 5}})
+        self.assertEqual(self.meta(), set(['y']))
+        self.assertFalse(self.presence.send_resync_request.called)
+
+    def test_gap_requests_resync(self):
+        apply = self.state.apply_meta_delta
+        apply('A', {'Instance': {'version': 3, 'full': {'instances': ['x']}}})
+        apply('A', {'Instance': {'version': 6, 'base': 5,
+                                 'added': {'instances': ['z']}}})
+        self.assertEqual(self.meta(), set(['x']))
+        self.presence.send_resync_request.assert_called_with('A')
+
+    def test_etags(self):
+        apply = self.state.apply_meta_delta
+        apply('A', {'Instance': {'version': 3, 'etag': 'x.1',
+                                 'full': {'instances': ['x']}}})
+        apply('B', {'Instance': {'version': 1, 'etag': 'y.1',
+                                 'full': {'instances': ['y']}}})
+        apply('A', {'Instance': {'version': 3, 'etag': 'x.2', 'base': 3}})
+        self.assertEqual(self.state.etags_for('Instance'),
+                         [('A', 'x.2'), ('B', 'y.1')])
+        self.state._remove_agent('B')
+        self.assertEqual(self.state.etags_for('Instance'), [('A', 'x.2')])
+
+    def test_wakeup_applies_delta(self):
+        self.state.when_heartbeat(agent='A', meta_delta={'Instance': {
+            'version': 3, 'etag': 'x.1', 'full': {'instances': ['x']}}})
+        self.state.when_wakeup(agent='A', meta_delta={'Instance': {
+            'version': 4, 'etag': 'x.2', 'base': 3,
+            'added': {'instances': ['y']}}})
+        self.assertEqual(self.meta(), set(['x', 'y']))
+        self.assertEqual(self.state.etags_for('Instance'), [('A', 'x.2')])
+        self.presence.send_heartbeat.assert_called_with()
+
+    def test_resync(self):
+        self.state.when_resync(agent='A', target='me')
+        self.presence.send_heartbeat.assert_called_with(full=True)
+
+    def test_resync_by_observer(self):
+        self.state.when_resync(agent='W', target=None)
+        self.presence.send_heartbeat.assert_called_with(full=True)
+        self.presence.send_heartbeat.reset_mock()
+        self.state.when_resync(agent='A', target='other')
+        self.assertFalse(self.presence.send_heartbeat.called)
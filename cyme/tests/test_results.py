@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+from celery import states
+from celery.backends.base import KeyValueStoreBackend
+from celery.tests.utils import unittest
+from eventlet import spawn_after
+from eventlet.event import Event
+from mock import Mock
+
+from cyme.branch import results
+from cyme.branch import thread
+
+
+class MemoryBackend(KeyValueStoreBackend):
+
+    def __init__(self, *args, **kwargs):
+        super(MemoryBackend, self).__init__(*args, **kwargs)
+        self.data = {}
+        self.mget = Mock(side_effect=self._mget)
+
+    def _mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+class test_fetch_many(unittest.TestCase):
+
+    def test_mget(self):
+        backend = MemoryBackend()
+        backend.store_result('a', 42, states.SUCCESS)
+        metas = results.fetch_many(['a', 'b'], backend)
+        self.assertEqual(metas['a']['result'], 42)
+        self.assertEqual(metas['b']['status'], states.PENDING)
+        self.assertEqual(backend.mget.call_count, 1)
+        # ready tasks are cached.
+        results.fetch_many(['a'], backend)
+        self.assertEqual(backend.mget.call_count, 1)
+
+    def test_without_mget(self):
+        backend = Mock()
+        backend._cache = {}
+        backend.get_task_meta.return_value = {'status': states.STARTED}
+        metas = results.fetch_many(['a', 'b'], backend)
+        self.assertEqual(metas['b']['status'], states.STARTED)
+        self.assertEqual(backend.get_task_meta.call_count, 2)
+
+
+class test_ResultPoller(unittest.TestCase):
+
+    def setUp(self):
+        self._Event = thread.Event
+        thread.Event = Event
+        self.backend = MemoryBackend()
+        self.poller = results.ResultPoller(interval=0.01,
+                                           backend=self.backend)
+
+    def tearDown(self):
+        thread.Event = self._Event
+
+    def test_wait(self):
+        self.backend.store_result('a', 42, states.SUCCESS)
+        spawn_after(0.01, self.poller.poll)
+        got = list(self.poller.wait(['a', 'b'], timeout=0.1))
+        self.assertEqual([(task_id, meta['result']) for task_id, meta in got],
+                         [('a', 42)])
+        self.assertFalse(self.poller._waiters)
+
+    def test_as_dict(self):
+        d = results.as_dict('a', {'status': states.FAILURE,
+                                  'result': KeyError('x')})
+        self.assertEqual(d['state'], states.FAILURE)
+        self.assertIn('KeyError', d['result'])
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+from celery.tests.utils import unittest
+from mock import Mock
+
+from cyme.branch import thread
+from cyme.branch.scaler import ControllerScaler
+
+
+def mock_controller(latency=0.0, idle=0.0):
+    c = Mock()
+    c.thread.latency = latency
+    c.thread.idle_since.return_value = idle
+    return c
+
+
+class test_ControllerScaler(unittest.TestCase):
+
+    def setUp(self):
+        self._Event, thread.Event = thread.Event, Mock()
+        self.branch = Mock()
+        self.branch.numc = 1
+        self.branch.maxc = 3
+        self.branch.controllers = [mock_controller()]
+        self.scaler = ControllerScaler(self.branch)
+        self.scaler.backlog = Mock()
+        self.scaler.backlog.return_value = 0
+
+    def tearDown(self):
+        thread.Event = self._Event
+
+    def test_scale_up_on_backlog(self):
+        self.scaler.backlog.return_value = 10
+        self.scaler.maybe_scale()
+        self.branch.add_controller.assert_called_with()
+
+    def test_scale_up_on_latency(self):
+        self.branch.controllers = [mock_controller(latency=5.0)]
+        self.scaler.maybe_scale()
+        self.branch.add_controller.assert_called_with()
+
+    def test_no_scale_up_above_max(self):
+        self.scaler.backlog.return_value = 100
+        self.branch.controllers = [mock_controller() for i in xrange(3)]
+        self.scaler.maybe_scale()
+        self.assertFalse(self.branch.add_controller.called)
+
+    def test_retire_idle(self):
+        retiring = mock_controller(idle=120.0)
+        self.branch.controllers = [mock_controller(), retiring]
+        self.scaler.maybe_scale()
+        self.branch.remove_controller.assert_called_with(retiring,
+                drain_timeout=self.scaler.drain_timeout)
+
+    def test_keeps_busy_and_min(self):
+        self.branch.controllers = [mock_controller(), mock_controller(idle=1)]
+        self.scaler.maybe_scale()
+        self.branch.controllers = [mock_controller(idle=120.0)]
+        self.scaler.maybe_scale()
+        self.assertFalse(self.branch.remove_controller.called)
+
+    def test_cooldown(self):
+        self.scaler.backlog.return_value = 10
+        self.scaler.maybe_scale()
+        self.scaler.maybe_scale()
+        self.assertEqual(self.branch.add_controller.call_count, 1)
@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+
+from celery.tests.utils import unittest
+from mock import Mock
+
+from cyme.status import Status
+
+
+class MockStatus(Status):
+
+    def insured(self, instance, fun, *args, **kwargs):
+        return fun(*args, **kwargs)
+
+
+def mock_instance(status):
+    instance = Mock()
+    instance.is_enabled = True
+    instance.max_concurrency, instance.min_concurrency = 10, 2
+    instance.queues = ['images']
+    instance.direct_queue = 'dq.foo'
+    instance.status.return_value = status
+    return instance
+
+
+class test_Status(unittest.TestCase):
+
+    def test_verify_using_cyme_status(self):
+        instance = mock_instance({'autoscaler': {'max': 10, 'min': 2},
+                                  'queues': ['dq.foo', 'video']})
+        MockStatus()._do_verify_instance(instance)
+        self.assertFalse(instance.restart.call_count)
+        self.assertFalse(instance.stats.call_count)
+        self.assertFalse(instance.consuming_from.call_count)
+        self.assertFalse(instance.autoscale.call_count)
+        instance.update_consumers.assert_called_with(['images'], ['video'])
+
+    def test_verify_older_worker(self):
+        instance = mock_instance({'error': "KeyError('cyme_status')"})
+        instance.stats.return_value = {'autoscaler': {'max': 4, 'min': 1}}
+        instance.consuming_from.return_value = {'images': {}}
+        MockStatus()._do_verify_instance(instance)
+        self.assertFalse(instance.restart.call_count)
+        instance.autoscale.assert_called_with(10, 2)
+        self.assertFalse(instance.update_consumers.call_count)
+
+    def test_verify_not_alive(self):
+        instance = mock_instance(None)
+        instance.stats.return_value = None
+        instance.consuming_from.return_value = None
+        status = MockStatus()
+        status._do_restart_instance = Mock()
+        status._do_verify_instance(instance)
+        self.assertTrue(status._do_restart_instance.call_count)
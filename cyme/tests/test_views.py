@@ -0,0 +1,298 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+from StringIO import StringIO
+
+from anyjson import deserialize, serialize
+from celery.tests.utils import unittest
+from django.test.client import RequestFactory
+from mock import Mock, patch
+
+from cyme.api import views
+from cyme.branch.httpd import FastRouter
+
+
+class test_apply_many(unittest.TestCase):
+
+    def setUp(self):
+        self.view = views.apply_many.as_view()
+
+    def post(self, items):
+        return self.view(RequestFactory().post('/foo/apply/',
+                            serialize(items), content_type='application/json'),
+                         app='foo')
+
+    def test_bad_request(self):
+        self.assertEqual(self.post({'url': 'http://x'}).status_code, 400)
+        self.assertEqual(self.post([{'method': 'GET'}]).status_code, 400)
+
+    @patch('cyme.api.views.webhook')
+    @patch('cyme.api.views.queues')
+    @patch('cyme.api.views.rate_limits')
+    @patch('cyme.api.views.apps')
+    def test_apply(self, apps, rate_limits, queues, webhook):
+        rate_limits.consume_many.return_value = 0
+        producers = apps.get.return_value.get_broker.return_value.producers
+        producer = producers.acquire.return_value.__enter__.return_value
+        producer.connection.as_uri.return_value = 'memory://'
+        queues.get.return_value = {'exchange': 'x', 'exchange_type': 'direct',
+                                   'routing_key': 'x'}
+        webhook.apply_async.side_effect = [Mock(task_id=str(i))
+                                            for i in range(3)]
+        response = self.post([{'url': 'http://a', 'queue': 'q'},
+                              {'url': 'http://b', 'method': 'post'},
+                              {'url': 'http://c', 'queue': 'q'}])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(deserialize(response.content)['uuids'],
+                         ['0', '1', '2'])
+        self.assertEqual(producers.acquire.call_count, 1)
+        queues.get.assert_called_once_with('q')
+        args, kwargs = webhook.apply_async.call_args_list[1]
+        self.assertEqual(args[0], ('http://b', 'POST', {}, None))
+        self.assertNotIn('exchange', kwargs)
+
+    @patch('cyme.api.views.rate_limits')
+    @patch('cyme.api.views.apps')
+    def test_rate_limited(self, apps, rate_limits):
+        rate_limits.consume_many.return_value = 0.5
+        response = self.post([{'url': 'http://a', 'queue': 'q'},
+                              {'url': 'http://b', 'queue': 'q'},
+                              {'url': 'http://c'}])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        rate_limits.consume_many.assert_called_with(apps.get.return_value,
+                                                    {'q': 2, None: 1})
+        self.assertFalse(apps.get.return_value.get_broker.called)
+
+
+class test_batch(unittest.TestCase):
+
+    def test_invalid_operation(self):
+        body = serialize([{'method': 'restart', 'args': {'name': 'x'}},
+                          {'method': 'restart', 'name': 'x'}])
+        response = views.batch.as_view()(RequestFactory().post(
+                        '/foo/batch/instances/', body,
+                        content_type='application/json'),
+                        app='foo', actor='instances')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('index 1', response.content)
+
+
+class test_apply(unittest.TestCase):
+
+    @patch('cyme.api.views.rate_limits')
+    @patch('cyme.api.views.apps')
+    def test_rate_limited(self, apps, rate_limits):
+        rate_limits.consume.return_value = 1.5
+        view = views.apply.as_view()
+        response = view(RequestFactory().get('/foo/queue/tasks/http://x/'),
+                        app='foo', rest='tasks/http://x/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        rate_limits.consume.assert_called_with(apps.get.return_value,
+                                               'tasks')
+
+    @patch('cyme.api.views.webhook')
+    @patch('cyme.api.views.queues')
+    @patch('cyme.api.views.rate_limits')
+    @patch('cyme.api.views.apps')
+    def test_raw_body(self, apps, rate_limits, queues, webhook):
+        rate_limits.consume.return_value = 0
+        producers = apps.get.return_value.get_broker.return_value.producers
+        producer = producers.acquire.return_value.__enter__.return_value
+        producer.connection.as_uri.return_value = 'memory://'
+        queues.get.return_value = {'exchange': 'x', 'exchange_type': 'direct',
+                                   'routing_key': 'x'}
+        webhook.apply_async.return_value = Mock(task_id='1')
+        view = views.apply.as_view()
+        body = '{"user": 133}'
+        response = view(RequestFactory().post('/foo/queue/tasks/http://x/',
+                            body, content_type='application/json'),
+                        app='foo', rest='tasks/http://x/')
+        self.assertEqual(response.status_code, 202)
+        args, kwargs = webhook.apply_async.call_args
+        self.assertEqual(args[0][2:], ({}, body,
+                                       {'Content-Type': 'application/json'}))
+
+        with patch('cyme.conf.CYME_APPLY_MAX_BODY_SIZE', 4):
+            response = view(RequestFactory().post(
+                                '/foo/queue/tasks/http://x/',
+                                body, content_type='application/json'),
+                            app='foo', rest='tasks/http://x/')
+            self.assertEqual(response.status_code, 413)
+        self.assertEqual(rate_limits.consume.call_count, 1)
+
+    def wsgi_apply(self, body, content_type):
+        # chunked requests have no content length.
+        start_response = Mock()
+        response = FastRouter(Mock())({
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/foo/queue/tasks/http://x/',
+            'CONTENT_TYPE': content_type,
+            'HTTP_TRANSFER_ENCODING': 'chunked',
+            'wsgi.input': body}, start_response)
+        return start_response.call_args[0][0], response
+
+    @patch('cyme.api.views.rate_limits')
+    @patch('cyme.api.views.apps')
+    def test_chunked_body_too_large(self, apps, rate_limits):
+        body = StringIO('x' * 100)
+        with patch('cyme.conf.CYME_APPLY_MAX_BODY_SIZE', 10):
+            status, _ = self.wsgi_apply(body, 'application/json')
+        self.assertTrue(status.startswith('413'))
+        # the rest of the body is not read.
+        self.assertEqual(body.tell(), 11)
+        self.assertFalse(rate_limits.consume.called)
+
+    @patch('cyme.api.views.rate_limits')
+    @patch('cyme.api.views.apps')
+    def test_chunked_form(self, apps, rate_limits):
+        body = StringIO('x=1&' * 100)
+        with patch('cyme.conf.CYME_APPLY_MAX_BODY_SIZE', 10):
+            status, _ = self.wsgi_apply(body,
+                                        'application/x-www-form-urlencoded')
+        self.assertTrue(status.startswith('411'))
+        self.assertEqual(body.tell(), 0)
+        self.assertFalse(rate_limits.consume.called)
+
+
+class test_wait_many(unittest.TestCase):
+
+    def setUp(self):
+        self.view = views.wait_many.as_view()
+
+    def test_bad_request(self):
+        response = self.view(RequestFactory().get('/foo/query/wait/'),
+                             app='foo')
+        self.assertEqual(response.status_code, 400)
+
+    @patch('cyme.api.views.results')
+    def test_stream(self, results):
+        results.wait.return_value = iter([('b', {'status': 'SUCCESS',
+                                                 'result': 42})])
+        response = self.view(RequestFactory().get('/foo/query/wait/',
+                                {'uuids': 'a,b', 'timeout': '3'}), app='foo')
+        lines = [deserialize(line) for line in response]
+        self.assertEqual(lines, [{'uuid': 'b', 'state': 'SUCCESS',
+                                  'result': 42},
+                                 {'pending': ['a']}])
+        results.wait.assert_called_once_with(['a', 'b'], timeout=3.0)
+
+
+class test_query_many(unittest.TestCase):
+
+    def setUp(self):
+        self.view = views.query_many.as_view()
+
+    def post(self, uuids, what):
+        return self.view(RequestFactory().post('/foo/query/%s/' % (what, ),
+                            serialize(uuids), content_type='application/json'),
+                         app='foo', what=what)
+
+    def test_bad_request(self):
+        self.assertEqual(self.post([], 'states').status_code, 400)
+        self.assertEqual(self.post([1], 'states').status_code, 400)
+
+    @patch('cyme.api.views.fetch_many')
+    def test_query(self, fetch_many):
+        fetch_many.return_value = {'a': {'status': 'SUCCESS', 'result': 42},
+                                   'b': {'status': 'PENDING', 'result': None}}
+        self.assertEqual(deserialize(self.post(['a', 'b'], 'states').content),
+                         {'a': 'SUCCESS', 'b': 'PENDING'})
+        self.assertEqual(deserialize(self.post({'uuids': ['a', 'b']},
+                                               'results').content),
+                         {'a': 42, 'b': None})
+        fetch_many.assert_called_with(['a', 'b'])
+
+
+class test_conditional_listing(unittest.TestCase):
+
+    def setUp(self):
+        self.view = views.Queue.as_view()
+
+    @patch('cyme.api.views.queues')
+    def test_not_modified(self, queues):
+        queues.etag.return_value = 'abc'
+        queues.iterall.return_value = iter([['a'], [], ['b', 'c']])
+        response = self.view(RequestFactory().get('/foo/queues/'), app='foo')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertEqual(deserialize(''.join(response)), ['a', 'b', 'c'])
+        response = self.view(RequestFactory().get('/foo/queues/',
+                                HTTP_IF_NONE_MATCH='"abc"'), app='foo')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queues.iterall.call_count, 1)
+
+    @patch('cyme.api.views.queues')
+    def test_error_reply(self, queues):
+        queues.etag.return_value = None
+
+        def replies(error_first=False):
+            if not error_first:
+                yield ['a']
+            raise KeyError('b')
+
+        queues.iterall.return_value = replies()
+        response = self.view(RequestFactory().get('/foo/queues/'), app='foo')
+        self.assertEqual(response.status_code, 200)
+        names = deserialize(''.join(response))
+        self.assertEqual(names[0], 'a')
+        self.assertIn('nok', names[-1])
+
+        queues.iterall.return_value = replies(error_first=True)
+        response = self.view(RequestFactory().get('/foo/queues/'), app='foo')
+        self.assertEqual(response.status_code, 500)
+
+    @patch('cyme.api.views.queues')
+    def test_untagged(self, queues):
+        # e.g. in the HTTP workers.
+        queues.etag.return_value = None
+        queues.iterall.return_value = iter([['a']])
+        response = self.view(RequestFactory().get('/foo/queues/',
+                                HTTP_IF_NONE_MATCH='"None"'), app='foo')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    @patch('cyme.api.views.queues')
+    def test_paginated(self, queues):
+        queues.all.return_value = {'names': ['a'], 'cursor': 'a'}
+        response = self.view(RequestFactory().get('/foo/queues/',
+                                                  {'limit': '1'}), app='foo')
+        self.assertEqual(deserialize(response.content),
+                         {'names': ['a'], 'cursor': 'a'})
+        queues.all.assert_called_with(limit=1)
+
+
+class test_nowait(unittest.TestCase):
+
+    @patch('cyme.api.views.instances')
+    def test_schedule(self, instances):
+        instances.remove.__name__ = 'remove'
+        instances.remove.im_self.name = 'Instance'
+        instances.remove.return_value = 'ok'
+        response = views.Instance.as_view()(
+                        RequestFactory().delete('/foo/instances/!/x/'),
+                        app='foo', name='x', nowait='!/')
+        self.assertEqual(response.status_code, 202)
+        id = deserialize(response.content)['operation']
+        response = views.operation.as_view()(
+                        RequestFactory().get('/operations/%s/' % (id, ),
+                                             {'wait': '1'}), id=id)
+        op = deserialize(response.content)
+        self.assertEqual(op['name'], 'Instance.remove')
+        self.assertEqual(op['result'], 'ok')
+        instances.remove.assert_called_with('x')
+
+    @patch('cyme.conf.CYME_ASYNC_OPERATIONS', False)
+    @patch('cyme.api.views.instances')
+    def test_disabled(self, instances):
+        response = views.Instance.as_view()(
+                        RequestFactory().delete('/foo/instances/!/x/'),
+                        app='foo', name='x', nowait='!/')
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(instances.remove.called)
+
+    def test_unknown_operation(self):
+        response = views.operation.as_view()(
+                        RequestFactory().get('/operations/x/'), id='x')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import gzip
+
+from StringIO import StringIO
+
+from anyjson import deserialize
+from celery.tests.utils import unittest
+from django.test.client import RequestFactory
+
+from cyme.api import web
+
+
+class test_select_json_encoder(unittest.TestCase):
+
+    def test_select(self):
+        self.assertEqual(web.select_json_encoder('json')[0], 'json')
+        name, encode = web.select_json_encoder('nonexisting')
+        self.assertIn(name, [module for module, _ in web.JSON_ENCODERS])
+        self.assertEqual(deserialize(encode({'x': [1]})), {'x': [1]})
+
+
+class test_iterencode_lists(unittest.TestCase):
+
+    def test_iterencode(self):
+        self.assertEqual(deserialize(''.join(web.iterencode_lists(
+                            iter([['a'], [], ('b', 'c')])))),
+                         ['a', 'b', 'c'])
+        self.assertEqual(''.join(web.iterencode_lists([])), '[]')
+
+    def test_error_mid_stream(self):
+
+        def lists():
+            yield ['a']
+            raise KeyError('b')
+
+        items = deserialize(''.join(web.iterencode_lists(lists())))
+        self.assertEqual(items[0], 'a')
+        self.assertIn('KeyError', items[1]['nok'][0])
+
+    def test_error_before_stream(self):
+
+        def lists():
+            raise KeyError('a')
+            yield ['a']
+
+        with self.assertRaises(KeyError):
+            web.StreamingJsonResponse(lists())
+
+
+class test_maybe_gzip(unittest.TestCase):
+
+    def request(self, accept='gzip, deflate'):
+        return RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+
+    def test_compress(self):
+        data = {'names': ['instance%s' % i for i in xrange(200)]}
+        response = web.maybe_gzip(self.request(), web.JsonResponse(data),
+                                  min_size=100)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = gzip.GzipFile(fileobj=StringIO(response.content)).read()
+        self.assertEqual(deserialize(body), data)
+
+    def test_not_accepted(self):
+        response = web.maybe_gzip(self.request('identity'),
+                                  web.JsonResponse({'x': 'y' * 200}),
+                                  min_size=100)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_too_small(self):
+        response = web.maybe_gzip(self.request(), web.JsonResponse({'x': 1}),
+                                  min_size=100)
+        self.assertFalse(response.has_header('Content-Encoding'))
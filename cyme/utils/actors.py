@@ -1,10 +1,58 @@
 from __future__ import absolute_import
 
+from functools import partial
+
 from celery.app import app_or_default
+from kombu.serialization import registry
 
 import cl
 import cl.presence
 
+from cyme import conf
+
+
+def register_msgpack():
+    """Registers the ``msgpack`` serializer using the current
+    msgpack API (``packb``/``unpackb``), decoding strings as unicode
+    and arrays as lists, like json does.
+
+    Returns :const:`False` if the msgpack library is not installed.
+
+    """
+    try:
+        import msgpack
+    except ImportError:
+        return False
+    packed = msgpack.packb([u'x'])
+    for options in ({'raw': False},
+                    {'use_list': True, 'encoding': 'utf-8'},
+                    {'encoding': 'utf-8'}, {}):
+        try:
+            msgpack.unpackb(packed, **options)
+        except TypeError:
+            continue
+        registry.register('msgpack', msgpack.packb,
+                          partial(msgpack.unpackb, **options),
+                          content_type='application/x-msgpack',
+                          content_encoding='binary')
+        return True
+    return False
+
+
+def select_serializer(name=None):
+    """Returns the serializer to use for actor messages, which is
+    ``name`` (default is ``CYME_ACTOR_SERIALIZER``) if
+    available, or json otherwise."""
+    name = name or conf.CYME_ACTOR_SERIALIZER
+    if registry._encoders.get(name, (None, None, None))[2] is None:
+        return 'json'
+    return name
+
+
+# messages may be received from branches using msgpack, so the decoder
+# must be registered even if it's not used to send messages.
+register_msgpack()
+
 
 def construct(cls, instance, connection=None, *args, **kwargs):
     app = instance.app = app_or_default(kwargs.pop('app', None))
@@ -16,6 +64,7 @@ class Actor(cl.Actor):
 
     def __init__(self, *args, **kwargs):
         construct(Actor, self, *args, **kwargs)
+        self.serializer = select_serializer()
 
 
 class Agent(cl.Agent):